@@ -0,0 +1,153 @@
+"""
+File: backend/A_api_interface/admission_control.py
+
+Admission control for LLM calls made by the API.
+
+Under a burst, letting every request straight into the model runs a local
+model out of memory, or piles up hung connections to a hosted provider, and
+every client gets slow together. Instead:
+
+- At most `max_concurrent` model calls run at once; the rest wait in a
+  priority queue (interactive questions before batch jobs).
+- The queue is bounded, and a request that would likely miss its deadline
+  (queue wait + typical call time) is shed right away with 503 + Retry-After,
+  instead of timing out after tying up a connection.
+- A queued request that is still not admitted when its deadline is near is
+  shed the same way.
+
+Only model calls are gated: the pipeline asks for a slot after the answer
+cache and local retrieval, so cached and local answers never queue.
+"""
+
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from utils.logger import logger
+
+# Lower runs first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+
+# Weight of the newest call in the moving average of call durations
+SERVICE_TIME_SMOOTHING = 0.2
+
+
+class Overloaded(Exception):
+    """
+    A request was shed; `retry_after` is the suggested wait in seconds.
+    """
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Caps concurrent model calls and queues the excess by priority, shedding
+    requests that cannot be served within the deadline.
+    """
+
+    def __init__(self, max_concurrent: int = 8, max_queue: int = 64, deadline_seconds: float = 60.0):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max_queue
+        self.deadline_seconds = deadline_seconds
+        self.active = 0
+        self.service_seconds = 0.0  # moving average of call durations (0 until measured)
+        self._queue = []  # heap of (priority, sequence, future)
+        self._sequence = itertools.count()
+        self._stats = {"admitted": 0, "queued": 0, "shed": 0}
+
+    @asynccontextmanager
+    async def slot(self, priority: int = PRIORITY_INTERACTIVE) -> AsyncIterator[None]:
+        """
+        Holds one model-call slot for the enclosed block.
+
+        Raises:
+            Overloaded: The queue is full, or the request would miss its deadline.
+        """
+        await self._acquire(priority)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.service_seconds = (
+                elapsed if not self.service_seconds
+                else (1 - SERVICE_TIME_SMOOTHING) * self.service_seconds + SERVICE_TIME_SMOOTHING * elapsed
+            )
+            self._release()
+
+    def metrics(self) -> dict:
+        return {
+            **self._stats,
+            "active": self.active,
+            "waiting": self.waiting,
+            "max_concurrent": self.max_concurrent,
+            "service_seconds": round(self.service_seconds, 3),
+        }
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for _, _, future in self._queue if not future.done())
+
+    def expected_wait(self, ahead: int) -> float:
+        """
+        Seconds until a request with `ahead` requests queued before it gets a slot.
+        """
+        return math.ceil((ahead + 1) / self.max_concurrent) * self.service_seconds
+
+    # ----- internals (all on the event loop, so no locks) -----
+
+    async def _acquire(self, priority: int):
+        if self.active < self.max_concurrent and not self.waiting:
+            self.active += 1
+            self._stats["admitted"] += 1
+            return
+
+        ahead = sum(1 for p, _, future in self._queue if p <= priority and not future.done())
+        if self.waiting >= self.max_queue:
+            self._shed(f"queue full ({self.waiting} waiting)", ahead)
+        if self.expected_wait(ahead) + self.service_seconds > self.deadline_seconds:
+            self._shed(f"expected wait {self.expected_wait(ahead):.1f}s", ahead)
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._sequence), future))
+        self._stats["queued"] += 1
+        # Give up early enough that an admitted request can still finish in time
+        budget = max(self.deadline_seconds - self.service_seconds, 0.0)
+        try:
+            await asyncio.wait_for(asyncio.shield(future), budget)
+        except asyncio.TimeoutError:
+            if not future.done():
+                future.cancel()
+                self._shed(f"not admitted within {budget:.1f}s", ahead)
+            # Otherwise the slot arrived just as the wait ran out: keep it
+        except asyncio.CancelledError:
+            # Client went away: give back a slot handed over at the same moment
+            if future.done() and not future.cancelled():
+                self._release()
+            else:
+                future.cancel()
+            raise
+        self._stats["admitted"] += 1
+
+    def _release(self):
+        # Hand the slot straight to the next live waiter, if any
+        while self._queue:
+            _, _, future = heapq.heappop(self._queue)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    def _shed(self, reason: str, ahead: int):
+        self._stats["shed"] += 1
+        retry_after = max(1, math.ceil(self.expected_wait(ahead)))
+        logger.warning(f"Shedding request: {reason}; {self.active} model calls running.")
+        raise Overloaded(f"Server busy: {reason}.", retry_after)
@@ -5,19 +5,35 @@ FastAPI endpoint for handling LLM-powered query requests.
 
 This module:
 - Receives a user's question via POST at /query.
+- Streams the answer token by token via POST at /query/stream (Server-Sent Events).
+- Answers many questions at once via POST at /query/batch (JSON Lines, in order).
+- Runs the pipeline off the event loop so one slow model call never blocks other clients.
+- Caps concurrent model calls with a priority queue (admission control); requests
+  that would miss the deadline get 503 + Retry-After. Cached and local answers skip the queue.
+- Starts accepting connections immediately; models and indexes are loaded lazily
+  and warmed in a background thread. GET /ready reports which components are loaded.
+- Exports per-stage latency histograms (Prometheus text format) at GET /metrics,
+  and returns a per-request trace id header (TRACE_HEADER) matching the log line
+  that breaks the request down by stage.
 - Applies optional environment gating (e.g., local-only in 'dev' mode).
 - Supports both local development and cloud deployment (e.g., AWS Lambda via Mangum).
 - Enforces IP-based rate limiting (1 request/hour) using `slowapi` to discourage abuse.
+  Counters live in the shared state store (STATE_BACKEND), so every uvicorn worker
+  enforces the same limits.
 - Includes CORS middleware for frontend compatibility.
 """
 
 from fastapi import FastAPI, Request
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import RedirectResponse
+from fastapi.responses import PlainTextResponse, RedirectResponse, StreamingResponse
 from pydantic import BaseModel
 
+import json
 import sys
+import time
+from contextlib import nullcontext
+from functools import partial
 from pathlib import Path
 
 # Add Rate limiting
@@ -31,9 +47,31 @@ sys.path.append(str(Path(__file__).resolve().parent.parent))
 
 # Local imports
 from utils.logger import logger
-from utils.config import ENV  
-from A_api_interface.query_schema import QueryRequest, QueryResponse
-from backend.B_prompt_model.b0_pipeline import query  
+from utils.config import (
+    ENV,
+    WARMUP_ON_STARTUP,
+    BATCH_MAX_QUESTIONS,
+    TRACE_HEADER,
+    ADMISSION_ENABLED,
+    ADMISSION_MAX_CONCURRENT,
+    ADMISSION_MAX_QUEUE,
+    ADMISSION_DEADLINE_SECONDS,
+)
+from backend.utils.lazy import component_status, start_warm_up
+from backend.utils.metrics import REQUEST_SECONDS, gauge_lines, render_metrics, start_trace, trace_summary
+from backend.D_storage_layer.shared_state import rate_limit_storage_uri
+from A_api_interface.query_schema import BatchQueryRequest, QueryRequest, QueryResponse
+from A_api_interface.admission_control import (
+    PRIORITY_BATCH,
+    PRIORITY_INTERACTIVE,
+    AdmissionController,
+    Overloaded,
+)
+from backend.B_prompt_model.b0_pipeline import aquery, aquery_batch, aquery_stream
+from backend.B_prompt_model.b0_pipeline_singleflight import singleflight
+from backend.B_prompt_model.b2_call_model import generation_worker, prefix_cache, router
+from backend.C_retrieval_logic.c03_embed_chunks import embedding_cache
+from backend.D_storage_layer.corpus_index import search_index_stats
 
 app = FastAPI()
 
@@ -47,7 +85,8 @@ app.add_middleware(
 
 # 2. Rate limiting second
 # Rate limiter: 1 request per IP per hour
-limiter = Limiter(key_func=get_remote_address)
+# Counters live in the shared state store (STATE_BACKEND), so limits hold across workers
+limiter = Limiter(key_func=get_remote_address, storage_uri=rate_limit_storage_uri())
 app.state.limiter = limiter
 
 # Exception handler for rate limits
@@ -59,6 +98,53 @@ async def rate_limit_handler(request: Request, exc: RateLimitExceeded):
         content={"detail": "Rate limit exceeded. Please try again later."}
     )
 
+# Admission control: caps concurrent model calls (None when disabled)
+admission = (
+    AdmissionController(ADMISSION_MAX_CONCURRENT, ADMISSION_MAX_QUEUE, ADMISSION_DEADLINE_SECONDS)
+    if ADMISSION_ENABLED
+    else None
+)
+
+def admit(priority: int):
+    """
+    Returns the pipeline's `admit` hook: a model-call slot at this priority.
+    """
+    return partial(admission.slot, priority) if admission else nullcontext
+
+# Exception handler for shed requests
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": f"{exc} Please try again later."},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+# Per-request trace: time every request, tag it with a trace id (taken from the
+# incoming header if the caller sent one) and log its per-stage breakdown.
+# Streaming responses are timed until their first byte.
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    trace_id = start_trace(request.headers.get(TRACE_HEADER, "")[:64] if TRACE_HEADER else None)
+    started = time.perf_counter()
+    response = await call_next(request)
+    elapsed = time.perf_counter() - started
+    route = request.scope.get("route")
+    path = route.path if route is not None else "unmatched"
+    REQUEST_SECONDS.observe(elapsed, route=path, status=response.status_code)
+    if path.startswith("/query"):
+        logger.info(f"Trace {trace_id} {path} {response.status_code} in {elapsed * 1000:.0f}ms: {trace_summary()}")
+    if TRACE_HEADER:
+        response.headers[TRACE_HEADER] = trace_id
+    return response
+
+# Warm up models and indexes in the background; the server accepts
+# connections right away and the first requests load whatever is still missing.
+@app.on_event("startup")
+async def warm_up_on_startup():
+    if WARMUP_ON_STARTUP:
+        start_warm_up()
+
 # 3. API ROUTES Next
 # MAIN POST endpoint limit to 10 per minute and 200 per day
 @app.post("/query", response_model=QueryResponse)
@@ -74,11 +160,145 @@ async def ask_question(request: Request, payload: QueryRequest):
     #     )
 
     question = payload.question
-    logger.info(f"Received query: {question}")
-    answer = query(question)
+    logger.info(f"Received query ({len(question)} chars): {question[:80]!r}")
+    answer = await aquery(question, admit(PRIORITY_INTERACTIVE))
     return QueryResponse(answer=answer)
 
 
+# Streaming endpoint: same limits, answer sent as Server-Sent Events
+# Each event's data is a JSON string holding the next piece of the answer;
+# a final "done" event marks the end of the stream.
+@app.post("/query/stream")
+@limiter.limit("10/minute;200/day")
+async def ask_question_stream(request: Request, payload: QueryRequest):
+    question = payload.question
+    logger.info(f"Received streaming query ({len(question)} chars): {question[:80]!r}")
+
+    # Wait for the first piece before responding, so a shed request still gets a 503
+    pieces = aquery_stream(question, admit(PRIORITY_INTERACTIVE))
+    first = await anext(pieces, None)
+
+    async def events():
+        if first is not None:
+            yield f"data: {json.dumps(first)}\n\n"
+            async for piece in pieces:
+                yield f"data: {json.dumps(piece)}\n\n"
+        yield "event: done\ndata: {}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+# Batch endpoint: one request answers many questions (e.g. a course FAQ)
+# Questions share one embedding call and one index search; model calls are
+# batched. Each line of the response is a JSON object
+# {"index", "question", "answer"} (or "error"), in the order of the questions.
+@app.post("/query/batch")
+@limiter.limit("10/hour")
+async def ask_questions_batch(request: Request, payload: BatchQueryRequest):
+    questions = payload.questions
+    if len(questions) > BATCH_MAX_QUESTIONS:
+        return JSONResponse(
+            status_code=413,
+            content={"detail": f"Too many questions ({len(questions)}). The limit is {BATCH_MAX_QUESTIONS}."}
+        )
+    logger.info(f"Received batch of {len(questions)} questions")
+
+    # As for streams: a batch shed before its first result gets a 503 instead of an empty body
+    results = aquery_batch(questions, admit(PRIORITY_BATCH))
+    first = await anext(results, None)
+
+    async def lines():
+        if first is not None:
+            yield json.dumps(first) + "\n"
+            async for result in results:
+                yield json.dumps(result) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+# Liveness: the process is up and serving
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+
+# Readiness: 200 once every component is loaded, 503 (with details) before that
+@app.get("/ready")
+async def ready():
+    components = component_status()
+    is_ready = all(c["loaded"] for c in components.values())
+    return JSONResponse(
+        status_code=200 if is_ready else 503,
+        content={"ready": is_ready, "components": components},
+    )
+
+
+# Local generation: worker queue depth and batch sizes, prefix cache use (404 when not in local mode)
+@app.get("/metrics/generation")
+async def generation_metrics():
+    if generation_worker is None and prefix_cache is None:
+        return JSONResponse(status_code=404, content={"detail": "Local generation is not enabled."})
+    metrics = generation_worker.metrics() if generation_worker else {}
+    if prefix_cache is not None:
+        metrics["prefix_cache"] = prefix_cache.metrics()
+    return metrics
+
+
+# Prometheus scrape target: stage and request latency histograms, plus the
+# generation worker, prefix cache, LLM router, request coalescing, admission
+# control, embedding cache, vector index size/recall and component status as gauges
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    extra = gauge_lines(
+        "rag_component_loaded", "1 when a lazily loaded component is ready.",
+        [({"component": name}, status["loaded"]) for name, status in component_status().items()],
+    )
+    if generation_worker is not None:
+        extra += gauge_lines(
+            "rag_generation_worker", "Local generation worker statistics.",
+            [({"stat": name}, value) for name, value in generation_worker.metrics().items()],
+        )
+    if prefix_cache is not None:
+        extra += gauge_lines(
+            "rag_prefix_cache", "Guidelines prefix KV cache statistics.",
+            [({"stat": name}, value) for name, value in prefix_cache.metrics().items()],
+        )
+    if admission is not None:
+        extra += gauge_lines(
+            "rag_admission", "Admission control: model-call slots, queue and shed requests.",
+            [({"stat": name}, value) for name, value in admission.metrics().items()],
+        )
+    if embedding_cache is not None and embedding_cache.loaded:
+        extra += gauge_lines(
+            "rag_embedding_cache", "Embedding cache lookups and cached vectors.",
+            [({"stat": name}, value) for name, value in embedding_cache.get().metrics().items()],
+        )
+    extra += gauge_lines(
+        "rag_vector_index", "Search index size and measured recall vs exact search.",
+        [({"stat": name}, value) for name, value in search_index_stats().items()],
+    )
+    if singleflight is not None:
+        extra += gauge_lines(
+            "rag_singleflight", "Identical in-flight questions coalesced into one answer.",
+            [({"stat": name}, value) for name, value in singleflight.metrics().items()],
+        )
+    extra += gauge_lines(
+        "rag_llm_backend", "LLM router statistics per backend.",
+        [
+            ({"backend": backend, "stat": name}, value)
+            for backend, stats in router.metrics().items()
+            for name, value in stats.items()
+        ],
+    )
+    return PlainTextResponse(render_metrics(extra), media_type="text/plain; version=0.0.4")
+
+
+# LLM router: per-backend health, rolling latency and error rate
+@app.get("/metrics/llm")
+async def llm_metrics():
+    return router.metrics()
+
+
 # 4. Redirect root to docs
 @app.get("/")
 async def root():
@@ -4,9 +4,7 @@
 # This file coordinates the full Retrieval-Augmented Generation (RAG) flow:
 #
 # Responsibilities:
-# - Load raw content files (Layer C)
-# - Chunk files into manageable pieces
-# - Embed chunks into vector representations
+# - Read precomputed chunks and embeddings from the corpus index (Layer D)
 # - Search vectors based on user input
 # - Rank retrieved chunks for relevance
 # - Build a full structured prompt (Layer B1)
@@ -14,64 +12,321 @@
 # - Return the final generated answer
 #
 # This module orchestrates all major layers (C, B1, B2) to serve user queries.
+# Async entry points (aquery, aquery_stream) run retrieval in a worker thread
+# and await the model, so the API event loop is never blocked.
+# Repeated (or near-identical) questions are answered from the answer cache,
+# and identical questions already being answered wait for that answer
+# (single-flight) instead of calling the LLM again.
+# Async callers may pass `admit`, an async context manager factory entered
+# around each model call only (the API's admission control), so cached and
+# local answers never wait for it.
 # ==========================================================
 
-from C_retrieval_logic.c01_load_files import load_markdown_files
-from C_retrieval_logic.c02_chunk_text import chunk_text
-from C_retrieval_logic.c03_embed_chunks import embed_chunks
-from C_retrieval_logic.c04_search_vectors import search_vectors
-from C_retrieval_logic.c05_rank_chunks import rank_chunks
+import asyncio
+from contextlib import nullcontext
+from typing import AsyncIterator, Callable
+
+import numpy as np
+
+from backend.C_retrieval_logic.c03_embed_chunks import embed_query, embed_texts
+from backend.C_retrieval_logic.c04_search_lexical import looks_like_command
+from backend.C_retrieval_logic.c05_rank_chunks import rank_chunks
 from backend.B_prompt_model.b1_build_prompt_wrapper import wrapper_retrieval  
-from backend.B_prompt_model.b2_call_model import call_model
+from utils.logger import logger
+from utils.config import RETRIEVAL_MODE, SINGLEFLIGHT_KEY
+from backend.utils.metrics import span
+from backend.B_prompt_model.b0_pipeline_cache import answer_cache
+from backend.B_prompt_model.b0_pipeline_singleflight import flight_key, singleflight
+from backend.B_prompt_model.b0_retrieval_context import RetrievalContext
+from backend.B_prompt_model.b2_call_model import (
+    FALLBACK_ANSWER,
+    acall_model,
+    aiter_model_batch,
+    astream_model,
+    call_model,
+    call_model_batch,
+)
 
-def query(user_input: str) -> str:
+def lookup_cache(user_input: str):
     """
-    Runs the full Retrieval-Augmented Generation (RAG) pipeline:
+    Checks the answer cache: exact tier first, then the semantic tier.
 
-    1. Attempts local retrieval first (Wrapper).
-    2. If no strong match, continues with RAG flow.
-    3. Builds a full prompt including guidelines, context, and question.
-    4. Calls the LLM to generate the answer.
+    Returns:
+        tuple[str | None, np.ndarray | None]: A cached answer (or None), and the
+        query embedding if one was computed, so retrieval can reuse it.
+    """
+    if answer_cache is None:
+        return None, None
+    with span("cache_lookup") as counts:
+        answer = answer_cache.get_exact(user_input)
+        counts["cache_hits"] = int(answer is not None)
+    if answer is not None:
+        logger.info("Exact cache hit.")
+        return answer, None
+    if RETRIEVAL_MODE == "hybrid" and looks_like_command(user_input):
+        # Short commands ("git init" vs "git push") embed too closely for the
+        # semantic tier, and hybrid retrieval may not need the embedding at all
+        return None, None
+    query_vector = embed_query(user_input)
+    with span("cache_lookup") as counts:
+        answer = answer_cache.get_similar(query_vector)
+        counts["semantic_hits"] = int(answer is not None)
+    return answer, query_vector
+
+def remember(user_input: str, answer: str, query_vector=None):
+    if answer_cache is not None and answer != FALLBACK_ANSWER:
+        answer_cache.put(user_input, answer, query_vector)
+
+def coalesced(mode: str) -> bool:
+    """
+    True when single-flight is on and keyed by `mode` ("question" or "context").
+    """
+    return singleflight is not None and SINGLEFLIGHT_KEY == mode
+
+def retrieve(user_input: str, query_vector=None) -> tuple[str | None, list[str]]:
+    """
+    Runs the retrieval half of the pipeline (no LLM call).
 
     Args:
         user_input (str): The user's question or input.
+        query_vector (np.ndarray | None): Query embedding, if already computed.
 
     Returns:
-        str: The model's generated answer based on retrieved context.
+        tuple[str | None, list[str]]: A ready local answer (or None), and the
+        ranked context chunks to send to the model when there is no local answer.
     """
+    # One embedding and one index probe, shared by both steps
+    return retrieve_context(RetrievalContext(user_input, query_vector))
+
+def retrieve_context(context: RetrievalContext) -> tuple[str | None, list[str]]:
+    """
+    Runs retrieval for one question from its (possibly pre-probed) context.
+    """
+    user_input = context.question
 
     # ==========================================================
     # STEP 1: Local Retrieval Wrapper First
     # ==========================================================
-    local_chunks = wrapper_retrieval(user_input)
+    local_chunks = wrapper_retrieval(user_input, context)
     
     if local_chunks:
         # If we got good local results, skip RAG
         return (
             f"### Local results from pro-analytics-01:\n\n"
             f"{' '.join(local_chunks)}"
-        )
+        ), []
     
 
     # ==========================================================
     # STEP 2: Full RAG Process if Local Fails
     # ==========================================================
-    # Step 2.1: Load raw content files
-    files = load_markdown_files()
+    # Step 2.1: Reuse the candidates already probed for Step 1
+    # (precomputed corpus index, fused with BM25 in hybrid mode)
+    top_chunks = context.candidates()
+
+    # Step 2.2: Re-rank the candidates and keep the best few for the prompt
+    ranked_chunks = rank_chunks(top_chunks, user_input)
+    return None, [chunk["text"] for chunk in ranked_chunks]
+
+def query(user_input: str) -> str:
+    """
+    Runs the full Retrieval-Augmented Generation (RAG) pipeline:
+
+    1. Attempts local retrieval first (Wrapper).
+    2. If no strong match, continues with RAG flow.
+    3. Builds a full prompt including guidelines, context, and question.
+    4. Calls the LLM to generate the answer.
+
+    Args:
+        user_input (str): The user's question or input.
+
+    Returns:
+        str: The model's generated answer based on retrieved context.
+    """
+
+    cached, query_vector = lookup_cache(user_input)
+    if cached is not None:
+        return cached
+    if coalesced("question"):
+        return singleflight.do(flight_key(user_input), lambda: answer_uncached(user_input, query_vector))
+    return answer_uncached(user_input, query_vector)
+
+def answer_uncached(user_input: str, query_vector=None) -> str:
+    """
+    Retrieves context and generates an answer for a question the cache missed.
+    """
+    local_answer, context_chunks = retrieve(user_input, query_vector)
+    if local_answer:
+        answer = local_answer
+    elif coalesced("context"):
+        # Requests that retrieved the same chunks share one model call
+        answer = singleflight.do(
+            flight_key(user_input, context_chunks), lambda: call_model(user_input, context_chunks)
+        )
+    else:
+        # Build prompt and call the model
+        answer = call_model(user_input, context_chunks)
 
-    # Step 2.2: Chunk files into smaller pieces
-    all_chunks = []
-    for path, text in files:
-        all_chunks.extend(chunk_text(path, text))
+    remember(user_input, answer, query_vector)
+    return answer
 
-    # Step 2.3: Embed the chunks into vector space
-    embedded_chunks = embed_chunks(all_chunks)
+async def aquery(user_input: str, admit: Callable = nullcontext) -> str:
+    """
+    Async version of query: retrieval runs in a worker thread and the model
+    call is awaited, so other requests keep being served meanwhile.
 
-    # Step 2.4: Search for vectors relevant to user query
-    top_chunks = search_vectors(user_input, embedded_chunks)
+    Args:
+        user_input (str): The user's question or input.
+        admit (Callable): Returns an async context manager held around the model call.
+    """
+    cached, query_vector = await asyncio.to_thread(lookup_cache, user_input)
+    if cached is not None:
+        return cached
+    if coalesced("question"):
+        return await singleflight.ado(
+            flight_key(user_input), lambda: aanswer_uncached(user_input, query_vector, admit)
+        )
+    return await aanswer_uncached(user_input, query_vector, admit)
+
+async def aanswer_uncached(user_input: str, query_vector=None, admit: Callable = nullcontext) -> str:
+    """
+    Async version of answer_uncached.
+    """
+    local_answer, context_chunks = await asyncio.to_thread(retrieve, user_input, query_vector)
+    if local_answer:
+        answer = local_answer
+    elif coalesced("context"):
+        answer = await singleflight.ado(
+            flight_key(user_input, context_chunks), lambda: agenerate(user_input, context_chunks, admit)
+        )
+    else:
+        answer = await agenerate(user_input, context_chunks, admit)
+    remember(user_input, answer, query_vector)
+    return answer
 
-    # Step 2.5: Rank the top chunks by relevance
-    ranked_chunks = rank_chunks(top_chunks)
+async def agenerate(user_input: str, context_chunks: list[str], admit: Callable = nullcontext) -> str:
+    """
+    Calls the model once admitted.
+    """
+    async with admit():
+        return await acall_model(user_input, context_chunks)
+
+async def aquery_stream(user_input: str, admit: Callable = nullcontext) -> AsyncIterator[str]:
+    """
+    Streams the answer as it is generated. Cached and local answers arrive as one piece.
+    The model-call slot from `admit` is held until the stream ends.
+    """
+    cached, query_vector = await asyncio.to_thread(lookup_cache, user_input)
+    if cached is not None:
+        yield cached
+        return
+
+    local_answer, context_chunks = await asyncio.to_thread(retrieve, user_input, query_vector)
+    if local_answer:
+        remember(user_input, local_answer, query_vector)
+        yield local_answer
+        return
+
+    pieces = []
+    async with admit():
+        async for piece in astream_model(user_input, context_chunks):
+            pieces.append(piece)
+            yield piece
+    remember(user_input, "".join(pieces), query_vector)
+
+# ==========================================================
+# Batch queries (e.g. pre-computing answers for a course FAQ)
+# ==========================================================
+
+def prepare_batch(questions: list[str]) -> list[tuple[str | None, list[str], np.ndarray | None]]:
+    """
+    Runs the cache and retrieval steps for many questions at once: one
+    encode call for all uncached questions, and one matrix search.
+
+    Returns:
+        list[tuple]: Per question: (ready answer or None, context chunks, query embedding).
+    """
+    prepared = [None] * len(questions)
+    pending = []
+    with span("cache_lookup") as counts:
+        for i, question in enumerate(questions):
+            answer = answer_cache.get_exact(question) if answer_cache else None
+            if answer is not None:
+                prepared[i] = (answer, [], None)
+            else:
+                pending.append(i)
+        counts["cache_hits"] = len(questions) - len(pending)
+
+    vectors = embed_texts([questions[i] for i in pending])
+    logger.info(f"Batch: {len(questions) - len(pending)} exact cache hits, {len(pending)} embedded in one call.")
+
+    to_search, rows = [], []
+    for row, (i, vector) in enumerate(zip(pending, vectors)):
+        answer = None
+        # Same guard as lookup_cache: short commands skip the semantic tier
+        if answer_cache and not (RETRIEVAL_MODE == "hybrid" and looks_like_command(questions[i])):
+            answer = answer_cache.get_similar(vector)
+        if answer is not None:
+            prepared[i] = (answer, [], vector)
+        else:
+            to_search.append(i)
+            rows.append(row)
+
+    contexts = RetrievalContext.batch([questions[i] for i in to_search], vectors[rows])
+    for i, context in zip(to_search, contexts):
+        local_answer, chunks = retrieve_context(context)
+        if local_answer:
+            remember(questions[i], local_answer, context.query_vector)
+        prepared[i] = (local_answer, chunks, context.query_vector)
+    return prepared
+
+def query_batch(questions: list[str]) -> list[str]:
+    """
+    Answers many questions: shared embedding and search, then batched LLM
+    calls (padded batches for local models, bounded concurrency for APIs).
+
+    Args:
+        questions (list[str]): The questions, in order.
+
+    Returns:
+        list[str]: One answer per question, in the same order.
+    """
+    prepared = prepare_batch(questions)
+    todo = [i for i, (answer, _, _) in enumerate(prepared) if answer is None]
+    generated = call_model_batch([questions[i] for i in todo], [prepared[i][1] for i in todo])
+
+    answers = [answer for answer, _, _ in prepared]
+    for i, answer in zip(todo, generated):
+        remember(questions[i], answer, prepared[i][2])
+        answers[i] = answer
+    return answers
+
+async def aquery_batch(questions: list[str], admit: Callable = nullcontext) -> AsyncIterator[dict]:
+    """
+    Async batch query that yields results in input order as soon as each is ready.
+    Each model call takes its own slot from `admit`. A batch shed before it
+    yields anything raises the shed error; later sheds are per-question errors.
+
+    Yields:
+        dict: {"index", "question", "answer"}, or {"index", "question", "error"} if that question failed.
+    """
+    prepared = await asyncio.to_thread(prepare_batch, questions)
+    todo = [i for i, (answer, _, _) in enumerate(prepared) if answer is None]
+    generated = aiter_model_batch([questions[i] for i in todo], [prepared[i][1] for i in todo], admit)
 
-    # Step 2.6–7: Build prompt and call the model
-    return call_model(user_input, [chunk["text"] for chunk in ranked_chunks])
+    try:
+        for i, question in enumerate(questions):
+            answer = prepared[i][0]
+            if answer is None:
+                answer = await anext(generated)
+                if isinstance(answer, Exception):
+                    if i == 0 and getattr(answer, "retry_after", None) is not None:
+                        # Shed by admission control before any output: let the API answer 503
+                        raise answer
+                    logger.error(f"Batch question {i} failed: {answer}")
+                    yield {"index": i, "question": question, "error": str(answer)}
+                    continue
+                remember(question, answer, prepared[i][2])
+            yield {"index": i, "question": question, "answer": answer}
+    finally:
+        await generated.aclose()
@@ -0,0 +1,296 @@
+# ==========================================================
+# Layer B0 - Answer Cache (b0_pipeline_cache.py)
+# ==========================================================
+# This file keeps recent answers in front of the pipeline (b0_pipeline.py),
+# so repeated questions skip retrieval and the paid LLM call.
+#
+# Two tiers:
+# - Exact: normalized question text ("How do I create a venv?" == "how do i create a venv").
+# - Semantic: cosine similarity between query embeddings above a threshold.
+#
+# Entries expire after a TTL, the least recently used entry is evicted when
+# the cache is full, and everything is dropped when the corpus index version
+# changes (e.g. after refresh_chroma.py). Optionally persisted to disk.
+#
+# With a shared state store (STATE_BACKEND = sqlite / redis), exact-tier
+# entries are also written there, so every worker answers a question that
+# any worker has already answered. Shared hits are copied into the local
+# cache, which also feeds the semantic tier.
+# ==========================================================
+
+import atexit
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from backend.D_storage_layer.corpus_index import get_corpus_version
+from backend.D_storage_layer.shared_state import StateStore, get_state_store
+from utils.logger import logger
+from utils.config import (
+    ANSWER_CACHE_ENABLED,
+    ANSWER_CACHE_MAX_ENTRIES,
+    ANSWER_CACHE_TTL_SECONDS,
+    ANSWER_CACHE_SIMILARITY,
+    ANSWER_CACHE_PATH,
+)
+
+# Minimum seconds between writes of the persisted cache file
+SAVE_INTERVAL_SECONDS = 30
+
+# Key prefix of answers in the shared state store
+SHARED_KEY_PREFIX = "answer:"
+
+
+def normalize_question(question: str) -> str:
+    """
+    Lowercases, collapses whitespace, and drops trailing punctuation.
+    """
+    text = re.sub(r"\s+", " ", question.strip().lower())
+    return text.rstrip("?!. ")
+
+
+class AnswerCache:
+    """
+    Thread-safe two-tier (exact + semantic) answer cache with TTL and LRU eviction.
+    """
+
+    def __init__(
+        self,
+        max_entries: int,
+        ttl_seconds: float,
+        similarity: float,
+        path: str = "",
+        store: StateStore | None = None,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity = similarity
+        self.path = path
+        self.store = store  # shared tier across workers (None = this process only)
+        self.version = None
+        self._entries = OrderedDict()  # key -> {"answer", "embedding", "created"}
+        self._lock = threading.Lock()
+        self._matrix = None  # normalized embeddings, rows aligned with self._keys
+        self._keys = []
+        self._last_save = 0.0
+        if path:
+            self._load()
+
+    # ----- tiers -----
+
+    def get_exact(self, question: str) -> str | None:
+        key = normalize_question(question)
+        corpus_version = get_corpus_version()
+        with self._lock:
+            self._check_version(corpus_version)
+            entry = self._live_entry(key)
+            if entry or self.store is None:
+                return entry["answer"] if entry else None
+            version = self.version
+
+        # Shared tier, read without holding the local lock
+        shared = self._shared_get(key, version)
+        if shared is None:
+            return None
+        with self._lock:
+            if self.version == version:
+                self._insert(key, shared)
+        return shared["answer"]
+
+    def get_similar(self, embedding: np.ndarray) -> str | None:
+        corpus_version = get_corpus_version()
+        with self._lock:
+            self._check_version(corpus_version)
+            # Expired entries must not hide a live match just below them
+            self._drop_expired()
+            if not self._entries or embedding is None:
+                return None
+            if self._matrix is None:
+                self._rebuild_matrix()
+            if not self._keys:
+                return None
+            query = embedding / max(float(np.linalg.norm(embedding)), 1e-12)
+            scores = self._matrix @ query
+            best = int(np.argmax(scores))
+            if scores[best] < self.similarity:
+                return None
+            entry = self._live_entry(self._keys[best])
+            if entry:
+                logger.info(f"Semantic cache hit (similarity {scores[best]:.3f}).")
+            return entry["answer"] if entry else None
+
+    def put(self, question: str, answer: str, embedding: np.ndarray | None = None):
+        key = normalize_question(question)
+        entry = {
+            "answer": answer,
+            "embedding": None if embedding is None else np.asarray(embedding, dtype=np.float32),
+            "created": time.time(),
+        }
+        corpus_version = get_corpus_version()
+        with self._lock:
+            self._check_version(corpus_version)
+            self._insert(key, entry)
+            if self.path and time.time() - self._last_save > SAVE_INTERVAL_SECONDS:
+                self._save()
+            version = self.version
+        if self.store is not None:
+            self._shared_put(key, entry, version)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+        if self.store is not None:
+            self.store.clear(SHARED_KEY_PREFIX)
+
+    def save(self):
+        with self._lock:
+            if self.path:
+                self._save()
+
+    # ----- shared tier (call without the lock; store errors only cost a cache miss) -----
+
+    def _shared_get(self, key: str, version) -> dict | None:
+        try:
+            raw = self.store.get(SHARED_KEY_PREFIX + key)
+        except Exception as e:
+            logger.warning(f"Shared answer cache unavailable: {e}")
+            return None
+        if raw is None:
+            return None
+        data = json.loads(raw)
+        # Entries written against another corpus version are stale
+        if data["version"] != version or time.time() - data["created"] > self.ttl_seconds:
+            return None
+        logger.info("Shared cache hit.")
+        return {
+            "answer": data["answer"],
+            "embedding": None if data["embedding"] is None else np.asarray(data["embedding"], dtype=np.float32),
+            "created": data["created"],
+        }
+
+    def _shared_put(self, key: str, entry: dict, version):
+        data = {
+            "version": version,
+            "answer": entry["answer"],
+            "embedding": None if entry["embedding"] is None else entry["embedding"].tolist(),
+            "created": entry["created"],
+        }
+        try:
+            self.store.set(SHARED_KEY_PREFIX + key, json.dumps(data).encode("utf-8"), ttl=self.ttl_seconds)
+        except Exception as e:
+            logger.warning(f"Could not write to the shared answer cache: {e}")
+
+    # ----- internals (call with the lock held) -----
+
+    def _insert(self, key: str, entry: dict):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        self._matrix = None
+
+    def _live_entry(self, key: str) -> dict | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.time() - entry["created"] > self.ttl_seconds:
+            del self._entries[key]
+            self._matrix = None
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _drop_expired(self):
+        cutoff = time.time() - self.ttl_seconds
+        expired = [key for key, entry in self._entries.items() if entry["created"] < cutoff]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            self._matrix = None
+
+    def _rebuild_matrix(self):
+        self._keys = [k for k, e in self._entries.items() if e["embedding"] is not None]
+        if not self._keys:
+            self._matrix = np.zeros((0, 0), dtype=np.float32)
+            return
+        matrix = np.vstack([self._entries[k]["embedding"] for k in self._keys])
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        self._matrix = matrix / np.maximum(norms, 1e-12)
+
+    def _check_version(self, version: str):
+        # The caller reads the version before taking the lock: it may build the corpus index
+        if version != self.version:
+            if self._entries:
+                logger.info("Corpus changed. Clearing answer cache.")
+            self._entries.clear()
+            self._matrix = None
+            self.version = version
+
+    def _save(self):
+        data = {
+            "version": self.version,
+            "entries": [
+                {
+                    "question": key,
+                    "answer": e["answer"],
+                    "embedding": None if e["embedding"] is None else e["embedding"].tolist(),
+                    "created": e["created"],
+                }
+                for key, e in self._entries.items()
+            ],
+        }
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(data, file)
+        os.replace(tmp_path, self.path)
+        self._last_save = time.time()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as file:
+            data = json.load(file)
+        self.version = data["version"]
+        for e in data["entries"]:
+            self._entries[e["question"]] = {
+                "answer": e["answer"],
+                "embedding": None if e["embedding"] is None else np.asarray(e["embedding"], dtype=np.float32),
+                "created": e["created"],
+            }
+        logger.info(f"Loaded {len(self._entries)} cached answers from {self.path}")
+
+
+# Shared cache instance used by the pipeline (None when disabled)
+answer_cache = (
+    AnswerCache(
+        ANSWER_CACHE_MAX_ENTRIES,
+        ANSWER_CACHE_TTL_SECONDS,
+        ANSWER_CACHE_SIMILARITY,
+        ANSWER_CACHE_PATH,
+        store=get_state_store(),
+    )
+    if ANSWER_CACHE_ENABLED
+    else None
+)
+
+
+def clear_answer_cache(path: str = ANSWER_CACHE_PATH):
+    """
+    Drops all cached answers (including the shared store's) and deletes the
+    persisted cache file (called when the corpus is refreshed). Running servers also drop their
+    in-memory entries when the corpus version changes.
+    """
+    if answer_cache:
+        answer_cache.clear()
+    if path and os.path.exists(path):
+        os.remove(path)
+        logger.info(f"Removed persisted answer cache {path}")
+
+if answer_cache and ANSWER_CACHE_PATH:
+    atexit.register(answer_cache.save)
@@ -0,0 +1,163 @@
+# ==========================================================
+# Layer B0 - Request Coalescing (b0_pipeline_singleflight.py)
+# ==========================================================
+# When a class starts an assignment, many students ask the same question
+# within seconds, before the first answer reaches the answer cache.
+#
+# Single-flight: the first request for a key (the "leader") computes the
+# answer; identical requests arriving while it runs wait for that result
+# instead of starting their own retrieval and LLM call.
+#
+# - Keys: the normalized question, or the question plus the retrieved
+#   chunks (SINGLEFLIGHT_KEY = "context"), so only requests that would
+#   send the same prompt share an LLM call.
+# - Bounded: at most `max_waiters` requests wait on one key; extra ones
+#   compute on their own.
+# - Timeout: a waiter gives up after `timeout_seconds` and computes on its own.
+# - Nothing is kept after the leader finishes (no staleness); errors are
+#   shared with the waiters like answers. If the leader is cancelled (its
+#   client disconnected), its waiters compute on their own.
+#
+# Sync (threads) and async (event loop) callers share the same in-flight
+# table, so a CLI thread and an API request can coalesce too.
+# ==========================================================
+
+import asyncio
+import hashlib
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from typing import Awaitable, Callable
+
+from backend.B_prompt_model.b0_pipeline_cache import normalize_question
+from utils.logger import logger
+from utils.config import SINGLEFLIGHT_ENABLED, SINGLEFLIGHT_MAX_WAITERS, SINGLEFLIGHT_TIMEOUT_SECONDS
+
+
+def flight_key(question: str, chunks: list[str] | None = None) -> str:
+    """
+    Key for coalescing: the normalized question, plus a hash of the
+    retrieved chunks when they are given.
+    """
+    key = normalize_question(question)
+    if chunks is None:
+        return key
+    digest = hashlib.sha1("\x00".join(chunks).encode("utf-8")).hexdigest()
+    return f"{key}|{digest}"
+
+
+class _LeaderCancelled(Exception):
+    pass
+
+
+class _Flight:
+    def __init__(self):
+        self.future = Future()
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Runs one computation per key at a time and shares its result with
+    identical concurrent requests.
+    """
+
+    def __init__(self, max_waiters: int = 100, timeout_seconds: float = 90.0):
+        self.max_waiters = max_waiters
+        self.timeout_seconds = timeout_seconds
+        self._flights = {}  # key -> _Flight
+        self._lock = threading.Lock()
+        self._stats = {"leaders": 0, "coalesced": 0, "overflow": 0, "timeouts": 0}
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {**self._stats, "in_flight": len(self._flights)}
+
+    def do(self, key: str, fn: Callable[[], str]) -> str:
+        """
+        Returns fn() for this key, or the result of an identical call already in flight.
+        """
+        flight, leader = self._join(key)
+        if flight is None:
+            return fn()
+        if not leader:
+            try:
+                return flight.future.result(timeout=self.timeout_seconds)
+            except FutureTimeout:
+                self._timed_out()
+                return fn()
+            except _LeaderCancelled:
+                return fn()
+        try:
+            result = fn()
+        except BaseException as e:
+            self._finish(key, flight, error=e)
+            raise
+        self._finish(key, flight, result=result)
+        return result
+
+    async def ado(self, key: str, fn: Callable[[], Awaitable[str]]) -> str:
+        """
+        Async version of `do`: waiters await the leader without blocking the event loop.
+        """
+        flight, leader = self._join(key)
+        if flight is None:
+            return await fn()
+        if not leader:
+            try:
+                # shield: a cancelled waiter must not cancel the shared result
+                return await asyncio.wait_for(
+                    asyncio.shield(asyncio.wrap_future(flight.future)), self.timeout_seconds
+                )
+            except asyncio.TimeoutError:
+                self._timed_out()
+                return await fn()
+            except _LeaderCancelled:
+                return await fn()
+        try:
+            result = await fn()
+        except BaseException as e:
+            self._finish(key, flight, error=e)
+            raise
+        self._finish(key, flight, result=result)
+        return result
+
+    # ----- internals -----
+
+    def _join(self, key: str) -> tuple[_Flight | None, bool]:
+        # Returns (flight, is_leader); (None, False) when too many are already waiting
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+                self._stats["leaders"] += 1
+                return flight, True
+            if flight.waiters >= self.max_waiters:
+                self._stats["overflow"] += 1
+                return None, False
+            flight.waiters += 1
+            self._stats["coalesced"] += 1
+            return flight, False
+
+    def _finish(self, key: str, flight: _Flight, result: str | None = None, error: BaseException | None = None):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        if flight.waiters:
+            logger.info(f"Coalesced {flight.waiters} identical in-flight request(s).")
+        if error is not None:
+            if not isinstance(error, Exception):
+                error = _LeaderCancelled()
+            flight.future.set_exception(error)
+        else:
+            flight.future.set_result(result)
+
+    def _timed_out(self):
+        with self._lock:
+            self._stats["timeouts"] += 1
+        logger.warning(f"Waited {self.timeout_seconds:.0f}s on an identical request; answering separately.")
+
+
+# Shared in-flight table used by the pipeline (None when disabled)
+singleflight = (
+    SingleFlight(SINGLEFLIGHT_MAX_WAITERS, SINGLEFLIGHT_TIMEOUT_SECONDS) if SINGLEFLIGHT_ENABLED else None
+)
@@ -0,0 +1,139 @@
+# ==========================================================
+# Layer B0 - Retrieval Context (b0_retrieval_context.py)
+# ==========================================================
+# One RetrievalContext is created per question by the pipeline (b0_pipeline.py).
+#
+# It holds the query embedding and the candidate chunks (with scores) from a
+# single probe of the corpus index, and is shared by:
+# - the local-confidence path (wrapper_retrieval -> query_chunks), and
+# - the full RAG path (re-ranking and prompt building).
+#
+# So each question costs at most one embedding and one index probe, and all
+# of its rows come from one corpus snapshot (never from two versions).
+# For batches (RetrievalContext.batch), all questions share one encode call
+# and one matrix search.
+# ==========================================================
+
+import numpy as np
+
+from backend.C_retrieval_logic.c03_embed_chunks import embed_query, embed_texts
+from backend.C_retrieval_logic.c04_search_lexical import contains_phrase
+from backend.C_retrieval_logic.c04_search_vectors import search_batch, search_hybrid, search_vectors
+from backend.D_storage_layer.corpus_index import load_snapshot
+from utils.config import HYBRID_CANDIDATES, RERANK_CANDIDATES, RERANK_ENABLED, RETRIEVAL_MODE
+
+
+class RetrievalContext:
+    """
+    Per-request retrieval state: the question, its embedding (computed at most
+    once, lazily) and the candidate chunks from one probe of the corpus index.
+    """
+
+    def __init__(self, question: str, query_vector: np.ndarray | None = None, top_k: int | None = None):
+        self.question = question
+        self.query_vector = query_vector
+        self.top_k = top_k or (RERANK_CANDIDATES if RERANK_ENABLED else 3)
+        self._candidates = None
+        self._snapshot = None
+
+    @property
+    def snapshot(self):
+        # Taken once, so a corpus refresh mid-request cannot mix versions
+        if self._snapshot is None:
+            self._snapshot = load_snapshot()
+        return self._snapshot
+
+    @classmethod
+    def batch(cls, questions: list[str], query_vectors: np.ndarray | None = None) -> list["RetrievalContext"]:
+        """
+        Creates contexts for many questions with one encode call and one matrix search.
+
+        Args:
+            questions (list[str]): The questions, in order.
+            query_vectors (np.ndarray | None): Their embeddings, if already computed (one row each).
+
+        Returns:
+            list[RetrievalContext]: One context per question, candidates already filled in.
+        """
+        if query_vectors is None:
+            query_vectors = embed_texts(questions)
+        contexts = [cls(question, vector) for question, vector in zip(questions, query_vectors)]
+        if not contexts:
+            return contexts
+
+        snapshot = load_snapshot()
+        indexed_chunks = snapshot.chunks
+        top_k = contexts[0].top_k
+        probe_k = top_k * HYBRID_CANDIDATES if RETRIEVAL_MODE == "hybrid" else top_k
+        hits = search_batch(snapshot.search_index, query_vectors, probe_k)
+
+        for context, (rows, scores) in zip(contexts, hits):
+            context._snapshot = snapshot
+            if RETRIEVAL_MODE == "hybrid":
+                context._candidates = search_hybrid(
+                    context.question, indexed_chunks, None, snapshot.lexical_index,
+                    top_k=top_k, query_vector=context.query_vector, vector_rows=rows
+                )
+            else:
+                context._candidates = [
+                    {**indexed_chunks[row], "row": int(row), "score": float(score)}
+                    for row, score in zip(rows, scores)
+                ]
+        return contexts
+
+    def embedding(self, _question: str | None = None) -> np.ndarray:
+        if self.query_vector is None:
+            self.query_vector = embed_query(self.question)
+        return self.query_vector
+
+    def candidates(self) -> list[dict]:
+        """
+        Returns the candidate chunks (best first, with "row" and "score"),
+        probing the index selected by VECTOR_DB / RETRIEVAL_MODE on first call.
+        """
+        if self._candidates is None:
+            snapshot = self.snapshot
+            indexed_chunks = snapshot.chunks
+            if RETRIEVAL_MODE == "hybrid":
+                self._candidates = search_hybrid(
+                    self.question, indexed_chunks, snapshot.search_index, snapshot.lexical_index,
+                    top_k=self.top_k, query_vector=self.query_vector, embed_fn=self.embedding
+                )
+            else:
+                self._candidates = search_vectors(
+                    self.question, indexed_chunks, top_k=self.top_k,
+                    index=snapshot.search_index, query_vector=self.query_vector, embed_fn=self.embedding
+                )
+        return self._candidates
+
+    def local_matches(self, top_k: int, max_distance: float, source: str = "pro-analytics-01") -> list[str]:
+        """
+        Returns the texts of confident candidates from `source` documents.
+
+        Confidence uses the same rule as the Chroma query in query_chunks:
+        squared L2 distance between unit vectors (2 - 2 * cosine) at most
+        `max_distance`. When the candidates came from an exact command match
+        (no embedding was needed), chunks containing the command count as confident.
+
+        Args:
+            top_k (int): Maximum number of candidates to consider.
+            max_distance (float): Confidence threshold (e.g. chroma_store.CONFIDENCE_THRESHOLD).
+            source (str): Only chunks whose source contains this are eligible.
+
+        Returns:
+            list[str]: Confident chunk texts, best first.
+        """
+        candidates = [c for c in self.candidates() if source in c["source"].lower()][:top_k]
+        if self.query_vector is None:
+            return [c["text"] for c in candidates if contains_phrase(c["text"], self.question)]
+
+        embeddings = self.snapshot.embeddings
+        query = np.asarray(self.query_vector, dtype=np.float32)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        matches = []
+        for chunk in candidates:
+            vector = np.asarray(embeddings[chunk["row"]], dtype=np.float32)
+            cosine = float(vector @ query) / max(float(np.linalg.norm(vector)), 1e-12)
+            if 2.0 - 2.0 * cosine <= max_distance:
+                matches.append(chunk["text"])
+        return matches
@@ -5,31 +5,184 @@
 # 
 # Responsibilities:
 # - Load assistant behavior guidelines (static system message).
-# - Join retrieved context chunks into a usable reference section.
-# - Safely truncate the context if necessary to stay within model limits.
+# - Pack retrieved context chunks into a usable reference section:
+#   whole chunks in ranked order, near-duplicates dropped, within a token
+#   budget counted with the real tokenizer of the configured model.
 # - Format everything into a complete Retrieval-Augmented Generation (RAG) prompt.
 # 
 # This ensures the model receives a well-structured, professional, and
 # behavior-controlled input for every user query.
 # ==========================================================
 
-from typing import List
+import re
+from functools import lru_cache
+from typing import Callable, List
 from pathlib import Path
 
-# Maximum context size (in characters, not tokens)
-MAX_CONTEXT_LENGTH = 3000
+from utils.logger import logger
+from utils.config import CONTEXT_MAX_TOKENS, LLM_CONTEXT_WINDOW, OPENAI_MODEL, LOCAL_QUANT_MODE
+
+# Context windows (in tokens) of known models, matched on the name without a
+# provider prefix ("openai/gpt-4o-mini") and by longest prefix ("gpt-4o-2024-08-06");
+# others use LLM_CONTEXT_WINDOW or DEFAULT_CONTEXT_WINDOW
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-3.5-turbo": 16385,
+    "gpt-4": 8192,
+    "gpt-4-turbo": 128000,
+    "gpt-4o": 128000,
+    "gpt-4o-mini": 128000,
+}
+DEFAULT_CONTEXT_WINDOW = 2048  # e.g. TinyLlama, the default local model
+
+# Tokens kept free for the generated answer (matches b2 MAX_NEW_TOKENS)
+ANSWER_RESERVE_TOKENS = 512
+
+# Chunks sharing at least this fraction of word trigrams count as duplicates
+NEAR_DUPLICATE_SIMILARITY = 0.9
 
 # Path to the assistant behavior guidelines
 GUIDELINES_PATH = Path("backend/D_storage_layer/raw_docs/GUIDELINES.md")
 
-# Load guidelines once when this module is first imported
-if GUIDELINES_PATH.exists():
-    GUIDELINES_TEXT = GUIDELINES_PATH.read_text(encoding="utf-8").strip()
-else:
-    GUIDELINES_TEXT = (
-        "You are a helpful assistant who only answers questions "
-        "based on the provided context."
+# Used when GUIDELINES.md is missing
+DEFAULT_GUIDELINES = (
+    "You are a helpful assistant who only answers questions "
+    "based on the provided context."
+)
+
+# Guidelines text and the file modification time it was read at
+_guidelines = {"mtime": None, "text": DEFAULT_GUIDELINES}
+
+def get_guidelines() -> str:
+    """
+    Returns the guidelines text, re-reading GUIDELINES.md only when the file has
+    changed, so edits take effect without restarting the server.
+    """
+    mtime = GUIDELINES_PATH.stat().st_mtime_ns if GUIDELINES_PATH.exists() else None
+    if mtime != _guidelines["mtime"]:
+        text = GUIDELINES_PATH.read_text(encoding="utf-8").strip() if mtime else DEFAULT_GUIDELINES
+        if _guidelines["mtime"] is not None:
+            logger.info("GUIDELINES.md changed. Reloaded assistant guidelines.")
+        _guidelines.update(mtime=mtime, text=text)
+    return _guidelines["text"]
+
+# Loaded once at import; get_guidelines() picks up later edits
+GUIDELINES_TEXT = get_guidelines()
+
+@lru_cache(maxsize=1)
+def get_token_counter() -> Callable[[str], int]:
+    """
+    Returns a function counting tokens with the configured model's tokenizer:
+    the local HF tokenizer (8bit/4bit), tiktoken for hosted models, or an
+    estimate of 4 characters per token when neither is available.
+    """
+    if LOCAL_QUANT_MODE != "none":
+        from backend.B_prompt_model.b2_call_model import llm
+
+        tokenizer = llm.get()["tokenizer"]
+        return lambda text: len(tokenizer.encode(text, add_special_tokens=False))
+    try:
+        import tiktoken
+
+        try:
+            encoding = tiktoken.encoding_for_model(OPENAI_MODEL)
+        except KeyError:  # e.g. OpenRouter model names
+            encoding = tiktoken.get_encoding("cl100k_base")
+        return lambda text: len(encoding.encode(text, disallowed_special=()))
+    except ImportError:
+        logger.warning("tiktoken is not installed; estimating 4 characters per token.")
+        return lambda text: len(text) // 4 + 1
+
+def count_tokens(text: str) -> int:
+    return get_token_counter()(text)
+
+@lru_cache(maxsize=4)
+def _text_tokens(text: str) -> int:
+    return count_tokens(text)
+
+def guidelines_tokens() -> int:
+    # The guidelines are sent with every prompt; tokenize each version once
+    return _text_tokens(get_guidelines())
+
+@lru_cache(maxsize=8)
+def context_window(model_name: str) -> int:
+    """
+    Returns the context window of a hosted model (see MODEL_CONTEXT_WINDOWS),
+    warning once per model when it is unknown.
+    """
+    if LLM_CONTEXT_WINDOW > 0:
+        return LLM_CONTEXT_WINDOW
+    # "openai/gpt-4o-mini:free" -> "gpt-4o-mini"
+    name = model_name.rsplit("/", 1)[-1].split(":", 1)[0].lower()
+    known = [key for key in MODEL_CONTEXT_WINDOWS if name == key or name.startswith(key + "-")]
+    if known:
+        return MODEL_CONTEXT_WINDOWS[max(known, key=len)]
+    logger.warning(
+        f"Unknown context window for {model_name}; assuming {DEFAULT_CONTEXT_WINDOW} tokens. "
+        "Set LLM_CONTEXT_WINDOW to use more of it."
     )
+    return DEFAULT_CONTEXT_WINDOW
+
+def context_budget(question: str) -> int:
+    """
+    Returns the tokens available for context: CONTEXT_MAX_TOKENS, capped by
+    what the model's context window leaves after guidelines, question and answer.
+    """
+    # With a local backend configured, prompts must fit its (smaller) window
+    window = context_window(OPENAI_MODEL) if LOCAL_QUANT_MODE == "none" else DEFAULT_CONTEXT_WINDOW
+    room = window - ANSWER_RESERVE_TOKENS - guidelines_tokens() - count_tokens(question) - 32
+    return max(0, min(CONTEXT_MAX_TOKENS, room))
+
+def _shingles(text: str) -> set:
+    words = re.findall(r"\w+", text.lower())
+    return {tuple(words[i:i + 3]) for i in range(max(1, len(words) - 2))}
+
+def _truncate(text: str, budget: int) -> str:
+    # Longest prefix of whole words that fits the budget
+    words = text.split(" ")
+    low, high = 0, len(words)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if count_tokens(" ".join(words[:mid])) <= budget:
+            low = mid
+        else:
+            high = mid - 1
+    return " ".join(words[:low])
+
+def pack_context(chunks: List[str], budget: int) -> List[str]:
+    """
+    Greedily packs whole chunks, in ranked order, into a token budget.
+
+    Near-identical chunks are kept once. A chunk that does not fit is skipped
+    (later, smaller chunks may still fit). Only if not even the top chunk
+    fits is it cut, at a word boundary.
+
+    Args:
+        chunks (List[str]): Context chunks, best first.
+        budget (int): Maximum tokens for the joined context.
+
+    Returns:
+        List[str]: The chunks to send, best first.
+    """
+    packed, seen, used = [], [], 0
+    for chunk in chunks:
+        text = chunk.strip()
+        if not text:
+            continue
+        shingles = _shingles(text)
+        if any(len(shingles & other) >= NEAR_DUPLICATE_SIMILARITY * len(shingles | other) for other in seen):
+            continue
+        tokens = count_tokens(text) + 2  # + the "\n\n" separator
+        if used + tokens > budget:
+            continue
+        packed.append(text)
+        seen.append(shingles)
+        used += tokens
+
+    if not packed and chunks and budget > 0:
+        packed = [_truncate(chunks[0].strip(), budget)]
+
+    logger.info(f"Packed {len(packed)} of {len(chunks)} chunks into {used} of {budget} context tokens.")
+    return packed
 
 def build_prompt(question: str, chunks: List[str]) -> str:
     """
@@ -40,21 +193,17 @@ def build_prompt(question: str, chunks: List[str]) -> str:
 
     Args:
         question (str): The user's input question.
-        chunks (List[str]): List of relevant text chunks retrieved from the knowledge base.
+        chunks (List[str]): Relevant text chunks retrieved from the knowledge base, best first.
 
     Returns:
         str: A full, structured prompt ready to send to the LLM.
     """
-    # Join all context chunks together, separated by double newlines
-    context = "\n\n".join(chunks)
-
-    # Truncate the context if necessary
-    if len(context) > MAX_CONTEXT_LENGTH:
-        context = context[:MAX_CONTEXT_LENGTH]
+    # Pack whole chunks into the token budget, separated by double newlines
+    context = "\n\n".join(pack_context(chunks, context_budget(question)))
 
     # Build the final formatted prompt
     prompt = (
-        f"{GUIDELINES_TEXT}\n\n"
+        f"{get_guidelines()}\n\n"
         f"Context:\n{context}\n\n"
         f"Question:\n{question}\n\n"
         "Answer:"
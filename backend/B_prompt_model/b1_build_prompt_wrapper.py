@@ -5,17 +5,30 @@
 # This file handles local retrieval logic using `chroma_store`.
 # If local results are sufficient, it returns them directly.
 # If not, it signals to proceed with the full RAG process.
+# It reuses the per-request RetrievalContext, so it adds no extra embedding or probe.
 # ==========================================================
 
 from backend.D_storage_layer.chroma_store import query_chunks
+from backend.D_storage_layer.corpus_index import get_corpus_version
 from utils.logger import logger
 
-def wrapper_retrieval(user_input: str) -> list[str]:
+# Results for fixed rewritten queries, per corpus version (they never change in between)
+_rewrite_cache = {}
+
+def query_rewrite(rewritten: str, top_k: int) -> list[str]:
+    key = (get_corpus_version(), rewritten, top_k)
+    if key not in _rewrite_cache:
+        _rewrite_cache.clear()  # Drop results of older corpus versions
+        _rewrite_cache[key] = query_chunks(rewritten, top_k=top_k)
+    return _rewrite_cache[key]
+
+def wrapper_retrieval(user_input: str, context=None) -> list[str]:
     """
     Attempts local retrieval using ChromaDB before RAG processing.
 
     Args:
         user_input (str): The user's question or query.
+        context (RetrievalContext | None): Per-request retrieval state shared with the RAG path.
 
     Returns:
         list[str]: Retrieved context chunks if confidence is high, empty list otherwise.
@@ -28,7 +41,7 @@ def wrapper_retrieval(user_input: str) -> list[str]:
         logger.info(f"Detected project initialization query: {user_input}")
         
         # Perform a more focused search in ChromaDB
-        local_chunks = query_chunks("project initialization", top_k=5)
+        local_chunks = query_rewrite("project initialization", top_k=5)
 
         # Step 2: Inject the response with both options
         response = (
@@ -56,4 +69,4 @@ def wrapper_retrieval(user_input: str) -> list[str]:
             return [response]
 
     # If it is not a project setup, just query ChromaDB normally
-    return query_chunks(user_input)
+    return query_chunks(user_input, context=context)
@@ -8,10 +8,24 @@
 #   - "none"  then use external APIs like OpenAI or OpenRouter.
 #   - "8bit"  then load a local 8-bit quantized model using bitsandbytes.
 #   - "4bit"  then load a local 4-bit quantized model using AutoGPTQ.
+#   - LLM_BACKENDS may list several of these at once; a router sends each
+#     prompt to the fastest healthy one and fails over (b2_router.py).
 # - Accepting prompts built from retrieved knowledge and user questions.
+# - Hosted APIs are called through a pooled, retrying (optionally hedged)
+#   HTTP client (b2_provider_client.py).
 # - Sending prompts to the LLM and returning generated answers.
+# - Async and token-streaming variants for the API layer, so the event loop
+#   is never blocked by a model call.
+# - Batch variants for many questions at once (padded batched `generate` for
+#   local models, bounded concurrency for hosted APIs).
+# - Local models answer through a background worker that batches concurrent
+#   requests together (b2_generation_worker.py).
+# - Local models reuse the cached key/values of the shared GUIDELINES.md
+#   prompt prefix instead of re-encoding it for every prompt (b2_prefix_cache.py).
 #
 # This module supports both API-based and fully local deployments.
+# The model (or API client) is loaded lazily on first use, so importing this
+# module is cheap and a missing optional package does not stop the app.
 #
 # In this RAG system:
 # - Retrieved documents (Layer C) + user questions form the prompt (Layer B1).
@@ -20,45 +34,97 @@
 
 # ==========================================================
 
+import asyncio
+from contextlib import nullcontext
+from threading import Thread
+from typing import AsyncIterator, Callable, Iterator
+
 from dotenv import load_dotenv
 from utils.logger import logger
-from backend.B_prompt_model.b1_build_prompt import build_prompt
+from backend.B_prompt_model.b1_build_prompt import build_prompt, count_tokens, get_guidelines
+from backend.B_prompt_model.b2_generation_worker import GenerationWorker
+from backend.B_prompt_model.b2_prefix_cache import PrefixKVCache
+from backend.B_prompt_model.b2_provider_client import ProviderClient
+from backend.B_prompt_model.b2_router import Backend, LLMRouter, LocalBackend, ProviderBackend
+from backend.utils.lazy import lazy_component
+from backend.utils.metrics import span
 from utils.config import (
     LLM_PROVIDER,
     OPENAI_API_KEY,
     OPENROUTER_API_KEY,
     OPENAI_MODEL,
     MODEL_NAME,
-    QUANT_MODE  # "none", "8bit", or "4bit"
+    LLM_BACKENDS,  # e.g. ["openrouter", "openai", "4bit"]
+    LOCAL_QUANT_MODE,  # "none", "8bit", or "4bit"
+    BATCH_LLM_CONCURRENCY,
+    LOCAL_BATCH_SIZE,
+    GENERATION_BATCHING,
+    GENERATION_MAX_WAIT_MS,
+    PREFIX_CACHE_ENABLED,
+    LLM_BASE_URL,
+    LLM_TIMEOUT_SECONDS,
+    LLM_CONNECT_TIMEOUT_SECONDS,
+    LLM_MAX_RETRIES,
+    LLM_BACKOFF_SECONDS,
+    LLM_MAX_CONNECTIONS,
+    LLM_KEEPALIVE_SECONDS,
+    LLM_HEDGE_ENABLED,
+    LLM_HEDGE_MIN_SAMPLES,
+    LLM_ROUTER_TIMEOUT_SECONDS,
+    LLM_ROUTER_ERROR_THRESHOLD,
+    LLM_ROUTER_COOLDOWN_SECONDS,
+    LLM_ROUTER_WINDOW,
 )
 import os
 
 # Load environment variables
 load_dotenv()
 
-# Initialize model/client globals
-client = None
-model = None
-tokenizer = None
+# Answer returned when retrieval found nothing to ground the model on
+FALLBACK_ANSWER = (
+    "Sorry, I can't help with that.\n"
+    "My knowledge is focused on helping you set up professional Python projects "
+    "the recommended way."
+)
+
+# Maximum tokens generated by local models
+MAX_NEW_TOKENS = 512
+
+# Hosted providers that can appear in LLM_BACKENDS
+HOSTED_PROVIDERS = ("openrouter", "openai")
+
+# Only a local model is configured: batch requests use padded local batches directly
+LOCAL_ONLY = LLM_BACKENDS == [LOCAL_QUANT_MODE]
 
 # ==========================================================
 # Model Loaders
 # ==========================================================
 
-def load_none_model():
-    from openai import OpenAI
+def provider_settings(provider: str = LLM_PROVIDER) -> dict:
+    # LLM_BASE_URL overrides the provider's endpoint (e.g. a local mock server)
+    if provider == "openrouter":
+        return {"api_key": OPENROUTER_API_KEY, "base_url": LLM_BASE_URL or "https://openrouter.ai/api/v1"}
+    if provider == "openai":
+        return {"api_key": OPENAI_API_KEY, "base_url": LLM_BASE_URL or "https://api.openai.com/v1"}
+    raise ValueError(f"Unsupported LLM_PROVIDER: {provider}")
 
-    if LLM_PROVIDER == "openrouter":
-        client = OpenAI(
-            api_key=OPENROUTER_API_KEY,
-            base_url="https://openrouter.ai/api/v1"
-        )
+def load_none_model(provider: str = LLM_PROVIDER):
+    client = ProviderClient(
+        **provider_settings(provider),
+        model=OPENAI_MODEL,
+        timeout=LLM_TIMEOUT_SECONDS,
+        connect_timeout=LLM_CONNECT_TIMEOUT_SECONDS,
+        max_retries=LLM_MAX_RETRIES,
+        backoff_seconds=LLM_BACKOFF_SECONDS,
+        max_connections=LLM_MAX_CONNECTIONS,
+        keepalive_seconds=LLM_KEEPALIVE_SECONDS,
+        hedge=LLM_HEDGE_ENABLED,
+        hedge_min_samples=LLM_HEDGE_MIN_SAMPLES,
+    )
+    if provider == "openrouter":
         logger.info("Using OpenRouter (free) as LLM provider.")
-    elif LLM_PROVIDER == "openai":
-        client = OpenAI(api_key=OPENAI_API_KEY)
-        logger.info("Using OpenAI (paid) as LLM provider.")
     else:
-        raise ValueError(f"Unsupported LLM_PROVIDER: {LLM_PROVIDER}")
+        logger.info("Using OpenAI (paid) as LLM provider.")
 
     return client, None, None
 
@@ -89,23 +155,61 @@ def load_4bit_model():
     return None, model, tokenizer
 
 # ==========================================================
-# Load the correct model
+# Load the correct model (lazily, once)
 # ==========================================================
 
-if QUANT_MODE == "none":
-    client, model, tokenizer = load_none_model()
-elif QUANT_MODE == "8bit":
-    client, model, tokenizer = load_8bit_model()
-elif QUANT_MODE == "4bit":
-    client, model, tokenizer = load_4bit_model()
-else:
-    raise ValueError(f"Unsupported QUANT_MODE: {QUANT_MODE}")
+def load_model() -> dict:
+    """
+    Loads the local model selected by LOCAL_QUANT_MODE.
+
+    Returns:
+        dict: "model" and "tokenizer".
+    """
+    if LOCAL_QUANT_MODE == "8bit":
+        _, model, tokenizer = load_8bit_model()
+    elif LOCAL_QUANT_MODE == "4bit":
+        _, model, tokenizer = load_4bit_model()
+    else:
+        raise ValueError(f"Unsupported local model mode: {LOCAL_QUANT_MODE}")
+    # Set once here, so batched, streamed and prefix-cached calls all tokenize the same way
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    # Decoder-only models continue from the last token, so pad on the left
+    tokenizer.padding_side = "left"
+    return {"model": model, "tokenizer": tokenizer}
+
+# The local model (None when no local backend is configured)
+llm = lazy_component("llm", load_model) if LOCAL_QUANT_MODE != "none" else None
+
+# One pooled client per configured hosted provider
+provider_clients = {
+    name: lazy_component(f"{name}_client", lambda name=name: load_none_model(name)[0])
+    for name in LLM_BACKENDS
+    if name in HOSTED_PROVIDERS
+}
 
 
 # ==========================================================
 # Main Call Function
 # ==========================================================
 
+def prepare_prompt(question: str, chunks: list[str]) -> str | None:
+    """
+    Builds and logs the prompt, or returns None when there is no context to use.
+    """
+    if not chunks:
+        logger.warning("No relevant content found. Returning fallback message.")
+        return None
+
+    logger.info(f"Using {len(chunks)} chunks for prompt context.")
+    with span("build_prompt", chunks=len(chunks)) as counts:
+        prompt = build_prompt(question, chunks)
+        counts["prompt_tokens"] = count_tokens(prompt)
+
+    logger.info(f"Prompt length: {len(prompt)} characters ({counts['prompt_tokens']} tokens)")
+    logger.debug(f"Prompt sent to model:\n{prompt}")
+    return prompt
+
 def call_model(question: str, chunks: list[str]) -> str:
     """
     Builds a full Retrieval-Augmented Generation (RAG) prompt by combining assistant guidelines,
@@ -119,36 +223,244 @@ def call_model(question: str, chunks: list[str]) -> str:
     Returns:
         str: The model's generated answer based on the combined prompt.
     """
+    prompt = prepare_prompt(question, chunks)
+    if prompt is None:
+        return FALLBACK_ANSWER
 
-    if not chunks:
-        logger.warning("No relevant content found. Returning fallback message.")
-        return (
-            "Sorry, I can't help with that.\n"
-            "My knowledge is focused on helping you set up professional Python projects "
-            "the recommended way."
-        )
+    # The router picks a hosted API or the local model (batched with concurrent requests)
+    with span("call_model"):
+        answer = router.complete(prompt)
+    logger.info("Received response from model.")
+    return answer
 
-    logger.info(f"Using {len(chunks)} chunks for prompt context.")
-    prompt = build_prompt(question, chunks)
+async def acall_model(question: str, chunks: list[str]) -> str:
+    """
+    Async version of call_model for the API layer.
 
-    estimated_tokens = len(prompt) // 4
-    logger.info(f"Prompt length: {len(prompt)} characters (~{estimated_tokens} tokens)")
-    logger.debug(f"Prompt sent to model:\n{prompt}")
+    Hosted providers are awaited with the async provider client; local models
+    run in a worker thread so the event loop keeps serving other requests.
+    """
+    prompt = prepare_prompt(question, chunks)
+    if prompt is None:
+        return FALLBACK_ANSWER
+
+    with span("call_model"):
+        answer = await router.acomplete(prompt)
+    logger.info("Received response from model.")
+    return answer
+
+# Cached key/values of the guidelines prefix (None for hosted APIs or if disabled)
+prefix_cache = PrefixKVCache() if LOCAL_QUANT_MODE != "none" and PREFIX_CACHE_ENABLED else None
+
+def local_inputs(prompts: list[str], model, tokenizer) -> dict:
+    """
+    Tokenizes prompts for `generate`, reusing the cached guidelines prefix when possible.
+    """
+    if prefix_cache is not None:
+        inputs = prefix_cache.generate_inputs(model, tokenizer, get_guidelines(), prompts)
+        if inputs is not None:
+            return inputs
+    return dict(tokenizer(prompts, return_tensors="pt", padding=True).to(model.device))
+
+def generate_local_batch(prompts: list[str]) -> list[str]:
+    """
+    Generates answers for several prompts with padded, batched `generate`
+    calls on the local model (LOCAL_BATCH_SIZE prompts per call).
+
+    Returns:
+        list[str]: The generated text (without the prompt) for each prompt, in order.
+    """
+    loaded = llm.get()
+    model, tokenizer = loaded["model"], loaded["tokenizer"]
 
-    if QUANT_MODE == "none":
-        # Using OpenAI or OpenRouter API
-        response = client.chat.completions.create(
-            model=OPENAI_MODEL,
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.0  # deterministic
-        )
-        answer = response.choices[0].message.content.strip()
+    answers = []
+    for start in range(0, len(prompts), LOCAL_BATCH_SIZE):
+        batch = prompts[start:start + LOCAL_BATCH_SIZE]
+        inputs = local_inputs(batch, model, tokenizer)
+        try:
+            outputs = model.generate(
+                **inputs, max_new_tokens=MAX_NEW_TOKENS, pad_token_id=tokenizer.pad_token_id
+            )
+        except Exception as e:
+            if "past_key_values" not in inputs:
+                raise
+            prefix_cache.disable(e)
+            inputs = local_inputs(batch, model, tokenizer)
+            outputs = model.generate(
+                **inputs, max_new_tokens=MAX_NEW_TOKENS, pad_token_id=tokenizer.pad_token_id
+            )
+        generated = outputs[:, inputs["input_ids"].shape[1]:]
+        answers.extend(text.strip() for text in tokenizer.batch_decode(generated, skip_special_tokens=True))
+        logger.info(f"Generated {start + len(batch)} of {len(prompts)} batched answers.")
+    return answers
 
+# Background batching of concurrent local requests (None for hosted APIs or if disabled)
+generation_worker = (
+    GenerationWorker(generate_local_batch, LOCAL_BATCH_SIZE, GENERATION_MAX_WAIT_MS)
+    if LOCAL_QUANT_MODE != "none" and GENERATION_BATCHING
+    else None
+)
+
+def generate_local(prompt: str) -> str:
+    """
+    Generates one answer with the local model, through the batching worker when enabled.
+    """
+    if generation_worker is None:
+        return generate_local_batch([prompt])[0]
+    return generation_worker.generate(prompt)
+
+async def agenerate_local(prompt: str) -> str:
+    if generation_worker is None:
+        return await asyncio.to_thread(generate_local, prompt)
+    # Await the worker's future directly; no thread is held while queued
+    return await asyncio.wrap_future(generation_worker.submit(prompt))
+
+def call_model_batch(questions: list[str], chunk_lists: list[list[str]]) -> list[str]:
+    """
+    Answers many questions at once: a lone local model generates in padded
+    batches; otherwise prompts go through the router from a thread pool
+    (BATCH_LLM_CONCURRENCY at a time).
+
+    Args:
+        questions (list[str]): The user questions.
+        chunk_lists (list[list[str]]): Retrieved context for each question.
+
+    Returns:
+        list[str]: One answer per question, in order.
+    """
+    if not LOCAL_ONLY:
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(BATCH_LLM_CONCURRENCY) as pool:
+            return list(pool.map(call_model, questions, chunk_lists))
+
+    prompts = [prepare_prompt(q, chunks) for q, chunks in zip(questions, chunk_lists)]
+    todo = [i for i, prompt in enumerate(prompts) if prompt is not None]
+    answers = [FALLBACK_ANSWER] * len(prompts)
+    if generation_worker is None:
+        generated = generate_local_batch([prompts[i] for i in todo])
     else:
-        # Using local model (8bit or 4bit)
-        inputs = tokenizer(prompt, return_tensors="pt").to(model.device)
-        outputs = model.generate(**inputs, max_new_tokens=512)
-        answer = tokenizer.decode(outputs[0], skip_special_tokens=True)
+        # Queue them all; the worker batches them (with any live requests)
+        futures = [generation_worker.submit(prompts[i]) for i in todo]
+        generated = [future.result() for future in futures]
+    for i, answer in zip(todo, generated):
+        answers[i] = answer
+    return answers
 
-    logger.info("Received response from model.")
-    return answer
+async def aiter_model_batch(
+    questions: list[str], chunk_lists: list[list[str]], admit: Callable = nullcontext
+) -> AsyncIterator[str | Exception]:
+    """
+    Async version of call_model_batch that yields answers in input order as
+    soon as each is ready. Routed calls run with at most
+    BATCH_LLM_CONCURRENCY in flight; a lone local model runs padded batches
+    one after another in a worker thread. Every routed call (or padded
+    batch) holds its own slot from `admit`, so batches share the API's cap
+    on concurrent model calls.
+
+    Yields:
+        str | Exception: The answer for each question, or the error that question hit.
+    """
+    if not LOCAL_ONLY:
+        semaphore = asyncio.Semaphore(BATCH_LLM_CONCURRENCY)
+
+        async def limited(question, chunks):
+            async with semaphore, admit():
+                return await acall_model(question, chunks)
+
+        tasks = [asyncio.create_task(limited(q, chunks)) for q, chunks in zip(questions, chunk_lists)]
+        try:
+            for task in tasks:
+                try:
+                    yield await task
+                except Exception as e:
+                    yield e
+        finally:
+            # Client gone or generator closed early: stop the calls nobody will read
+            for task in tasks:
+                task.cancel()
+        return
+
+    for start in range(0, len(questions), LOCAL_BATCH_SIZE):
+        batch = slice(start, start + LOCAL_BATCH_SIZE)
+        try:
+            async with admit():
+                answers = await asyncio.to_thread(call_model_batch, questions[batch], chunk_lists[batch])
+        except Exception as e:
+            answers = [e] * len(questions[batch])
+        for answer in answers:
+            yield answer
+
+def stream_local_model(prompt: str) -> Iterator[str]:
+    """
+    Yields decoded text pieces from a local model as they are generated.
+    """
+    from transformers import TextIteratorStreamer
+
+    loaded = llm.get()
+    model, tokenizer = loaded["model"], loaded["tokenizer"]
+    streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+    inputs = local_inputs([prompt], model, tokenizer)
+    thread = Thread(
+        target=model.generate,
+        kwargs={
+            **inputs,
+            "max_new_tokens": MAX_NEW_TOKENS,
+            "pad_token_id": tokenizer.pad_token_id,
+            "streamer": streamer,
+        },
+        daemon=True,
+    )
+    thread.start()
+    yield from streamer
+    thread.join()
+
+async def astream_local(prompt: str) -> AsyncIterator[str]:
+    # Pull each piece from the blocking streamer in a worker thread
+    pieces = stream_local_model(prompt)
+    while (piece := await asyncio.to_thread(next, pieces, None)) is not None:
+        if piece:
+            yield piece
+
+# ==========================================================
+# Router over the configured backends (LLM_BACKENDS)
+# ==========================================================
+
+def make_backend(name: str) -> Backend:
+    if name in HOSTED_PROVIDERS:
+        return ProviderBackend(name, provider_clients[name])
+    if name in ("8bit", "4bit"):
+        return LocalBackend(name, generate_local, agenerate_local, astream_local)
+    raise ValueError(f"Unsupported LLM backend: {name}")
+
+router = LLMRouter(
+    [make_backend(name) for name in LLM_BACKENDS],
+    attempt_timeout=LLM_ROUTER_TIMEOUT_SECONDS,
+    error_threshold=LLM_ROUTER_ERROR_THRESHOLD,
+    cooldown_seconds=LLM_ROUTER_COOLDOWN_SECONDS,
+    window=LLM_ROUTER_WINDOW,
+)
+
+async def astream_model(question: str, chunks: list[str]) -> AsyncIterator[str]:
+    """
+    Streams the answer token by token, so the first words reach the client
+    before generation has finished.
+
+    Args:
+        question (str): The user's input question.
+        chunks (list[str]): Retrieved context snippets related to the question.
+
+    Yields:
+        str: Pieces of the generated answer, in order.
+    """
+    prompt = prepare_prompt(question, chunks)
+    if prompt is None:
+        yield FALLBACK_ANSWER
+        return
+
+    with span("call_model") as counts:
+        async for piece in router.astream(prompt):
+            counts["pieces"] = counts.get("pieces", 0) + 1
+            yield piece
+
+    logger.info("Finished streaming response from model.")
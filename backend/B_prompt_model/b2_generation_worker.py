@@ -0,0 +1,103 @@
+# ==========================================================
+# Layer B2 - Batched Generation Worker (b2_generation_worker.py)
+# ==========================================================
+# Local 8bit/4bit models generate far more tokens per second when several
+# prompts run through `generate` together as one padded batch.
+#
+# This worker runs in a background thread:
+# - Requests submit a prompt and get a Future back.
+# - The worker waits up to `max_wait_ms` after the first queued prompt to
+#   collect up to `max_batch_size` prompts, then generates them together.
+# - Queue depth and batch sizes are exposed via `metrics()`.
+# ==========================================================
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable
+
+from utils.logger import logger
+
+
+class GenerationWorker:
+    """
+    Collects concurrent prompts into batches for `generate_batch(prompts) -> answers`.
+    """
+
+    def __init__(self, generate_batch: Callable[[list[str]], list[str]], max_batch_size: int, max_wait_ms: float):
+        self.generate_batch = generate_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats = {"requests": 0, "batches": 0, "largest_batch": 0, "busy_seconds": 0.0}
+
+    def submit(self, prompt: str) -> Future:
+        """
+        Queues a prompt; the returned Future resolves to its generated answer.
+        """
+        self._ensure_started()
+        future = Future()
+        self._queue.put((prompt, future))
+        return future
+
+    def generate(self, prompt: str) -> str:
+        return self.submit(prompt).result()
+
+    def metrics(self) -> dict:
+        stats = dict(self._stats)
+        stats["queue_depth"] = self._queue.qsize()
+        stats["average_batch"] = round(stats["requests"] / stats["batches"], 2) if stats["batches"] else 0.0
+        stats["busy_seconds"] = round(stats["busy_seconds"], 3)
+        stats["max_batch_size"] = self.max_batch_size
+        return stats
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="generation-worker", daemon=True)
+                    self._thread.start()
+
+    def _next_batch(self) -> list[tuple[str, Future]]:
+        batch = [self._queue.get()]  # Block until there is work
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            # Skip requests whose caller already gave up
+            batch = [(prompt, future) for prompt, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            started = time.perf_counter()
+            try:
+                answers = self.generate_batch([prompt for prompt, _ in batch])
+                for (_, future), answer in zip(batch, answers):
+                    future.set_result(answer)
+            except Exception as e:
+                logger.error(f"Batched generation failed for {len(batch)} prompts: {e}")
+                for _, future in batch:
+                    future.set_exception(e)
+
+            elapsed = time.perf_counter() - started
+            self._stats["requests"] += len(batch)
+            self._stats["batches"] += 1
+            self._stats["largest_batch"] = max(self._stats["largest_batch"], len(batch))
+            self._stats["busy_seconds"] += elapsed
+            logger.info(
+                f"Generated a batch of {len(batch)} in {elapsed:.2f}s "
+                f"({self._queue.qsize()} prompts still queued)."
+            )
@@ -0,0 +1,120 @@
+# ==========================================================
+# Layer B2 - Prompt Prefix KV Cache (b2_prefix_cache.py)
+# ==========================================================
+# Every prompt starts with the same GUIDELINES.md text (Layer B1), so local
+# 8bit/4bit models re-encode hundreds of identical tokens per request.
+#
+# This cache runs the model over the guidelines prefix once, keeps its
+# attention key/value tensors (past_key_values), and hands `generate` a copy
+# of them for each new prompt, so only the context and question are encoded.
+#
+# - Built once per loaded model, on first use.
+# - Rebuilt when GUIDELINES.md changes (keyed by a hash of the text).
+# - Batches are laid out as [prefix][padding][suffix], so every row shares
+#   the same prefix positions and the cached tensors are simply repeated.
+# - If the model or transformers version rejects a cache, it is disabled and
+#   prompts are encoded in full as before.
+# ==========================================================
+
+import hashlib
+import threading
+
+from utils.logger import logger
+
+
+class PrefixKVCache:
+    """
+    Past key/values of a shared prompt prefix for one local model.
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self._entry = None  # {"key", "input_ids", "past"}
+        self._lock = threading.Lock()
+        self._stats = {"builds": 0, "hits": 0}
+
+    def metrics(self) -> dict:
+        cached = self._entry["input_ids"].shape[1] if self._entry else 0
+        return {**self._stats, "enabled": self.enabled, "prefix_tokens": cached}
+
+    def generate_inputs(self, model, tokenizer, prefix: str, prompts: list[str]) -> dict | None:
+        """
+        Builds `generate` keyword arguments that reuse the cached prefix.
+
+        Args:
+            model: The loaded local model.
+            tokenizer: Its tokenizer (padding side "left").
+            prefix (str): Text every prompt starts with (the guidelines).
+            prompts (list[str]): Prompts to generate for, as one batch.
+
+        Returns:
+            dict | None: input_ids, attention_mask and past_key_values, or None
+            when the cache is disabled or a prompt does not start with the prefix.
+        """
+        if not self.enabled or not all(prompt.startswith(prefix) for prompt in prompts):
+            return None
+        import torch
+
+        try:
+            entry = self._get(model, tokenizer, prefix)
+            suffixes = tokenizer(
+                [prompt[len(prefix):] for prompt in prompts],
+                return_tensors="pt",
+                padding=True,
+                add_special_tokens=False,
+            ).to(model.device)
+        except Exception as e:
+            self.disable(e)
+            return None
+
+        rows = len(prompts)
+        prefix_ids = entry["input_ids"].repeat(rows, 1)
+        self._stats["hits"] += rows
+        return {
+            # generate() skips the tokens already covered by past_key_values
+            "input_ids": torch.cat([prefix_ids, suffixes["input_ids"]], dim=1),
+            "attention_mask": torch.cat([torch.ones_like(prefix_ids), suffixes["attention_mask"]], dim=1),
+            "past_key_values": _expand(entry["past"], rows),
+        }
+
+    def disable(self, error: Exception):
+        if self.enabled:
+            logger.warning(f"Prefix KV cache disabled ({type(error).__name__}: {error}); encoding full prompts.")
+        self.enabled = False
+        self._entry = None
+
+    def _get(self, model, tokenizer, prefix: str) -> dict:
+        key = (id(model), hashlib.sha1(prefix.encode("utf-8")).hexdigest())
+        entry = self._entry
+        if entry is not None and entry["key"] == key:
+            return entry
+        with self._lock:
+            if self._entry is None or self._entry["key"] != key:
+                self._entry = self._build(model, tokenizer, prefix, key)
+            return self._entry
+
+    def _build(self, model, tokenizer, prefix: str, key: tuple) -> dict:
+        import torch
+
+        input_ids = tokenizer(prefix, return_tensors="pt")["input_ids"].to(model.device)
+        with torch.no_grad():
+            past = model(input_ids=input_ids, use_cache=True).past_key_values
+        if hasattr(past, "to_legacy_cache"):
+            past = past.to_legacy_cache()
+        self._stats["builds"] += 1
+        logger.info(f"Cached key/values for the {input_ids.shape[1]}-token guidelines prefix.")
+        return {"key": key, "input_ids": input_ids, "past": tuple(past)}
+
+
+def _expand(past: tuple, rows: int):
+    """
+    Copies the cached (key, value) pairs for a batch of `rows` prompts, so
+    generation never writes into the shared tensors.
+    """
+    layers = tuple((key.repeat(rows, 1, 1, 1), value.repeat(rows, 1, 1, 1)) for key, value in past)
+    try:
+        from transformers import DynamicCache
+
+        return DynamicCache.from_legacy_cache(layers)
+    except (ImportError, AttributeError):
+        return layers  # Older transformers accept the tuple format
@@ -0,0 +1,316 @@
+# ==========================================================
+# Layer B2 - Hosted Provider Client (b2_provider_client.py)
+# ==========================================================
+# A small client for OpenAI-compatible chat completion APIs (OpenAI,
+# OpenRouter, or a local mock server via LLM_BASE_URL).
+#
+# It is built for tail latency on shared/free endpoints:
+# - One pooled HTTP client per process with keep-alive, so requests reuse
+#   warm TLS connections; the pool size also caps requests in flight.
+# - Connect and read timeouts on every call.
+# - Retries with exponential backoff and jitter on 429/5xx and network
+#   errors, honoring the server's Retry-After header.
+# - Optional hedging: when a request is slower than the recent p95 latency,
+#   a second identical request is sent and whichever answers first wins.
+#
+# Sync (`complete`), async (`acomplete`) and streaming (`astream`) callers
+# share the same settings and latency statistics.
+# ==========================================================
+
+import asyncio
+import json
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FutureTimeout, wait
+from typing import AsyncIterator
+
+import httpx
+import numpy as np
+
+from utils.logger import logger
+
+# Status codes worth retrying: timeouts, rate limits and server errors
+RETRY_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+# Successful request latencies kept for the hedging percentile
+LATENCY_WINDOW = 200
+
+# Upper bound on a single backoff sleep, in seconds
+MAX_BACKOFF_SECONDS = 30.0
+
+
+class ProviderError(RuntimeError):
+    """
+    A provider request failed after all retries.
+    """
+
+    def __init__(self, message: str, status: int | None = None):
+        super().__init__(message)
+        self.status = status
+
+
+class ProviderClient:
+    """
+    Pooled, retrying, optionally hedged client for one chat completions endpoint.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        api_key: str,
+        model: str,
+        timeout: float = 60.0,
+        connect_timeout: float = 5.0,
+        max_retries: int = 3,
+        backoff_seconds: float = 0.5,
+        max_connections: int = 20,
+        keepalive_seconds: float = 30.0,
+        hedge: bool = False,
+        hedge_min_samples: int = 20,
+        transport: httpx.BaseTransport | None = None,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.max_retries = max(0, max_retries)
+        self.backoff_seconds = backoff_seconds
+        self.hedge = hedge
+        self.hedge_min_samples = hedge_min_samples
+        self._headers = {"Authorization": f"Bearer {api_key}"}
+        self._timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self._limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=keepalive_seconds,
+        )
+        # A custom transport (e.g. httpx.MockTransport in tests) serves both the sync and async clients
+        self._transport = transport
+        self._client = httpx.Client(
+            base_url=self.base_url, headers=self._headers, timeout=self._timeout, limits=self._limits,
+            transport=transport,
+        )
+        self._async_client = None
+        self._async_loop = None
+        self._hedge_pool = ThreadPoolExecutor(max_connections, thread_name_prefix="llm-hedge") if hedge else None
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "retries": 0, "failures": 0, "hedged": 0, "hedge_wins": 0}
+
+    # ----- public API -----
+
+    def complete(self, prompt: str) -> str:
+        """
+        Returns the completion for a prompt, hedging slow requests when enabled.
+
+        A thread cannot be cancelled, so the losing hedged request is not
+        stopped: it runs on in the hedge pool until it answers or hits the
+        read timeout, holding a pooled connection meanwhile. If it succeeds,
+        its latency still enters the hedging window; if it fails, the failure
+        is counted. Async callers should use `acomplete`, which cancels it.
+        """
+        delay = self.hedge_delay()
+        if delay is None:
+            return self._post(prompt)
+
+        primary = self._hedge_pool.submit(self._post, prompt)
+        try:
+            return primary.result(timeout=delay)
+        except FutureTimeout:
+            pass
+        self._count("hedged")
+        backup = self._hedge_pool.submit(self._post, prompt)
+        pending = {primary, backup}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is backup:
+                        self._count("hedge_wins")
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    async def acomplete(self, prompt: str) -> str:
+        """
+        Async version of `complete`; the losing hedged request is cancelled.
+        """
+        delay = self.hedge_delay()
+        if delay is None:
+            return await self._apost(prompt)
+
+        primary = asyncio.ensure_future(self._apost(prompt))
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return primary.result()
+        self._count("hedged")
+        backup = asyncio.ensure_future(self._apost(prompt))
+        pending = {primary, backup}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is backup:
+                            self._count("hedge_wins")
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def astream(self, prompt: str) -> AsyncIterator[str]:
+        """
+        Streams completion text as it arrives. Failures before the first piece
+        are retried like `acomplete`; after that they raise ProviderError, since
+        the caller already has part of the answer. Streams are never hedged.
+        """
+        client = self._get_async_client()
+        payload = self._payload(prompt, stream=True)
+        sent = False
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with client.stream("POST", "/chat/completions", json=payload) as response:
+                    if response.status_code in RETRY_STATUS and attempt < self.max_retries:
+                        await asyncio.sleep(self._retry_wait(attempt, response))
+                        continue
+                    if response.status_code >= 400:
+                        await response.aread()
+                        self._fail(response)
+                    self._count("requests")
+                    async for line in response.aiter_lines():
+                        if not line.startswith("data:"):
+                            continue
+                        data = line[5:].strip()
+                        if data == "[DONE]":
+                            break
+                        choices = json.loads(data).get("choices") or [{}]
+                        piece = (choices[0].get("delta") or {}).get("content")
+                        if piece:
+                            sent = True
+                            yield piece
+                    return
+            except httpx.TransportError as e:
+                if sent:
+                    self._count("failures")
+                    raise ProviderError(f"LLM provider stream interrupted: {e}") from e
+                if attempt >= self.max_retries:
+                    self._count("failures")
+                    raise ProviderError(f"LLM provider unreachable: {e}") from e
+                await asyncio.sleep(self._retry_wait(attempt))
+
+    def hedge_delay(self) -> float | None:
+        """
+        Seconds to wait before hedging: the p95 of recent successful requests
+        (None when hedging is off or too few requests have been seen).
+        """
+        if not self.hedge or len(self._latencies) < self.hedge_min_samples:
+            return None
+        return float(np.percentile(list(self._latencies), 95))
+
+    def metrics(self) -> dict:
+        latencies = list(self._latencies)
+        stats = dict(self._stats)
+        for name, q in (("p50_seconds", 50), ("p95_seconds", 95), ("p99_seconds", 99)):
+            stats[name] = round(float(np.percentile(latencies, q)), 3) if latencies else None
+        return stats
+
+    def close(self):
+        self._client.close()
+        if self._hedge_pool is not None:
+            self._hedge_pool.shutdown(wait=False)
+
+    # ----- internals -----
+
+    def _payload(self, prompt: str, stream: bool = False) -> dict:
+        payload = {
+            "model": self.model,
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": 0.0,  # deterministic
+        }
+        if stream:
+            payload["stream"] = True
+        return payload
+
+    def _post(self, prompt: str) -> str:
+        payload = self._payload(prompt)
+        for attempt in range(self.max_retries + 1):
+            started = time.perf_counter()
+            try:
+                response = self._client.post("/chat/completions", json=payload)
+            except httpx.TransportError as e:
+                if attempt >= self.max_retries:
+                    self._count("failures")
+                    raise ProviderError(f"LLM provider unreachable: {e}") from e
+                time.sleep(self._retry_wait(attempt))
+                continue
+            if response.status_code in RETRY_STATUS and attempt < self.max_retries:
+                time.sleep(self._retry_wait(attempt, response))
+                continue
+            return self._answer(response, time.perf_counter() - started)
+
+    async def _apost(self, prompt: str) -> str:
+        client = self._get_async_client()
+        payload = self._payload(prompt)
+        for attempt in range(self.max_retries + 1):
+            started = time.perf_counter()
+            try:
+                response = await client.post("/chat/completions", json=payload)
+            except httpx.TransportError as e:
+                if attempt >= self.max_retries:
+                    self._count("failures")
+                    raise ProviderError(f"LLM provider unreachable: {e}") from e
+                await asyncio.sleep(self._retry_wait(attempt))
+                continue
+            if response.status_code in RETRY_STATUS and attempt < self.max_retries:
+                await asyncio.sleep(self._retry_wait(attempt, response))
+                continue
+            return self._answer(response, time.perf_counter() - started)
+
+    def _answer(self, response: httpx.Response, elapsed: float) -> str:
+        if response.status_code >= 400:
+            self._fail(response)
+        self._count("requests")
+        self._latencies.append(elapsed)
+        return response.json()["choices"][0]["message"]["content"].strip()
+
+    def _fail(self, response: httpx.Response):
+        self._count("failures")
+        raise ProviderError(
+            f"LLM provider returned {response.status_code}: {response.text[:200]}",
+            status=response.status_code,
+        )
+
+    def _retry_wait(self, attempt: int, response: httpx.Response | None = None) -> float:
+        self._count("retries")
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        if retry_after:
+            try:
+                wait_seconds = min(float(retry_after), MAX_BACKOFF_SECONDS)
+                logger.warning(f"LLM provider returned {response.status_code}; retrying in {wait_seconds:.1f}s.")
+                return wait_seconds
+            except ValueError:
+                pass  # An HTTP date; fall back to exponential backoff
+        # Full jitter keeps many clients from retrying in lockstep
+        wait_seconds = random.uniform(0, min(self.backoff_seconds * 2 ** attempt, MAX_BACKOFF_SECONDS))
+        reason = response.status_code if response is not None else "network error"
+        logger.warning(f"LLM provider {reason}; retry {attempt + 1} of {self.max_retries} in {wait_seconds:.2f}s.")
+        return wait_seconds
+
+    def _get_async_client(self) -> httpx.AsyncClient:
+        # Async connections belong to one event loop; scripts calling asyncio.run() twice get a fresh pool
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_loop is not loop:
+            self._async_client = httpx.AsyncClient(
+                base_url=self.base_url, headers=self._headers, timeout=self._timeout, limits=self._limits,
+                transport=self._transport,
+            )
+            self._async_loop = loop
+        return self._async_client
+
+    def _count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
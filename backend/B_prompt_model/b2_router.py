@@ -0,0 +1,305 @@
+# ==========================================================
+# Layer B2 - LLM Router (b2_router.py)
+# ==========================================================
+# Routes each prompt to one of several configured LLM backends
+# (OpenRouter, OpenAI, a local 8bit/4bit model, or a test fake).
+#
+# For every backend the router keeps a rolling window of recent calls:
+# - Latency: mean duration of recent successful calls (a timed-out call counts
+#   the time it was given; other failures are not timed, so a backend that
+#   fails fast never looks fast). Untried backends count as 0s, so each one is
+#   measured early; backends whose recent calls all failed go after the rest.
+# - Errors: when the error rate of a full enough window reaches a threshold,
+#   the backend is skipped for a cooldown period, then tried again.
+#
+# Each request goes to the fastest healthy backend. If that call fails or
+# runs past the per-attempt timeout, the request fails over to the next
+# backend instead of waiting it out.
+#
+# Backends are pluggable: anything implementing `Backend.complete` works.
+# ==========================================================
+
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from typing import AsyncIterator, Callable
+
+from utils.logger import logger
+
+# Calls needed in the window before a backend can be marked unhealthy
+MIN_CALLS_FOR_HEALTH = 5
+
+
+class Backend:
+    """
+    One way of answering a prompt. Subclasses implement `complete`;
+    the async and streaming variants default to running it in a thread.
+    """
+
+    name = "backend"
+
+    def complete(self, prompt: str) -> str:
+        raise NotImplementedError
+
+    async def acomplete(self, prompt: str) -> str:
+        return await asyncio.to_thread(self.complete, prompt)
+
+    async def astream(self, prompt: str) -> AsyncIterator[str]:
+        yield await self.acomplete(prompt)
+
+    def metrics(self) -> dict:
+        return {}
+
+
+class ProviderBackend(Backend):
+    """
+    A hosted OpenAI-compatible API, through a lazily loaded ProviderClient.
+    """
+
+    def __init__(self, name: str, client):
+        self.name = name
+        self.client = client  # LazyComponent returning a ProviderClient
+
+    def complete(self, prompt: str) -> str:
+        return self.client.get().complete(prompt)
+
+    async def acomplete(self, prompt: str) -> str:
+        client = await asyncio.to_thread(self.client.get)
+        return await client.acomplete(prompt)
+
+    async def astream(self, prompt: str) -> AsyncIterator[str]:
+        client = await asyncio.to_thread(self.client.get)
+        async for piece in client.astream(prompt):
+            yield piece
+
+    def metrics(self) -> dict:
+        return self.client.get().metrics() if self.client.loaded else {}
+
+
+class LocalBackend(Backend):
+    """
+    A local model, given its blocking, async and streaming generate functions.
+    """
+
+    def __init__(self, name: str, generate: Callable, agenerate: Callable, astream: Callable):
+        self.name = name
+        self._generate = generate
+        self._agenerate = agenerate
+        self._astream = astream
+
+    def complete(self, prompt: str) -> str:
+        return self._generate(prompt)
+
+    async def acomplete(self, prompt: str) -> str:
+        return await self._agenerate(prompt)
+
+    async def astream(self, prompt: str) -> AsyncIterator[str]:
+        async for piece in self._astream(prompt):
+            yield piece
+
+
+class BackendHealth:
+    """
+    Rolling window of (succeeded, seconds) for one backend; seconds is None
+    for failures other than timeouts.
+    """
+
+    def __init__(self, window: int):
+        self.calls = deque(maxlen=window)
+        self.down_until = 0.0
+        self.total = 0
+        self.failures = 0
+
+    @property
+    def latency(self) -> float:
+        timed = [seconds for _, seconds in self.calls if seconds is not None]
+        return sum(timed) / len(timed) if timed else 0.0
+
+    @property
+    def untimed(self) -> bool:
+        """
+        True when the window has calls but every one failed before timing out.
+        """
+        return bool(self.calls) and all(seconds is None for _, seconds in self.calls)
+
+    @property
+    def error_rate(self) -> float:
+        return sum(1 for ok, _ in self.calls if not ok) / len(self.calls) if self.calls else 0.0
+
+    def healthy(self, now: float) -> bool:
+        if self.down_until and now >= self.down_until:
+            # Cooldown over: start over with a clean window
+            self.down_until = 0.0
+            self.calls.clear()
+        return now >= self.down_until
+
+
+class LLMRouter:
+    """
+    Sends each prompt to the fastest healthy backend, failing over on errors and timeouts.
+    """
+
+    def __init__(
+        self,
+        backends: list[Backend],
+        attempt_timeout: float = 30.0,
+        error_threshold: float = 0.5,
+        cooldown_seconds: float = 30.0,
+        window: int = 50,
+    ):
+        if not backends:
+            raise ValueError("LLMRouter needs at least one backend.")
+        self.backends = backends
+        self.attempt_timeout = attempt_timeout
+        self.error_threshold = error_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self._health = {backend.name: BackendHealth(window) for backend in backends}
+        self._lock = threading.Lock()
+
+    def ranked(self) -> list[Backend]:
+        """
+        Backends in the order to try them: healthy ones fastest first
+        (ties keep configured order), then unhealthy ones as a last resort.
+        """
+        now = time.monotonic()
+        with self._lock:
+            return sorted(
+                self.backends,
+                key=lambda b: (
+                    not self._health[b.name].healthy(now),
+                    self._health[b.name].untimed,
+                    self._health[b.name].latency,
+                ),
+            )
+
+    def complete(self, prompt: str) -> str:
+        candidates = self.ranked()
+        error = None
+        for position, backend in enumerate(candidates):
+            last = position == len(candidates) - 1
+            started = time.perf_counter()
+            try:
+                if last:
+                    answer = backend.complete(prompt)
+                else:
+                    # Bound the wait so a slow backend fails over instead of blocking the request
+                    answer = _run_in_thread(backend.complete, prompt).result(timeout=self.attempt_timeout)
+            except Exception as e:
+                error = self._failed(backend, e, started, last)
+                continue
+            self._record(backend, True, time.perf_counter() - started)
+            return answer
+        raise error
+
+    async def acomplete(self, prompt: str) -> str:
+        candidates = self.ranked()
+        error = None
+        for position, backend in enumerate(candidates):
+            last = position == len(candidates) - 1
+            started = time.perf_counter()
+            try:
+                timeout = None if last else self.attempt_timeout
+                answer = await asyncio.wait_for(backend.acomplete(prompt), timeout)
+            except Exception as e:
+                error = self._failed(backend, e, started, last)
+                continue
+            self._record(backend, True, time.perf_counter() - started)
+            return answer
+        raise error
+
+    async def astream(self, prompt: str) -> AsyncIterator[str]:
+        """
+        Streams from the best backend. Fails over only until the first piece
+        arrives; after that, an error ends the stream.
+        """
+        candidates = self.ranked()
+        error = None
+        for position, backend in enumerate(candidates):
+            last = position == len(candidates) - 1
+            started = time.perf_counter()
+            stream = backend.astream(prompt).__aiter__()
+            try:
+                timeout = None if last else self.attempt_timeout
+                first = await asyncio.wait_for(stream.__anext__(), timeout)
+            except StopAsyncIteration:
+                self._record(backend, True, time.perf_counter() - started)
+                return
+            except Exception as e:
+                await _aclose(stream)
+                error = self._failed(backend, e, started, last)
+                continue
+            yield first
+            try:
+                async for piece in stream:
+                    yield piece
+            except Exception:
+                self._record(backend, False, None)
+                raise
+            self._record(backend, True, time.perf_counter() - started)
+            return
+        raise error
+
+    def metrics(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                backend.name: {
+                    "healthy": self._health[backend.name].healthy(now),
+                    "calls": self._health[backend.name].total,
+                    "failures": self._health[backend.name].failures,
+                    "error_rate": round(self._health[backend.name].error_rate, 3),
+                    "latency_seconds": round(self._health[backend.name].latency, 3),
+                    **backend.metrics(),
+                }
+                for backend in self.backends
+            }
+
+    def _failed(self, backend: Backend, error: Exception, started: float, last: bool) -> Exception:
+        seconds = None
+        if isinstance(error, (FutureTimeout, asyncio.TimeoutError)):
+            error = TimeoutError(f"{backend.name} did not answer within {self.attempt_timeout:.0f}s")
+            seconds = time.perf_counter() - started
+        self._record(backend, False, seconds)
+        if not last:
+            logger.warning(f"LLM backend {backend.name} failed ({error}); failing over.")
+        return error
+
+    def _record(self, backend: Backend, ok: bool, seconds: float | None):
+        with self._lock:
+            health = self._health[backend.name]
+            health.calls.append((ok, seconds))
+            health.total += 1
+            if ok:
+                return
+            health.failures += 1
+            full = len(health.calls) >= min(MIN_CALLS_FOR_HEALTH, health.calls.maxlen)
+            if full and health.error_rate >= self.error_threshold and not health.down_until:
+                health.down_until = time.monotonic() + self.cooldown_seconds
+                logger.warning(
+                    f"LLM backend {backend.name} marked unhealthy for {self.cooldown_seconds:.0f}s "
+                    f"(error rate {health.error_rate:.0%})."
+                )
+
+
+def _run_in_thread(fn: Callable[[str], str], prompt: str) -> Future:
+    # A fresh thread per attempt: abandoned slow calls can never starve later requests of workers
+    future = Future()
+
+    def run():
+        try:
+            future.set_result(fn(prompt))
+        except Exception as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, name="llm-attempt", daemon=True).start()
+    return future
+
+
+async def _aclose(stream):
+    if hasattr(stream, "aclose"):
+        try:
+            await stream.aclose()
+        except Exception:
+            pass
@@ -1,10 +1,13 @@
 from pathlib import Path
 from utils.logger import logger
+from backend.utils.metrics import span
 
 def load_markdown_files(folder="backend/D_storage_layer/raw_docs") -> list[tuple[str, str]]:
     logger.info("Loading markdown files...")
     base = Path(folder)
     markdown_files = base.rglob("*.md")
-    files = [(str(p.relative_to(base)), p.read_text(encoding="utf-8")) for p in markdown_files]
+    with span("load") as counts:
+        files = [(str(p.relative_to(base)), p.read_text(encoding="utf-8")) for p in markdown_files]
+        counts["files"] = len(files)
     logger.info(f"Loaded {len(files)} files.")
     return files
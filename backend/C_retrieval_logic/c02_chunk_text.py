@@ -1,13 +1,228 @@
+import io
+import re
+from functools import lru_cache
+from typing import Callable, Iterable, Iterator
+
 from utils.logger import logger
+from utils.config import CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS
+from backend.C_retrieval_logic.c03_embed_chunks import embedding_model
+from backend.utils.metrics import span
 
-def chunk_text(source_path: str, text: str, max_length: int = 300) -> list[dict]:
-    logger.info(f"Chunking file: {source_path}")
-    chunks = [
-        {
+# Bump when chunk boundaries change, so stored indexes get rebuilt
+CHUNKER_VERSION = "markdown-1"
+
+# Token limit assumed when the embedding model's tokenizer is unavailable
+DEFAULT_MAX_TOKENS = 256
+
+# Chunks shorter than this (e.g. a lone "---") are not worth a vector
+MIN_CHUNK_CHARS = 20
+
+FENCE_RE = re.compile(r"^\s{0,3}(`{3,}|~{3,})")
+HEADING_RE = re.compile(r"^\s{0,3}(#{1,6})\s+(.*?)[\s#]*$")
+LIST_ITEM_RE = re.compile(r"^\s{0,3}([-*+]|\d+[.)])\s+")
+
+def chunker_signature() -> str:
+    """
+    Identifies the chunker and its settings; stored in index manifests.
+    """
+    return f"{CHUNKER_VERSION}:{CHUNK_MAX_TOKENS}:{CHUNK_OVERLAP_TOKENS}"
+
+@lru_cache(maxsize=1)
+def _token_counter() -> tuple[int, Callable[[str], int]]:
+    # Count with the embedding model's own tokenizer so chunks are never truncated
+    try:
+        model = embedding_model.get()
+        tokenizer = model.tokenizer
+        # Leave room for the [CLS]/[SEP] special tokens
+        return model.max_seq_length - 2, lambda text: len(tokenizer.encode(text, add_special_tokens=False))
+    except Exception as e:
+        logger.warning(f"Embedding tokenizer unavailable ({e}); estimating 4 characters per token.")
+        return DEFAULT_MAX_TOKENS, lambda text: len(text) // 4 + 1
+
+def _iter_blocks(lines: Iterable[str]) -> Iterator[tuple[str, str]]:
+    """
+    Yields (kind, text) markdown blocks: "heading", "code" (a whole fenced
+    block), "list" (one list item with its continuation lines) or "paragraph".
+    """
+    buffer, kind, fence = [], None, None
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if fence:
+            buffer.append(line)
+            if re.match(rf"^\s{{0,3}}{re.escape(fence)}{re.escape(fence[0])}*\s*$", line):
+                yield "code", "\n".join(buffer)
+                buffer, fence = [], None
+            continue
+
+        match = FENCE_RE.match(line)
+        starts_block = match or HEADING_RE.match(line) or LIST_ITEM_RE.match(line) or not line.strip()
+        if starts_block and buffer:
+            yield kind, "\n".join(buffer)
+            buffer = []
+
+        if match:
+            buffer, kind, fence = [line], "code", match.group(1)
+        elif HEADING_RE.match(line):
+            yield "heading", line.strip()
+        elif LIST_ITEM_RE.match(line):
+            buffer, kind = [line], "list"
+        elif line.strip():
+            if not buffer:
+                kind = "paragraph"
+            buffer.append(line)
+
+    if buffer:
+        yield kind, "\n".join(buffer)  # Also flushes an unclosed code fence
+
+def _pack(pieces: list[str], sep: str, budget: int, count: Callable[[str], int]) -> Iterator[str]:
+    current, used = [], 0
+    for piece in pieces:
+        tokens = count(piece)
+        if current and used + tokens > budget:
+            yield sep.join(current)
+            current, used = [], 0
+        current.append(piece)
+        used += tokens
+    if current:
+        yield sep.join(current)
+
+def _split_block(kind: str, text: str, budget: int, count: Callable[[str], int]) -> Iterator[str]:
+    """
+    Yields the block whole if it fits the budget, otherwise line-sized (then
+    word-sized) pieces. Split code blocks are re-fenced so each piece is valid markdown.
+    """
+    if count(text) <= budget:
+        yield text
+        return
+
+    lines = text.split("\n")
+    if kind == "code" and len(lines) > 2:
+        opening = lines[0]
+        closing = lines[-1] if FENCE_RE.match(lines[-1]) else FENCE_RE.match(opening).group(1)
+        body = lines[1:-1] if closing == lines[-1] else lines[1:]
+        room = max(1, budget - count(opening) - count(closing))
+        for piece in _pack(body, "\n", room, count):
+            yield f"{opening}\n{piece}\n{closing}"
+        return
+
+    for line in _pack(lines, "\n", budget, count):
+        if count(line) <= budget:
+            yield line
+        else:
+            # A single very long line: fall back to word boundaries
+            yield from _pack(line.split(" "), " ", budget, count)
+
+def _overlap_tail(parts: list[tuple], overlap: int, count: Callable[[str], int]) -> list[tuple]:
+    """
+    Returns the trailing content of an emitted chunk to repeat at the start of
+    the next one: whole blocks if they fit the overlap, else the last words of prose.
+    """
+    tail, used = [], 0
+    for text, tokens, level, kind in reversed(parts):
+        if level or used + tokens > overlap:
+            break
+        tail.insert(0, (text, tokens, level, kind))
+        used += tokens
+    if tail or not parts or overlap <= 0:
+        return tail
+
+    text, _, level, kind = parts[-1]
+    if level or kind == "code":
+        return []
+    words = text.split()
+    start = len(words)
+    while start > 0 and count(" ".join(words[start - 1:])) <= overlap:
+        start -= 1
+    if start == len(words):
+        return []
+    piece = " ".join(words[start:])
+    return [(piece, count(piece), 0, "paragraph")]
+
+def iter_chunks(
+    source_path: str,
+    text: str | Iterable[str],
+    max_tokens: int = CHUNK_MAX_TOKENS,
+    overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+) -> Iterator[dict]:
+    """
+    Streams structure-aware chunks from a markdown document.
+
+    Chunks never cross a heading, and never split a fenced code block or list
+    item unless that block alone exceeds the token budget. Consecutive blocks
+    of one section are packed up to the budget, and each chunk repeats up to
+    `overlap_tokens` of the previous chunk of the same section.
+
+    Args:
+        source_path (str): Path stored in each chunk's "source".
+        text (str | Iterable[str]): Document text, or its lines (e.g. an open file).
+        max_tokens (int): Token budget per chunk (0 = the embedding model's limit).
+        overlap_tokens (int): Tokens repeated from the previous chunk.
+
+    Yields:
+        dict: {"source", "text", "heading_path"} where heading_path is "Title > Section > ...".
+    """
+    limit, count = _token_counter()
+    budget = min(max_tokens, limit) if max_tokens > 0 else limit
+    overlap = max(0, min(overlap_tokens, budget // 2))
+    lines = io.StringIO(text) if isinstance(text, str) else text
+
+    headings = []  # (level, title) of the enclosing sections
+    parts = []  # (text, tokens, heading level or 0, kind) of the chunk being built
+    used = 0
+    fresh = False  # True once the chunk has content not yet emitted
+    emitted = 0
+
+    def emit():
+        nonlocal emitted
+        chunk_text = "\n\n".join(part[0] for part in parts)
+        if len(chunk_text.strip()) < MIN_CHUNK_CHARS:
+            return None
+        emitted += 1
+        return {
             "source": source_path,
-            "text": text[i:i+max_length]
+            "text": chunk_text,
+            "heading_path": " > ".join(title for _, title in headings),
         }
-        for i in range(0, len(text), max_length)
-    ]
+
+    for kind, block in _iter_blocks(lines):
+        if kind == "heading":
+            if fresh and (chunk := emit()):
+                yield chunk
+            level_marks, title = HEADING_RE.match(block).groups()
+            level = len(level_marks)
+            # Keep headings of enclosing sections that had no body text of their own
+            parts = [] if fresh else [p for p in parts if 0 < p[2] < level]
+            parts.append((block, count(block), level, kind))
+            used = sum(p[1] for p in parts)
+            fresh = False
+            headings = [h for h in headings if h[0] < level] + [(level, title)]
+            continue
+
+        for piece in _split_block(kind, block, budget, count):
+            tokens = count(piece)
+            if used + tokens > budget:
+                if fresh:
+                    if chunk := emit():
+                        yield chunk
+                    parts = _overlap_tail(parts, overlap, count)
+                    fresh = False
+                else:
+                    parts = [p for p in parts if p[2]]
+                used = sum(p[1] for p in parts)
+                if used + tokens > budget:
+                    parts, used = [], 0
+            parts.append((piece, tokens, 0, kind))
+            used += tokens
+            fresh = True
+
+    if fresh and (chunk := emit()):
+        yield chunk
+    logger.debug(f"Created {emitted} chunks from {source_path}")
+
+def chunk_text(source_path: str, text: str, max_tokens: int = CHUNK_MAX_TOKENS) -> list[dict]:
+    logger.info(f"Chunking file: {source_path}")
+    with span("chunk") as counts:
+        chunks = list(iter_chunks(source_path, text, max_tokens))
+        counts["chunks"] = len(chunks)
     logger.info(f"Created {len(chunks)} chunks from {source_path}")
     return chunks
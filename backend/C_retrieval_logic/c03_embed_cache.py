@@ -0,0 +1,190 @@
+"""
+Embedding Cache (text hash -> vector)
+File: backend/C_retrieval_logic/c03_embed_cache.py
+
+The same text is often embedded again: boilerplate paragraphs repeated
+across the pro-analytics repos, unchanged chunks on refresh, and repeated
+user questions. This cache keeps every computed vector on disk, keyed by
+(embedding model, sha1 of the whitespace-normalized text).
+
+Layout (one directory per embedding model):
+- vectors.f32: append-only float32 matrix, one row per cached text.
+  Read through a memory map, so lookups copy nothing and every worker
+  process shares the same pages from the OS page cache.
+- index.bin: append-only records of (20-byte sha1, uint64 row).
+- meta.json: model name and vector dimension.
+
+Appends happen under an exclusive file lock (where fcntl exists), vectors
+before index records, so a reader never sees a row that is not written yet.
+Each process reads only the index records added since its last look.
+"""
+
+import hashlib
+import json
+import os
+import re
+import struct
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+from utils.logger import logger
+
+try:
+    import fcntl
+except ImportError:  # Windows: appends are only serialized within one process
+    fcntl = None
+
+# One index record: sha1 digest + row number
+_RECORD = struct.Struct("<20sQ")
+
+
+def text_key(model_name: str, text: str) -> bytes:
+    """
+    sha1 of the model name and the whitespace-normalized text.
+    """
+    normalized = re.sub(r"\s+", " ", text).strip()
+    return hashlib.sha1(f"{model_name}\x00{normalized}".encode("utf-8")).digest()
+
+
+class EmbeddingCache:
+    """
+    Append-only, memory-mapped embedding cache for one model, shared across processes.
+    """
+
+    def __init__(self, directory: str, model_name: str, max_mb: float = 512):
+        self.model_name = model_name
+        self.directory = os.path.join(directory, re.sub(r"[^A-Za-z0-9_.-]+", "__", model_name))
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.dim = None
+        self._vectors_path = os.path.join(self.directory, "vectors.f32")
+        self._index_path = os.path.join(self.directory, "index.bin")
+        self._meta_path = os.path.join(self.directory, "meta.json")
+        self._lock_path = os.path.join(self.directory, "lock")
+        self._rows = {}  # digest -> row
+        self._index_offset = 0  # bytes of index.bin already read
+        self._matrix = None  # memory map of vectors.f32
+        self._lock = threading.Lock()
+        self._full = False
+        self._stats = {"hits": 0, "misses": 0}
+        self._open()
+
+    def metrics(self) -> dict:
+        return {**self._stats, "rows": len(self._rows), "dim": self.dim}
+
+    def lookup(self, keys: list[bytes]) -> list[np.ndarray | None]:
+        """
+        Returns the cached vector (a read-only view of the memory map) for each key, or None.
+        """
+        with self._lock:
+            if any(key not in self._rows for key in keys):
+                self._refresh()
+            found = []
+            for key in keys:
+                row = self._rows.get(key)
+                found.append(None if row is None else self._row(row))
+            hits = sum(vector is not None for vector in found)
+            self._stats["hits"] += hits
+            self._stats["misses"] += len(keys) - hits
+            return found
+
+    def add(self, keys: list[bytes], vectors: np.ndarray):
+        """
+        Appends vectors for keys not cached yet (by this or any other process).
+        """
+        if not len(keys) or self._full:
+            return
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with self._lock, self._file_lock():
+            if self.dim is None:
+                self._read_meta()
+            if self.dim is None:
+                self.dim = int(vectors.shape[1])
+                with open(self._meta_path, "w", encoding="utf-8") as file:
+                    json.dump({"model": self.model_name, "dim": self.dim}, file)
+            if vectors.shape[1] != self.dim:
+                logger.warning(f"Embedding cache dim {self.dim} != {vectors.shape[1]}; not caching.")
+                return
+            self._refresh()
+            fresh, seen = [], set()
+            for i, key in enumerate(keys):
+                if key not in self._rows and key not in seen:
+                    fresh.append(i)
+                    seen.add(key)
+            if not fresh:
+                return
+
+            row_bytes = self.dim * 4
+            size = os.path.getsize(self._vectors_path)
+            if size + len(fresh) * row_bytes > self.max_bytes:
+                self._full = True
+                logger.warning(f"Embedding cache reached {self.max_bytes // (1024 * 1024)} MB; not adding more.")
+                return
+            first_row = size // row_bytes
+            with open(self._vectors_path, "r+b") as file:
+                # Drop a partial row left by an interrupted write
+                file.truncate(first_row * row_bytes)
+                file.seek(first_row * row_bytes)
+                file.write(vectors[fresh].tobytes())
+            records = b"".join(_RECORD.pack(keys[i], first_row + n) for n, i in enumerate(fresh))
+            with open(self._index_path, "r+b") as file:
+                end = os.path.getsize(self._index_path)
+                file.truncate(end - end % _RECORD.size)
+                file.seek(0, os.SEEK_END)
+                file.write(records)
+            self._refresh()
+
+    # ----- internals (call with self._lock held) -----
+
+    def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        for path in (self._vectors_path, self._index_path):
+            if not os.path.exists(path):
+                open(path, "ab").close()
+        with self._lock:
+            self._refresh()
+        if self._rows:
+            logger.info(f"Embedding cache: {len(self._rows)} cached vectors for {self.model_name}.")
+
+    def _refresh(self):
+        # Read index records appended (by any process) since the last look
+        size = os.path.getsize(self._index_path)
+        size -= size % _RECORD.size
+        if size <= self._index_offset:
+            return
+        if self.dim is None:
+            self._read_meta()
+            if self.dim is None:
+                return
+        with open(self._index_path, "rb") as file:
+            file.seek(self._index_offset)
+            data = file.read(size - self._index_offset)
+        rows = os.path.getsize(self._vectors_path) // (self.dim * 4)
+        for digest, row in _RECORD.iter_unpack(data):
+            if row < rows:
+                self._rows.setdefault(digest, row)
+        self._index_offset = size
+
+    def _read_meta(self):
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path, "r", encoding="utf-8") as file:
+                self.dim = json.load(file)["dim"]
+
+    def _row(self, row: int) -> np.ndarray:
+        if self._matrix is None or row >= len(self._matrix):
+            rows = os.path.getsize(self._vectors_path) // (self.dim * 4)
+            self._matrix = np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(rows, self.dim))
+        return self._matrix[row]
+
+    @contextmanager
+    def _file_lock(self):
+        # Exclusive across processes (only this process's lock without fcntl)
+        if fcntl is None:
+            yield
+            return
+        with open(self._lock_path, "a") as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
@@ -1,13 +1,156 @@
-from sentence_transformers import SentenceTransformer
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Iterable, Iterator
+
+import numpy as np
 from utils.logger import logger
+from utils.config import (
+    EMBEDDING_MODEL,
+    EMBED_BATCH_SIZE,
+    EMBED_WORKERS,
+    EMBED_CACHE_ENABLED,
+    EMBED_CACHE_DIR,
+    EMBED_CACHE_MAX_MB,
+)
+from backend.utils.lazy import lazy_component
+from backend.utils.metrics import span
+from backend.C_retrieval_logic.c03_embed_cache import EmbeddingCache, text_key
+
+def load_embedding_model():
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(EMBEDDING_MODEL)
+
+# Loaded on first use (or by the API warm-up), not at import time
+embedding_model = lazy_component("embedding_model", load_embedding_model)
+
+def load_embedding_cache():
+    return EmbeddingCache(EMBED_CACHE_DIR, EMBEDDING_MODEL, EMBED_CACHE_MAX_MB)
+
+# Vectors of texts embedded before, shared on disk by every process (None when disabled)
+embedding_cache = lazy_component("embedding_cache", load_embedding_cache) if EMBED_CACHE_ENABLED else None
 
-model = SentenceTransformer("all-MiniLM-L6-v2")
+def embed_texts(texts: list[str]) -> np.ndarray:
+    model = embedding_model.get()
+    if not texts:
+        return np.zeros((0, model.get_sentence_embedding_dimension()), dtype=np.float32)
+    with span("embed", texts=len(texts)) as counts:
+        if embedding_cache is None:
+            return np.asarray(model.encode(texts, batch_size=EMBED_BATCH_SIZE), dtype=np.float32)
+        return _embed_cached(model, texts, counts)
+
+def _embed_cached(model, texts: list[str], counts: dict) -> np.ndarray:
+    # Encode only texts not in the embedding cache (each distinct text once), then cache them
+    keys = [text_key(EMBEDDING_MODEL, text) for text in texts]
+    try:
+        cache = embedding_cache.get()
+        cached = cache.lookup(keys)
+    except OSError as e:
+        logger.warning(f"Embedding cache unavailable ({e}); encoding all texts.")
+        return np.asarray(model.encode(texts, batch_size=EMBED_BATCH_SIZE), dtype=np.float32)
+    missing = {}
+    for key, text, vector in zip(keys, texts, cached):
+        if vector is None:
+            missing.setdefault(key, text)
+    counts["cache_hits"] = sum(vector is not None for vector in cached)
+    if not missing:
+        return np.vstack(cached)
+
+    fresh = np.asarray(model.encode(list(missing.values()), batch_size=EMBED_BATCH_SIZE), dtype=np.float32)
+    try:
+        cache.add(list(missing), fresh)
+    except OSError as e:
+        logger.warning(f"Could not write to the embedding cache: {e}")
+    by_key = dict(zip(missing, fresh))
+    return np.vstack([by_key[key] if vector is None else vector for key, vector in zip(keys, cached)])
 
 def embed_chunks(chunks: list[dict]) -> list[dict]:
     texts = [chunk["text"] for chunk in chunks]
     logger.info(f"Embedding {len(texts)} chunks...")
-    vectors = model.encode(texts).tolist()
+    # Each chunk gets a row view of one packed float32 matrix, not a list of Python floats
+    vectors = embed_texts(texts)
     for chunk, vector in zip(chunks, vectors):
         chunk["embedding"] = vector
     logger.info("Embedding complete.")
     return chunks
+
+def embed_query(text: str) -> np.ndarray:
+    return embed_texts([text])[0]
+
+def peak_memory_mb() -> float:
+    try:
+        import resource
+    except ImportError:  # Windows: no resource module
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS reports bytes
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+def _init_worker(workers: int) -> None:
+    # Split the cores between workers instead of each torch pool using all of them
+    import torch
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // workers))
+
+def iter_embedded_batches(
+    chunks: Iterable[dict],
+    batch_size: int = EMBED_BATCH_SIZE,
+    workers: int = EMBED_WORKERS,
+) -> Iterator[tuple[list[dict], np.ndarray]]:
+    """
+    Streams chunks through the embedding model in fixed-size batches.
+
+    Only a bounded number of batches is held in memory at once, so large docs
+    trees are embedded in bounded memory. With workers > 1 the batches are
+    spread over a CPU process pool (each worker loads its own model).
+
+    Args:
+        chunks (Iterable[dict]): Chunk dicts with a "text" key (may be a generator).
+        batch_size (int): Number of chunks per batch.
+        workers (int): Worker processes; 0 or 1 embeds in this process.
+
+    Yields:
+        tuple[list[dict], np.ndarray]: Each batch of chunks with its float32 vectors, in input order.
+    """
+    iterator = iter(chunks)
+    batches = iter(lambda: list(islice(iterator, batch_size)), [])
+    started = time.perf_counter()
+    done = 0
+
+    def report(batch):
+        nonlocal done
+        done += len(batch)
+        elapsed = max(time.perf_counter() - started, 1e-9)
+        logger.info(
+            f"Embedded {done} chunks ({done / elapsed:.1f} chunks/sec, "
+            f"peak memory {peak_memory_mb():.0f} MB)"
+        )
+
+    if workers <= 1:
+        for batch in batches:
+            vectors = embed_texts([chunk["text"] for chunk in batch])
+            report(batch)
+            yield batch, vectors
+        return
+
+    import multiprocessing
+
+    # "spawn" avoids forking a process that already holds torch threads
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker, initargs=(workers,)) as pool:
+        pending = deque()
+        for batch in batches:
+            pending.append((batch, pool.submit(embed_texts, [chunk["text"] for chunk in batch])))
+            # Keep at most two batches per worker in flight
+            if len(pending) >= workers * 2:
+                batch, future = pending.popleft()
+                vectors = future.result()
+                report(batch)
+                yield batch, vectors
+        while pending:
+            batch, future = pending.popleft()
+            vectors = future.result()
+            report(batch)
+            yield batch, vectors
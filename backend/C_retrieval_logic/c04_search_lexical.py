@@ -0,0 +1,146 @@
+import re
+from collections import Counter
+from typing import Hashable, Iterable
+
+import numpy as np
+from utils.logger import logger
+from utils.config import BM25_K1, BM25_B, RRF_K
+from backend.C_retrieval_logic.c04_search_vectors import top_k_rows
+
+# Identifier-friendly tokens: keeps "requirements.txt", "git-init", "src/app.py" whole
+TOKEN_RE = re.compile(r"\w[\w.\-/+]*")
+SPLIT_RE = re.compile(r"[.\-/+]+")
+
+# First words of natural-language questions (never treated as exact commands)
+QUESTION_WORDS = {
+    "how", "what", "why", "when", "where", "which", "who",
+    "can", "could", "should", "do", "does", "is", "are", "explain", "tell",
+}
+
+def tokenize(text: str) -> list[str]:
+    """
+    Lowercases and splits text into terms. Compound identifiers are kept whole
+    and also split into parts, so "requirements.txt" matches both exactly and by "requirements".
+    """
+    tokens = []
+    for token in TOKEN_RE.findall(text.lower()):
+        token = token.rstrip(".-/+")
+        tokens.append(token)
+        if SPLIT_RE.search(token):
+            tokens.extend(part for part in SPLIT_RE.split(token) if part)
+    return tokens
+
+def looks_like_command(query: str) -> bool:
+    """
+    True for short, non-question queries such as "git init" or "py -m venv .venv".
+    """
+    words = query.strip().strip("`").split()
+    return 0 < len(words) <= 6 and "?" not in query and words[0].lower() not in QUESTION_WORDS
+
+def contains_phrase(text: str, query: str) -> bool:
+    phrase = " ".join(query.strip().strip("`").lower().split())
+    return len(phrase) >= 3 and phrase in " ".join(text.lower().split())
+
+def reciprocal_rank_fusion(rankings: Iterable[Iterable[Hashable]], k: int = RRF_K) -> list[tuple[Hashable, float]]:
+    """
+    Fuses several rankings (best first) into one: each item scores sum(1 / (k + rank)).
+
+    Returns:
+        list[tuple[Hashable, float]]: Items with fused scores, best first.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda pair: pair[1], reverse=True)
+
+class BM25Index:
+    """
+    BM25 inverted index stored as compact postings arrays (CSR layout):
+    the postings of term t are rows offsets[t]:offsets[t+1] of `doc_ids` and
+    `weights`. Weights hold the precomputed BM25 contribution of each
+    (term, doc) pair, so a query is a few array slices and one bincount.
+    """
+
+    def __init__(self, terms, offsets, doc_ids, weights, num_docs, params):
+        self.terms = terms
+        self.vocab = {term: term_id for term_id, term in enumerate(terms)}
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.weights = weights
+        self.num_docs = num_docs
+        self.params = params
+
+    def __len__(self) -> int:
+        return self.num_docs
+
+    @classmethod
+    def build(cls, texts: list[str], k1: float = BM25_K1, b: float = BM25_B) -> "BM25Index":
+        vocab = {}
+        term_ids, doc_ids, tfs = [], [], []
+        doc_lens = np.zeros(len(texts), dtype=np.float32)
+        for doc, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            doc_lens[doc] = sum(counts.values())
+            for term, tf in counts.items():
+                term_ids.append(vocab.setdefault(term, len(vocab)))
+                doc_ids.append(doc)
+                tfs.append(tf)
+
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        order = np.argsort(term_ids, kind="stable")
+        term_ids = term_ids[order]
+        doc_ids = np.asarray(doc_ids, dtype=np.int32)[order]
+        tfs = np.asarray(tfs, dtype=np.float32)[order]
+
+        df = np.bincount(term_ids, minlength=len(vocab))
+        # Offsets from the int64 counts: float32 sums lose exactness past 2^24 postings
+        offsets = np.concatenate(([0], np.cumsum(df))).astype(np.int64)
+        df = df.astype(np.float32)
+        idf = np.log(1.0 + (len(texts) - df + 0.5) / (df + 0.5))
+        avgdl = float(doc_lens.mean()) if len(texts) else 1.0
+        norm = k1 * (1.0 - b + b * doc_lens[doc_ids] / max(avgdl, 1e-9))
+        weights = (idf[term_ids] * tfs * (k1 + 1.0) / (tfs + norm)).astype(np.float32)
+
+        terms = np.asarray(list(vocab), dtype=str)
+        logger.info(f"Built BM25 index: {len(terms)} terms, {len(doc_ids)} postings, {len(texts)} chunks.")
+        return cls(terms, offsets, doc_ids, weights, len(texts), np.asarray([k1, b], dtype=np.float32))
+
+    def save(self, path: str) -> None:
+        # Uncompressed .npz so the arrays load without a decompression pass
+        with open(path, "wb") as file:
+            np.savez(
+                file,
+                terms=self.terms,
+                offsets=self.offsets,
+                doc_ids=self.doc_ids,
+                weights=self.weights,
+                num_docs=np.asarray(self.num_docs),
+                params=self.params,
+            )
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        with np.load(path) as data:
+            return cls(
+                data["terms"],
+                data["offsets"],
+                data["doc_ids"],
+                data["weights"],
+                int(data["num_docs"]),
+                data["params"],
+            )
+
+    def search(self, query: str, top_k: int) -> tuple[np.ndarray, np.ndarray]:
+        term_ids = [self.vocab[term] for term in tokenize(query) if term in self.vocab]
+        if not term_ids:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+        slices = [slice(self.offsets[t], self.offsets[t + 1]) for t in term_ids]
+        rows = np.concatenate([self.doc_ids[s] for s in slices])
+        weights = np.concatenate([self.weights[s] for s in slices])
+        # Only touch documents that contain a query term
+        docs, inverse = np.unique(rows, return_inverse=True)
+        scores = np.bincount(inverse, weights=weights).astype(np.float32)
+        top = top_k_rows(scores, top_k)
+        return docs[top].astype(np.int64), scores[top]
@@ -1,6 +1,200 @@
+from typing import Callable
+
+import numpy as np
 from utils.logger import logger
+from utils.config import VECTOR_METRIC, HYBRID_CANDIDATES
+from backend.C_retrieval_logic.c03_embed_chunks import embed_query
+from backend.utils.metrics import span
+
+METRICS = ("cosine", "dot", "l2")
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+def top_k_rows(scores: np.ndarray, top_k: int) -> np.ndarray:
+    k = min(top_k, len(scores))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+class VectorIndex:
+    """
+    Exact top-k search over one contiguous float32 matrix.
+
+    Rows are pre-normalized for cosine, so every query is a single
+    matrix-vector product followed by argpartition. Scores are "higher is
+    better" for all metrics (L2 returns the negative squared distance).
+    """
+
+    def __init__(self, embeddings: np.ndarray, metric: str = "cosine"):
+        if metric not in METRICS:
+            raise ValueError(f"Unsupported metric: {metric}")
+        matrix = np.ascontiguousarray(embeddings, dtype=np.float32)
+        if metric == "cosine":
+            matrix = normalize_rows(matrix)
+        self.metric = metric
+        self.matrix = matrix
+        # Squared row norms let L2 ranking reuse the same matrix-vector product
+        self.sq_norms = np.einsum("ij,ij->i", matrix, matrix) if metric == "l2" else None
+
+    def __len__(self) -> int:
+        return self.matrix.shape[0]
+
+    def search(self, query_vector: np.ndarray, top_k: int) -> tuple[np.ndarray, np.ndarray]:
+        query = np.asarray(query_vector, dtype=np.float32).ravel()
+        if self.metric == "cosine":
+            query = normalize_rows(query)
+
+        scores = self.matrix @ query
+        if self.metric == "l2":
+            # -||m - q||^2 = 2 m.q - ||m||^2 - ||q||^2
+            scores = 2.0 * scores - self.sq_norms - float(query @ query)
+
+        top = top_k_rows(scores, top_k)
+        return top, scores[top]
+
+    def search_batch(self, query_vectors: np.ndarray, top_k: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Searches many queries with one matrix-matrix product.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: (rows, scores), each shaped (num_queries, k), best first.
+        """
+        queries = np.atleast_2d(np.asarray(query_vectors, dtype=np.float32))
+        if self.metric == "cosine":
+            queries = normalize_rows(queries)
+
+        scores = queries @ self.matrix.T
+        if self.metric == "l2":
+            scores = 2.0 * scores - self.sq_norms - np.einsum("ij,ij->i", queries, queries)[:, None]
+
+        k = min(top_k, scores.shape[1])
+        if k <= 0:
+            empty = np.zeros((len(queries), 0))
+            return empty.astype(np.int64), empty.astype(np.float32)
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+# Last index built, reused while the same embedding matrix is passed in
+_cached = {"embeddings": None, "metric": None, "index": None}
+
+def get_vector_index(embeddings: np.ndarray, metric: str = VECTOR_METRIC) -> VectorIndex:
+    if _cached["embeddings"] is not embeddings or _cached["metric"] != metric:
+        logger.info(f"Building {metric} vector index over {len(embeddings)} chunks...")
+        _cached.update(embeddings=embeddings, metric=metric, index=VectorIndex(embeddings, metric))
+    return _cached["index"]
+
+def search_batch(index, query_vectors: np.ndarray, top_k: int) -> list[tuple[np.ndarray, np.ndarray]]:
+    """
+    Probes any index with many queries: one matrix search when the index
+    supports it (exact, HNSW), one probe per query otherwise (IVF).
+
+    Returns:
+        list[tuple[np.ndarray, np.ndarray]]: (rows, scores) per query, in input order.
+    """
+    with span("search", queries=len(query_vectors)):
+        if hasattr(index, "search_batch"):
+            rows, scores = index.search_batch(query_vectors, top_k)
+            return list(zip(rows, scores))
+        return [index.search(query_vector, top_k) for query_vector in query_vectors]
+
+def search_vectors(
+    query: str,
+    embedded_chunks: list[dict],
+    top_k: int = 3,
+    embeddings: np.ndarray | None = None,
+    metric: str = VECTOR_METRIC,
+    index=None,
+    query_vector: np.ndarray | None = None,
+    embed_fn: Callable[[str], np.ndarray] = embed_query,
+) -> list[dict]:
+    if not embedded_chunks:
+        return []
+    if query_vector is None:
+        query_vector = embed_fn(query)
+    if index is None:
+        if embeddings is None:
+            embeddings = np.asarray([chunk["embedding"] for chunk in embedded_chunks], dtype=np.float32)
+        index = get_vector_index(embeddings, metric)
+
+    with span("search", queries=1) as counts:
+        rows, scores = index.search(query_vector, top_k)
+        counts["results"] = len(rows)
+    logger.info(f"Vector search ({index.metric}) returned {len(rows)} of {len(index)} chunks.")
+    return [
+        {**embedded_chunks[row], "row": int(row), "score": float(score)}
+        for row, score in zip(rows, scores)
+    ]
+
+def search_hybrid(
+    query: str,
+    indexed_chunks: list[dict],
+    index,
+    lexical_index,
+    top_k: int = 3,
+    query_vector: np.ndarray | None = None,
+    embed_fn: Callable[[str], np.ndarray] = embed_query,
+    vector_rows: np.ndarray | None = None,
+) -> list[dict]:
+    """
+    Fuses vector search and BM25 search with reciprocal rank fusion.
+
+    Short command-like queries (e.g. "git init") whose exact text appears in
+    a top BM25 hit are answered from the lexical index alone, without
+    embedding the query.
+
+    Args:
+        query (str): The user's question.
+        indexed_chunks (list[dict]): Chunks, one per index row.
+        index: Vector index (VectorIndex / IVFIndex / HNSWIndex).
+        lexical_index (BM25Index): BM25 index over the same rows.
+        top_k (int): Number of chunks to return.
+        query_vector (np.ndarray | None): Query embedding, if already computed.
+        embed_fn (Callable): Embeds the query when query_vector is None.
+        vector_rows (np.ndarray | None): Vector hits, if already probed (batch queries).
+
+    Returns:
+        list[dict]: Chunks with their index "row" and a fused "score", best first.
+    """
+    from backend.C_retrieval_logic.c04_search_lexical import (
+        contains_phrase,
+        looks_like_command,
+        reciprocal_rank_fusion,
+    )
+
+    if not indexed_chunks:
+        return []
+    candidates = top_k * HYBRID_CANDIDATES
+    with span("search_lexical", queries=1) as counts:
+        lexical_rows, lexical_scores = lexical_index.search(query, candidates)
+        counts["results"] = len(lexical_rows)
+
+    if looks_like_command(query):
+        exact = [
+            (row, score) for row, score in zip(lexical_rows, lexical_scores)
+            if contains_phrase(indexed_chunks[row]["text"], query)
+        ]
+        if exact:
+            logger.info("Exact lexical match for command query; skipping the embedding.")
+            return [
+                {**indexed_chunks[row], "row": int(row), "score": float(score)}
+                for row, score in exact[:top_k]
+            ]
+
+    if vector_rows is None:
+        if query_vector is None:
+            query_vector = embed_fn(query)
+        with span("search", queries=1) as counts:
+            vector_rows, _ = index.search(query_vector, candidates)
+            counts["results"] = len(vector_rows)
 
-def search_vectors(query: str, embedded_chunks: list[dict], top_k: int = 3) -> list[dict]:
-    logger.info("Running placeholder vector search...")
-    # Replace with real similarity search later
-    return embedded_chunks[:top_k]
+    fused = reciprocal_rank_fusion([vector_rows.tolist(), lexical_rows.tolist()])[:top_k]
+    logger.info(
+        f"Hybrid search fused {len(vector_rows)} vector and {len(lexical_rows)} lexical hits "
+        f"into {len(fused)} chunks."
+    )
+    return [{**indexed_chunks[row], "row": int(row), "score": score} for row, score in fused]
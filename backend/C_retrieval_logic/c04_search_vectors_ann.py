@@ -0,0 +1,324 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+from utils.logger import logger
+from utils.config import (
+    VECTOR_DB,
+    VECTOR_METRIC,
+    ANN_NLIST,
+    ANN_NPROBE,
+    HNSW_M,
+    HNSW_EF_CONSTRUCTION,
+    HNSW_EF,
+)
+from backend.C_retrieval_logic.c04_search_vectors import METRICS, normalize_rows, top_k_rows
+
+# Persisted next to chroma_store so both indexes live in the storage layer
+ANN_INDEX_DIRECTORY = os.path.abspath("backend/D_storage_layer/ann_index")
+ANN_META_PATH = os.path.join(ANN_INDEX_DIRECTORY, "meta.json")
+
+# VECTOR_DB values served by an approximate index (anything else uses exact search)
+ANN_BACKENDS = ("ivf", "hnsw")
+
+# Rows scored per block while assigning vectors to IVF lists
+_ASSIGN_BLOCK = 65536
+
+# Index files carry a tag (corpus version + settings), like the corpus index's embeddings-{version}.npy
+_ANN_FILE_PREFIXES = ("ivf_", "hnsw")
+
+def _ann_path(directory: str, name: str, tag: str) -> str:
+    stem, extension = os.path.splitext(name)
+    return os.path.join(directory, f"{stem}-{tag}{extension}")
+
+def _replace_with(path: str, write) -> None:
+    # Write a temp file, then swap it in: workers still mapping the old file keep reading it intact
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+def _save_array(path: str, array: np.ndarray) -> None:
+    def write(tmp_path):
+        with open(tmp_path, "wb") as file:
+            np.save(file, array)
+
+    _replace_with(path, write)
+
+def _scores(matrix: np.ndarray, query: np.ndarray, metric: str, sq_norms: np.ndarray | None = None) -> np.ndarray:
+    scores = matrix @ query
+    if metric == "l2":
+        # Ranking-equivalent to -||m - q||^2 (the ||q||^2 term is constant per query)
+        scores = 2.0 * scores - sq_norms
+    return scores
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray, metric: str) -> np.ndarray:
+    sq_norms = np.einsum("ij,ij->i", centroids, centroids) if metric == "l2" else None
+    assign = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), _ASSIGN_BLOCK):
+        block = np.asarray(vectors[start:start + _ASSIGN_BLOCK], dtype=np.float32)
+        scores = block @ centroids.T
+        if metric == "l2":
+            scores = 2.0 * scores - sq_norms
+        assign[start:start + len(block)] = np.argmax(scores, axis=1)
+    return assign
+
+def _kmeans(vectors: np.ndarray, nlist: int, metric: str, iterations: int = 20, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    # Train on a bounded sample, like faiss does (~256 points per list)
+    sample_size = min(len(vectors), nlist * 256)
+    sample = np.asarray(vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))])
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+
+    for _ in range(iterations):
+        assign = _assign(sample, centroids, metric)
+        counts = np.bincount(assign, minlength=nlist)
+        order = np.argsort(assign, kind="stable")
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        filled = counts > 0
+        sums = np.add.reduceat(sample[order], starts[filled], axis=0)
+        centroids[filled] = sums / counts[filled, None]
+        # Re-seed empty lists with random sample points
+        empty = np.flatnonzero(~filled)
+        if len(empty):
+            centroids[empty] = sample[rng.choice(len(sample), len(empty), replace=False)]
+        if metric == "cosine":
+            centroids = normalize_rows(centroids)
+    return centroids.astype(np.float32)
+
+class IVFIndex:
+    """
+    Inverted-file index: vectors are clustered into `nlist` lists and a query
+    only scores the `nprobe` closest lists. Each list is stored as one
+    contiguous block of rows so the arrays can be memory-mapped from disk.
+    """
+
+    def __init__(self, metric, centroids, list_offsets, list_ids, vectors, sq_norms=None, nprobe=ANN_NPROBE):
+        self.metric = metric
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_ids = list_ids
+        self.vectors = vectors
+        self.sq_norms = sq_norms
+        self.nprobe = nprobe
+        self.centroid_sq_norms = np.einsum("ij,ij->i", centroids, centroids) if metric == "l2" else None
+
+    def __len__(self) -> int:
+        return len(self.list_ids)
+
+    @classmethod
+    def build(cls, embeddings: np.ndarray, metric: str = VECTOR_METRIC, nlist: int = ANN_NLIST) -> "IVFIndex":
+        vectors = np.ascontiguousarray(embeddings, dtype=np.float32)
+        if metric == "cosine":
+            vectors = normalize_rows(vectors)
+        if nlist <= 0:
+            nlist = max(1, int(4 * np.sqrt(len(vectors))))
+        nlist = min(nlist, len(vectors))
+
+        centroids = _kmeans(vectors, nlist, metric)
+        assign = _assign(vectors, centroids, metric)
+        order = np.argsort(assign, kind="stable")
+        list_offsets = np.concatenate(([0], np.cumsum(np.bincount(assign, minlength=nlist)))).astype(np.int64)
+        vectors = vectors[order]
+        sq_norms = np.einsum("ij,ij->i", vectors, vectors) if metric == "l2" else None
+        return cls(metric, centroids, list_offsets, order.astype(np.int64), vectors, sq_norms)
+
+    def save(self, directory: str, tag: str) -> None:
+        _save_array(_ann_path(directory, "ivf_centroids.npy", tag), self.centroids)
+        _save_array(_ann_path(directory, "ivf_list_offsets.npy", tag), self.list_offsets)
+        _save_array(_ann_path(directory, "ivf_list_ids.npy", tag), self.list_ids)
+        _save_array(_ann_path(directory, "ivf_vectors.npy", tag), self.vectors)
+        if self.sq_norms is not None:
+            _save_array(_ann_path(directory, "ivf_sq_norms.npy", tag), self.sq_norms)
+
+    @classmethod
+    def load(cls, directory: str, metric: str, tag: str) -> "IVFIndex":
+        def load_array(name, mmap_mode="r"):
+            return np.load(_ann_path(directory, name, tag), mmap_mode=mmap_mode)
+
+        return cls(
+            metric,
+            load_array("ivf_centroids.npy", None),
+            load_array("ivf_list_offsets.npy", None),
+            load_array("ivf_list_ids.npy"),
+            load_array("ivf_vectors.npy"),
+            load_array("ivf_sq_norms.npy") if metric == "l2" else None,
+        )
+
+    def search(self, query_vector: np.ndarray, top_k: int, nprobe: int | None = None) -> tuple[np.ndarray, np.ndarray]:
+        query = np.asarray(query_vector, dtype=np.float32).ravel()
+        if self.metric == "cosine":
+            query = normalize_rows(query)
+
+        centroid_scores = _scores(self.centroids, query, self.metric, self.centroid_sq_norms)
+        probe = top_k_rows(centroid_scores, nprobe or self.nprobe)
+
+        rows, scores = [], []
+        for list_no in probe:
+            start, end = self.list_offsets[list_no], self.list_offsets[list_no + 1]
+            if start == end:
+                continue
+            sq = self.sq_norms[start:end] if self.sq_norms is not None else None
+            scores.append(_scores(self.vectors[start:end], query, self.metric, sq))
+            rows.append(np.arange(start, end))
+        if not rows:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+        rows, scores = np.concatenate(rows), np.concatenate(scores)
+        if self.metric == "l2":
+            scores = scores - float(query @ query)
+        top = top_k_rows(scores, top_k)
+        return np.asarray(self.list_ids[rows[top]]), scores[top]
+
+class HNSWIndex:
+    """
+    Graph index backed by the optional `hnswlib` package.
+    M sets graph degree (memory/recall), ef sets the search breadth (speed/recall).
+    """
+
+    _SPACES = {"cosine": "cosine", "dot": "ip", "l2": "l2"}
+
+    def __init__(self, metric, index, size):
+        self.metric = metric
+        self.index = index
+        self.size = size
+        self.index.set_ef(HNSW_EF)
+
+    def __len__(self) -> int:
+        return self.size
+
+    @classmethod
+    def build(cls, embeddings: np.ndarray, metric: str = VECTOR_METRIC) -> "HNSWIndex":
+        import hnswlib
+
+        vectors = np.ascontiguousarray(embeddings, dtype=np.float32)
+        index = hnswlib.Index(space=cls._SPACES[metric], dim=vectors.shape[1])
+        index.init_index(max_elements=len(vectors), M=HNSW_M, ef_construction=HNSW_EF_CONSTRUCTION)
+        index.add_items(vectors, np.arange(len(vectors)))
+        return cls(metric, index, len(vectors))
+
+    def save(self, directory: str, tag: str) -> None:
+        _replace_with(_ann_path(directory, "hnsw.bin", tag), self.index.save_index)
+
+    @classmethod
+    def load(cls, directory: str, metric: str, tag: str, dim: int, size: int) -> "HNSWIndex":
+        import hnswlib
+
+        index = hnswlib.Index(space=cls._SPACES[metric], dim=dim)
+        index.load_index(_ann_path(directory, "hnsw.bin", tag), max_elements=size)
+        return cls(metric, index, size)
+
+    def search(self, query_vector: np.ndarray, top_k: int) -> tuple[np.ndarray, np.ndarray]:
+        k = min(top_k, self.size)
+        if k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        self.index.set_ef(max(HNSW_EF, k))
+        labels, distances = self.index.knn_query(np.asarray(query_vector, dtype=np.float32), k=k)
+        # hnswlib returns distances; convert to "higher is better" scores
+        scores = -distances[0] if self.metric == "l2" else 1.0 - distances[0]
+        return labels[0].astype(np.int64), scores.astype(np.float32)
+
+    def search_batch(self, query_vectors: np.ndarray, top_k: int) -> tuple[np.ndarray, np.ndarray]:
+        k = min(top_k, self.size)
+        queries = np.atleast_2d(np.asarray(query_vectors, dtype=np.float32))
+        if k <= 0:
+            empty = np.zeros((len(queries), 0))
+            return empty.astype(np.int64), empty.astype(np.float32)
+        self.index.set_ef(max(HNSW_EF, k))
+        labels, distances = self.index.knn_query(queries, k=k)
+        scores = -distances if self.metric == "l2" else 1.0 - distances
+        return labels.astype(np.int64), scores.astype(np.float32)
+
+def _params(backend: str) -> dict:
+    if backend == "ivf":
+        return {"nlist": ANN_NLIST}
+    return {"M": HNSW_M, "ef_construction": HNSW_EF_CONSTRUCTION}
+
+def _tag(version: str, backend: str, metric: str) -> str:
+    # A rebuild with other settings never overwrites files a worker may have mapped
+    settings = json.dumps([backend, metric, _params(backend)], sort_keys=True)
+    return f"{version}-{hashlib.sha256(settings.encode('utf-8')).hexdigest()[:8]}"
+
+def build_ann_index(embeddings: np.ndarray, version: str, backend: str = VECTOR_DB, metric: str = VECTOR_METRIC):
+    """
+    Builds the configured ANN index from stored embeddings and persists it.
+
+    Args:
+        embeddings (np.ndarray): Corpus embedding matrix (one row per chunk).
+        version (str): Corpus index version the ANN index is built from.
+        backend (str): "ivf" or "hnsw".
+        metric (str): One of METRICS.
+
+    Returns:
+        IVFIndex | HNSWIndex: The freshly built index.
+    """
+    if backend not in ANN_BACKENDS:
+        raise ValueError(f"Unsupported ANN backend: {backend}")
+    if metric not in METRICS:
+        raise ValueError(f"Unsupported metric: {metric}")
+
+    logger.info(f"Building {backend} index over {len(embeddings)} vectors...")
+    index = IVFIndex.build(embeddings, metric) if backend == "ivf" else HNSWIndex.build(embeddings, metric)
+
+    tag = _tag(version, backend, metric)
+    os.makedirs(ANN_INDEX_DIRECTORY, exist_ok=True)
+    index.save(ANN_INDEX_DIRECTORY, tag)
+    meta = {
+        "backend": backend,
+        "version": version,
+        "tag": tag,
+        "metric": metric,
+        "dim": int(embeddings.shape[1]),
+        "size": len(embeddings),
+        "params": _params(backend),
+    }
+
+    def write_meta(tmp_path):
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(meta, file)
+
+    # Meta last, so readers never pair it with files from another build
+    _replace_with(ANN_META_PATH, write_meta)
+
+    # Remove files from older builds (workers still mapping them keep their copy until they reload)
+    for name in os.listdir(ANN_INDEX_DIRECTORY):
+        if name.startswith(_ANN_FILE_PREFIXES) and f"-{tag}." not in name and not name.endswith(".tmp"):
+            os.remove(os.path.join(ANN_INDEX_DIRECTORY, name))
+    logger.info(f"Saved {backend} index to {ANN_INDEX_DIRECTORY}")
+    return index
+
+def _read_ann_meta(version: str, backend: str, metric: str) -> dict | None:
+    # The saved meta, if it describes an index for this version and these settings
+    if not os.path.exists(ANN_META_PATH):
+        return None
+    with open(ANN_META_PATH, "r", encoding="utf-8") as file:
+        meta = json.load(file)
+    return meta if meta.get("tag") == _tag(version, backend, metric) else None
+
+def has_ann_index(version: str, backend: str = VECTOR_DB, metric: str = VECTOR_METRIC) -> bool:
+    """
+    True when a persisted ANN index matches this corpus version and the current settings.
+    """
+    return _read_ann_meta(version, backend, metric) is not None
+
+def load_ann_index(
+    embeddings: np.ndarray,
+    version: str,
+    backend: str = VECTOR_DB,
+    metric: str = VECTOR_METRIC,
+    build_missing: bool = True,
+):
+    """
+    Loads the persisted ANN index (memory-mapped where possible), rebuilding it
+    when it was built from another corpus version or with other settings
+    (or returning None then, if `build_missing` is False).
+    """
+    meta = _read_ann_meta(version, backend, metric)
+    if meta is not None:
+        logger.info(f"Loading {backend} index from {ANN_INDEX_DIRECTORY}")
+        if backend == "ivf":
+            return IVFIndex.load(ANN_INDEX_DIRECTORY, metric, meta["tag"])
+        return HNSWIndex.load(ANN_INDEX_DIRECTORY, metric, meta["tag"], meta["dim"], meta["size"])
+    if not build_missing:
+        return None
+    return build_ann_index(embeddings, version, backend, metric)
@@ -0,0 +1,271 @@
+"""
+Quantized Vector Search (float16 / int8 / binary + full-precision rescoring)
+File: backend/C_retrieval_logic/c04_search_vectors_quantized.py
+
+Exact search keeps a normalized float32 copy of every embedding in memory
+and reads all of it on every query. This index keeps compressed codes instead:
+
+- float16: half precision (2x smaller).
+- int8: per-dimension scalar quantization, x ~= code * scale (4x smaller).
+- binary: one sign bit per dimension around the corpus mean, compared by
+  Hamming distance (32x smaller).
+
+A query scores the compressed codes, keeps `rescore_factor` candidates per
+requested result, and rescores only those rows at full precision, read from
+the float32 corpus embeddings (memory-mapped from disk by the corpus index).
+Scores match VectorIndex, so it is a drop-in replacement for exact search.
+
+Codes are never copied to float32 as a whole: they are widened a few hundred
+rows at a time into a small per-thread buffer that stays in the CPU cache,
+so each search reads the codes once plus the candidate rows. float16 is
+widened with integer bit shifts (exact, and much faster than numpy's
+float16 cast), but numpy has no half-precision product, so int8 is the
+faster of the two.
+
+`measure_recall()` compares the results with exact search on pseudo-queries,
+so the recall cost of each encoding is measured, not assumed.
+"""
+
+import threading
+
+import numpy as np
+from utils.logger import logger
+from backend.C_retrieval_logic.c04_search_vectors import METRICS, normalize_rows, top_k_rows
+
+QUANTIZATIONS = ("float16", "int8", "binary")
+
+# Rows encoded at a time while building the index
+_ENCODE_BLOCK = 65536
+
+# float32 values in the per-thread decode buffer (1 MB, cache-sized)
+_DECODE_FLOATS = 262144
+
+# Largest score matrix (queries x rows) built at once; bigger batches are split
+_MAX_SCORE_FLOATS = 1 << 24
+
+# float16 bits shifted into a float32 read 2^-112 times the value; the query carries the 2^112
+_HALF_BIAS = np.float32(2.0 ** 112)
+# Keeps the sign bit and the 5-bit exponent + mantissa after the shift
+_HALF_MASK = np.int32(-0x70000001)  # 0x8FFFFFFF
+
+# Set bits in each byte value (Hamming distance of packed sign bits, numpy < 2.0)
+_POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint16)
+
+
+def _hamming(codes: np.ndarray, bits: np.ndarray) -> np.ndarray:
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(codes ^ bits).sum(axis=1, dtype=np.int32)
+    return _POPCOUNT[codes ^ bits].sum(axis=1, dtype=np.int32)
+
+
+class QuantizedIndex:
+    """
+    Top-k search over compressed vectors, rescored at full precision.
+    """
+
+    def __init__(self, embeddings: np.ndarray, metric: str = "cosine", encoding: str = "int8", rescore_factor: int = 10):
+        if metric not in METRICS:
+            raise ValueError(f"Unsupported metric: {metric}")
+        if encoding not in QUANTIZATIONS:
+            raise ValueError(f"Unsupported quantization: {encoding}")
+        self.metric = metric
+        self.encoding = encoding
+        self.rescore_factor = max(1, rescore_factor)
+        self.embeddings = embeddings  # full precision, only candidate rows are read
+        self.dim = embeddings.shape[1]
+        self.scale = None
+        self.mean = None
+        self.sq_norms = None
+        self._buffers = threading.local()
+
+        self._fit(embeddings)
+        codes, sq_norms = [], []
+        for start in range(0, len(embeddings), _ENCODE_BLOCK):
+            block = self._prepare(embeddings[start:start + _ENCODE_BLOCK])
+            codes.append(self._encode(block))
+            sq_norms.append(np.einsum("ij,ij->i", block, block))
+        self.codes = np.concatenate(codes) if codes else self._encode(np.zeros((0, self.dim), dtype=np.float32))
+        if metric == "l2" and encoding != "binary":
+            # Exact norms keep L2 ranking a single product with the decoded codes
+            self.sq_norms = np.concatenate(sq_norms) if sq_norms else np.zeros(0, dtype=np.float32)
+
+        full_bytes = len(embeddings) * self.dim * 4
+        self.stats = {
+            "encoding": encoding,
+            "rows": len(embeddings),
+            "index_bytes": self.nbytes,
+            "float32_bytes": full_bytes,
+            "compression": round(full_bytes / max(self.nbytes, 1), 1),
+            "search_bytes_at_10": self.search_bytes(10),
+        }
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    @property
+    def nbytes(self) -> int:
+        aux = sum(a.nbytes for a in (self.scale, self.mean, self.sq_norms) if a is not None)
+        return self.codes.nbytes + aux
+
+    def search_bytes(self, top_k: int) -> int:
+        """
+        Bytes read by one search: every code, plus the full-precision candidate rows.
+        """
+        candidates = min(top_k * self.rescore_factor, len(self))
+        return self.nbytes + candidates * self.dim * 4
+
+    def search(self, query_vector: np.ndarray, top_k: int) -> tuple[np.ndarray, np.ndarray]:
+        rows, scores = self.search_batch(np.asarray(query_vector, dtype=np.float32).reshape(1, -1), top_k)
+        return rows[0], scores[0]
+
+    def search_batch(self, query_vectors: np.ndarray, top_k: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns:
+            tuple[np.ndarray, np.ndarray]: (rows, scores), each shaped (num_queries, k), best first.
+        """
+        queries = self._prepare(np.atleast_2d(query_vectors))
+        k = min(top_k, len(self))
+        if k <= 0:
+            empty = np.zeros((len(queries), 0))
+            return empty.astype(np.int64), empty.astype(np.float32)
+
+        candidates = min(k * self.rescore_factor, len(self))
+        rows = np.empty((len(queries), k), dtype=np.int64)
+        scores = np.empty((len(queries), k), dtype=np.float32)
+        for start, stop in self._query_batches(len(queries)):
+            approx = self._approximate_scores(queries[start:stop])
+            top = np.argpartition(-approx, candidates - 1, axis=1)[:, :candidates]
+            for i, candidate_rows in enumerate(top, start):
+                rows[i], scores[i] = self._rescore(queries[i], np.sort(candidate_rows), k)
+        return rows, scores
+
+    def measure_recall(self, top_k: int = 10, samples: int = 100, seed: int = 0) -> dict:
+        """
+        Recall@k against exact search, on pseudo-queries (the mean of two
+        random corpus vectors), before and after full-precision rescoring.
+        """
+        if len(self) < 2 or samples <= 0:
+            return {}
+        rng = np.random.default_rng(seed)
+        pairs = np.sort(rng.integers(0, len(self), size=(min(samples, len(self)), 2)), axis=0)
+        queries = (np.asarray(self.embeddings[pairs[:, 0]], dtype=np.float32)
+                   + np.asarray(self.embeddings[pairs[:, 1]], dtype=np.float32)) / 2
+        k = min(top_k, len(self))
+
+        prepared = self._prepare(queries)
+        exact = np.empty((len(queries), k), dtype=np.int64)
+        compressed = np.empty((len(queries), k), dtype=np.int64)
+        for start, stop in self._query_batches(len(queries)):
+            exact[start:stop] = np.argpartition(-self._exact_scores(prepared[start:stop]), k - 1, axis=1)[:, :k]
+            approx = self._approximate_scores(prepared[start:stop])
+            compressed[start:stop] = np.argpartition(-approx, k - 1, axis=1)[:, :k]
+        rescored, _ = self.search_batch(queries, k)
+
+        def recall(found):
+            return float(np.mean([len(set(a) & set(b)) / k for a, b in zip(found, exact)]))
+
+        result = {
+            f"recall_at_{k}_compressed": round(recall(compressed), 4),
+            f"recall_at_{k}": round(recall(rescored), 4),
+        }
+        result["recall_delta"] = round(result[f"recall_at_{k}"] - 1.0, 4)
+        self.stats.update(result)
+        logger.info(
+            f"{self.encoding} vector index: {self.nbytes / 1024:.0f} KB vs {self.stats['float32_bytes'] / 1024:.0f} KB "
+            f"float32 ({self.stats['compression']}x smaller); recall@{k} {result[f'recall_at_{k}_compressed']:.3f} "
+            f"compressed, {result[f'recall_at_{k}']:.3f} after rescoring (delta {result['recall_delta']:+.4f})."
+        )
+        return result
+
+    # ----- internals -----
+
+    def _prepare(self, vectors: np.ndarray) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        return normalize_rows(vectors) if self.metric == "cosine" else vectors
+
+    def _fit(self, embeddings: np.ndarray):
+        # int8 scales and binary thresholds come from a bounded sample (every row for small corpora)
+        rng = np.random.default_rng(0)
+        size = min(len(embeddings), _ENCODE_BLOCK)
+        sample = self._prepare(embeddings[np.sort(rng.choice(len(embeddings), size, replace=False))])
+        if not len(sample):
+            sample = np.zeros((1, self.dim), dtype=np.float32)
+        if self.encoding == "int8":
+            # Symmetric per-dimension scale; outliers beyond the sample are clipped
+            self.scale = np.maximum(np.abs(sample).max(axis=0), 1e-12).astype(np.float32) / 127.0
+        elif self.encoding == "binary":
+            self.mean = sample.mean(axis=0).astype(np.float32)
+
+    def _encode(self, block: np.ndarray) -> np.ndarray:
+        if self.encoding == "float16":
+            return block.astype(np.float16)
+        if self.encoding == "int8":
+            return np.clip(np.rint(block / self.scale), -127, 127).astype(np.int8)
+        return np.packbits(block > self.mean, axis=1)
+
+    def _query_batches(self, num_queries: int):
+        # Caps the (queries x rows) score matrix for large batches (e.g. recall checks)
+        step = max(1, _MAX_SCORE_FLOATS // max(len(self), 1))
+        for start in range(0, num_queries, step):
+            yield start, min(start + step, num_queries)
+
+    def _decode_buffer(self) -> np.ndarray:
+        # Per thread, so concurrent searches never share it
+        buffer = getattr(self._buffers, "value", None)
+        if buffer is None:
+            rows = max(1, _DECODE_FLOATS // self.dim)
+            buffer = self._buffers.value = np.empty((rows, self.dim), dtype=np.float32)
+        return buffer
+
+    def _approximate_scores(self, queries: np.ndarray) -> np.ndarray:
+        # (num_queries, rows); higher is better
+        if self.encoding == "binary":
+            query_bits = np.packbits(queries > self.mean, axis=1)
+            return np.stack([-_hamming(self.codes, bits) for bits in query_bits])
+
+        if self.encoding == "int8":
+            weights = queries * self.scale
+        else:
+            weights = queries * _HALF_BIAS
+        weights = np.ascontiguousarray(weights.T, dtype=np.float32)
+        buffer = self._decode_buffer()
+        scores = np.empty((len(self), len(queries)), dtype=np.float32)
+        for start in range(0, len(self), len(buffer)):
+            codes = self.codes[start:start + len(buffer)]
+            block = buffer[:len(codes)]
+            if self.encoding == "int8":
+                np.copyto(block, codes, casting="unsafe")
+            else:
+                # Sign-extended half bits << 13 line up sign, exponent and mantissa with float32
+                bits = block.view(np.int32)
+                np.left_shift(codes.view(np.int16), 13, out=bits, dtype=np.int32)
+                np.bitwise_and(bits, _HALF_MASK, out=bits)
+            np.matmul(block, weights, out=scores[start:start + len(codes)])
+        scores = np.ascontiguousarray(scores.T)
+        if self.metric == "l2":
+            scores = 2.0 * scores - self.sq_norms
+        return scores
+
+    def _full_scores(self, query: np.ndarray, vectors: np.ndarray) -> np.ndarray:
+        vectors = self._prepare(vectors)
+        if self.metric == "l2":
+            diff = vectors - query
+            return -np.einsum("ij,ij->i", diff, diff)
+        return vectors @ query
+
+    def _rescore(self, query: np.ndarray, candidate_rows: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        # Sorted rows read the memory-mapped embeddings front to back
+        scores = self._full_scores(query, self.embeddings[candidate_rows])
+        best = top_k_rows(scores, k)
+        return candidate_rows[best], scores[best]
+
+    def _exact_scores(self, queries: np.ndarray) -> np.ndarray:
+        # Each block is prepared once and scored against every query
+        scores = np.empty((len(queries), len(self)), dtype=np.float32)
+        for start in range(0, len(self), _ENCODE_BLOCK):
+            block = self._prepare(self.embeddings[start:start + _ENCODE_BLOCK])
+            products = queries @ block.T
+            if self.metric == "l2":
+                products = 2.0 * products - np.einsum("ij,ij->i", block, block)
+            scores[:, start:start + len(block)] = products
+        return scores
@@ -1,5 +1,122 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
 from utils.logger import logger
+from utils.config import (
+    RERANK_ENABLED,
+    RERANK_MODEL,
+    RERANK_TOP_K,
+    RERANK_BUDGET_MS,
+    RERANK_CACHE_SIZE,
+)
+from backend.utils.lazy import lazy_component, start_warm_up
+from backend.utils.metrics import span
+
+def load_reranker():
+    from sentence_transformers import CrossEncoder
+    return CrossEncoder(RERANK_MODEL, device="cpu")
+
+# Registered only when enabled, so /ready does not wait for an unused model
+reranker = lazy_component("reranker", load_reranker) if RERANK_ENABLED else None
+
+# (query hash, chunk hash) -> cross-encoder score, least recently used first
+_score_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+# Moving average of scoring cost per (query, chunk) pair, in milliseconds
+_cost = {"ms_per_pair": None}
+
+# Background load of the model, started by the first request that needs it
+_warm_up = {"started": False}
+_warm_up_lock = threading.Lock()
+
+def _hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+def _chunk_key(chunk: dict) -> str:
+    return chunk.get("id") or _hash(f"{chunk.get('source', '')}\n{chunk['text']}")
+
+def _score_pairs(query: str, chunks: list[dict], counts: dict) -> list[float] | None:
+    """
+    Returns cross-encoder scores for every chunk, scoring uncached pairs in
+    one batch, or None when that would exceed the latency budget.
+    Score cache hits are added to `counts["cache_hits"]`.
+    """
+    query_key = _hash(query)
+    keys = [(query_key, _chunk_key(chunk)) for chunk in chunks]
+    with _cache_lock:
+        scores = {key: _score_cache[key] for key in keys if key in _score_cache}
+        for key in scores:
+            _score_cache.move_to_end(key)
+
+    missing = [i for i, key in enumerate(keys) if key not in scores]
+    counts["cache_hits"] += len(scores)
+    if missing:
+        estimate = _cost["ms_per_pair"]
+        if estimate is not None and estimate * len(missing) > RERANK_BUDGET_MS:
+            logger.warning(
+                f"Re-ranking {len(missing)} pairs would take ~{estimate * len(missing):.0f} ms "
+                f"(budget {RERANK_BUDGET_MS} ms). Keeping first-stage order."
+            )
+            # Decay the estimate so one slow batch does not disable re-ranking for good
+            _cost["ms_per_pair"] = estimate * 0.9
+            return None
+
+        started = time.perf_counter()
+        pairs = [(query, chunks[i]["text"]) for i in missing]
+        new_scores = reranker.get().predict(pairs, batch_size=len(pairs), show_progress_bar=False)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        per_pair = elapsed_ms / len(missing)
+        _cost["ms_per_pair"] = per_pair if estimate is None else 0.8 * estimate + 0.2 * per_pair
+        logger.info(f"Cross-encoder scored {len(missing)} pairs in {elapsed_ms:.0f} ms.")
+
+        with _cache_lock:
+            for i, score in zip(missing, new_scores):
+                scores[keys[i]] = float(score)
+                _score_cache[keys[i]] = float(score)
+            while len(_score_cache) > RERANK_CACHE_SIZE:
+                _score_cache.popitem(last=False)
+
+    return [scores[key] for key in keys]
+
+def rank_chunks(chunks: list[dict], query: str | None = None, top_k: int | None = RERANK_TOP_K) -> list[dict]:
+    """
+    Re-ranks first-stage candidates with a cross-encoder and keeps the top_k.
+
+    Falls back to the first-stage order when re-ranking is disabled, no query
+    is given, the model is not loaded yet (it then loads in the background),
+    or scoring would exceed RERANK_BUDGET_MS.
+
+    Args:
+        chunks (list[dict]): Candidates from vector / hybrid search, best first.
+        query (str | None): The user's question.
+        top_k (int | None): Number of chunks to keep (None = all).
+
+    Returns:
+        list[dict]: The best chunks, best first ("rerank_score" added when re-ranked).
+    """
+    if reranker is None or not query or len(chunks) <= 1:
+        return chunks[:top_k]
+    if not reranker.loaded:
+        logger.info("Re-ranker not loaded yet. Keeping first-stage order.")
+        with _warm_up_lock:
+            start = not _warm_up["started"]
+            _warm_up["started"] = True
+        # Once per process: not per request while it loads, nor again after a failed load
+        if start:
+            start_warm_up(["reranker"])
+        return chunks[:top_k]
+
+    try:
+        with span("rank", candidates=len(chunks), cache_hits=0) as counts:
+            scores = _score_pairs(query, chunks, counts)
+    except Exception as e:
+        logger.error(f"Re-ranking failed ({e}). Keeping first-stage order.")
+        return chunks[:top_k]
+    if scores is None:
+        return chunks[:top_k]
 
-def rank_chunks(chunks: list[dict]) -> list[dict]:
-    logger.info("Ranking placeholder chunks...")
-    return chunks  # Placeholder: no change
+    order = sorted(range(len(chunks)), key=lambda i: scores[i], reverse=True)
+    return [{**chunks[i], "rerank_score": scores[i]} for i in order][:top_k]
@@ -1,6 +1,17 @@
 # File: backend/D_storage_layer/chroma_loader.py
+import hashlib
 import os
-from backend.D_storage_layer.chroma_store import store_chunks
+from backend.C_retrieval_logic.c02_chunk_text import chunker_signature, iter_chunks
+from backend.C_retrieval_logic.c03_embed_chunks import iter_embedded_batches
+from backend.D_storage_layer.chroma_store import (
+    chunk_id,
+    get_collection,
+    delete_chunks,
+    load_manifest,
+    save_manifest,
+    store_chunks,
+)
+from backend.utils.config import EMBED_BATCH_SIZE, EMBED_WORKERS
 from backend.utils.logger import logger
 
 # Path to the local clone of pro-analytics-01 repo
@@ -18,41 +29,67 @@ def get_markdown_files():
     logger.info(f"Found {len(md_files)} markdown files.")
     return md_files
 
-def chunk_markdown(file_path):
+def load_and_store(batch_size: int = EMBED_BATCH_SIZE, workers: int = EMBED_WORKERS) -> int:
     """
-    Chunk markdown content by headers or paragraphs.
-    """
-    with open(file_path, "r", encoding="utf-8") as file:
-        content = file.read()
-    
-    # Split by two new lines as a rough chunking strategy
-    chunks = content.split("\n\n")
-    
-    # Create a chunk list
-    chunk_data = []
-    for idx, chunk in enumerate(chunks):
-        if len(chunk.strip()) > 20:  # Avoid storing very tiny fragments
-            chunk_data.append({
-                "text": chunk.strip(),
-                "source": file_path
-            })
-    
-    logger.info(f"Chunked {file_path} into {len(chunk_data)} parts.")
-    return chunk_data
-
-def load_and_store():
-    """
-    Loads markdown files, chunks them, and stores them in ChromaDB.
+    Incrementally syncs the markdown files into ChromaDB.
+
+    - Files whose content hash matches the manifest are skipped entirely.
+    - In changed files, only chunks with new content ids are embedded (in batches)
+      and upserted; chunks whose text vanished are deleted.
+    - Chunks of files that no longer exist are deleted.
+
+    Args:
+        batch_size (int): Chunks embedded and added to Chroma per batch.
+        workers (int): Embedding worker processes (0 or 1 = in-process).
+
+    Returns:
+        int: Number of chunks embedded and upserted.
     """
-    all_chunks = []
-    markdown_files = get_markdown_files()
-    
-    for md_file in markdown_files:
-        chunks = chunk_markdown(md_file)
-        all_chunks.extend(chunks)
-    
-    if all_chunks:
-        store_chunks(all_chunks)
-        logger.info(f"Successfully stored {len(all_chunks)} chunks into ChromaDB.")
-    else:
-        logger.warning("WARNING: No chunks found to store.")
+    manifest = load_manifest()
+    legacy = manifest is None and get_collection().count() > 0
+    sources = manifest["sources"] if manifest else {}
+    # Files chunked with other settings are re-chunked even if unchanged
+    same_chunker = bool(manifest) and manifest.get("chunker") == chunker_signature()
+    updated = {}
+
+    def iter_changed_chunks():
+        for md_file in get_markdown_files():
+            with open(md_file, "r", encoding="utf-8") as file:
+                content = file.read()
+            digest = hashlib.sha256(content.encode("utf-8")).hexdigest()
+            entry = sources.get(md_file)
+            if same_chunker and entry and entry["sha256"] == digest:
+                updated[md_file] = entry
+                continue
+
+            old_ids = set(entry["ids"]) if entry else set()
+            ids = []
+            for chunk in iter_chunks(md_file, content):
+                chunk["id"] = chunk_id(chunk["source"], chunk["text"])
+                ids.append(chunk["id"])
+                if chunk["id"] not in old_ids:
+                    yield chunk
+            updated[md_file] = {"sha256": digest, "ids": list(dict.fromkeys(ids))}
+            logger.info(f"Chunked {md_file} into {len(ids)} parts.")
+
+    total = 0
+    for batch, vectors in iter_embedded_batches(iter_changed_chunks(), batch_size, workers):
+        store_chunks(batch, embeddings=vectors, verify=False)
+        total += len(batch)
+
+    # Delete chunks whose text vanished, and chunks of removed files
+    stale = set()
+    for source, entry in sources.items():
+        stale.update(set(entry["ids"]) - set(updated.get(source, {}).get("ids", [])))
+    if legacy:
+        # First run on a collection indexed with positional ids: drop them once
+        current = {doc_id for entry in updated.values() for doc_id in entry["ids"]}
+        stale.update(set(get_collection().get(include=[])["ids"]) - current)
+    delete_chunks(sorted(stale))
+    save_manifest({"chunker": chunker_signature(), "sources": updated})
+
+    logger.info(
+        f"ChromaDB sync complete: {total} chunks upserted, {len(stale)} deleted, "
+        f"{get_collection().count()} in collection."
+    )
+    return total
@@ -2,44 +2,156 @@
 # ==========================================================
 # Centralized ChromaDB Logic for storage and retrieval
 # - Stores embeddings and metadata
+# - Uses content-addressed chunk ids and a manifest of indexed files
 # - Handles local retrieval for high-confidence matches
 # ==========================================================
 
+import hashlib
+import json
 import os
-import chromadb
-from chromadb.config import Settings
+from backend.C_retrieval_logic.c04_search_lexical import (
+    contains_phrase,
+    looks_like_command,
+    reciprocal_rank_fusion,
+)
+from backend.utils.config import CHROMA_DEBUG_DUMP, RETRIEVAL_MODE
+from backend.utils.lazy import lazy_component
 from backend.utils.logger import logger
+from backend.utils.metrics import span
 
 # Get absolute path
 CHROMA_PERSIST_DIRECTORY = os.path.abspath("backend/D_storage_layer/chroma_store")
-print(f"ChromaDB is using persist directory: {CHROMA_PERSIST_DIRECTORY}")
-
-# Ensure the directory exists
-if not os.path.exists(CHROMA_PERSIST_DIRECTORY):
-    print(f"Directory {CHROMA_PERSIST_DIRECTORY} not found. Creating it now.")
-    os.makedirs(CHROMA_PERSIST_DIRECTORY)
-else:
-    print(f"Directory {CHROMA_PERSIST_DIRECTORY} already exists.")
-
-# Initialize ChromaDB Client
-client = chromadb.PersistentClient(
-    path=CHROMA_PERSIST_DIRECTORY
-)
 
-# Get or create the collection
-collection = client.get_or_create_collection(name="project-docs")
+
+def load_collection():
+    import chromadb
+
+    print(f"ChromaDB is using persist directory: {CHROMA_PERSIST_DIRECTORY}")
+
+    # Ensure the directory exists
+    if not os.path.exists(CHROMA_PERSIST_DIRECTORY):
+        print(f"Directory {CHROMA_PERSIST_DIRECTORY} not found. Creating it now.")
+        os.makedirs(CHROMA_PERSIST_DIRECTORY)
+    else:
+        print(f"Directory {CHROMA_PERSIST_DIRECTORY} already exists.")
+
+    # Initialize ChromaDB Client
+    client = chromadb.PersistentClient(
+        path=CHROMA_PERSIST_DIRECTORY
+    )
+
+    # Get or create the collection
+    return client.get_or_create_collection(name="project-docs")
+
+
+# Client and collection are opened on first use, not at import time
+chroma = lazy_component("chroma", load_collection)
+
+
+def get_collection():
+    return chroma.get()
 
 # Confidence threshold for high-quality matches
 CONFIDENCE_THRESHOLD = 0.75
 
-def store_chunks(chunks: list[dict]):
+# Manifest of what is indexed: source file -> content hash and chunk ids
+MANIFEST_PATH = os.path.join(CHROMA_PERSIST_DIRECTORY, "index_manifest.json")
+
+# Ids per delete call (keeps SQLite statements small)
+DELETE_BATCH_SIZE = 5000
+
+# Cheap collection stats, refreshed on writes instead of on every query
+STATS_SAMPLE_SIZE = 5
+_stats = {"count": None, "sample": [], "manifest_mtime": None}
+
+
+def _manifest_mtime():
+    return os.path.getmtime(MANIFEST_PATH) if os.path.exists(MANIFEST_PATH) else None
+
+
+def refresh_stats():
+    """
+    Re-reads the collection count and a small document sample.
+    Called after every write; queries only read the cached values.
+    """
+    _stats["count"] = get_collection().count()
+    _stats["sample"] = get_collection().peek(limit=STATS_SAMPLE_SIZE)["documents"]
+    _stats["manifest_mtime"] = _manifest_mtime()
+
+
+def get_collection_stats() -> dict:
+    """
+    Returns the cached document count and sample.
+    Also picks up writes made by another process (e.g. refresh_chroma.py)
+    by checking the manifest's modification time.
+    """
+    if _stats["count"] is None or _stats["manifest_mtime"] != _manifest_mtime():
+        refresh_stats()
+    return {"count": _stats["count"], "sample": list(_stats["sample"])}
+
+
+def debug_dump_collection(limit: int | None = None):
+    """
+    Logs every stored document with its metadata (opt-in, O(corpus)).
+    Enable per query with CHROMA_DEBUG_DUMP=true, or call directly when debugging.
+    """
+    results = get_collection().get(limit=limit, include=["documents", "metadatas"])
+    logger.debug(f"Dumping {len(results['ids'])} documents from ChromaDB:")
+    for doc_id, doc, meta in zip(results["ids"], results["documents"], results["metadatas"]):
+        logger.debug(f"{doc_id} {meta}: {doc}")
+
+
+def chunk_id(source: str, text: str) -> str:
+    """
+    Returns a stable, content-addressed id for a chunk.
+    Editing one paragraph only changes that paragraph's id.
     """
-    Stores chunks in ChromaDB for later retrieval.
+    return hashlib.sha256(f"{source}\n{text}".encode("utf-8")).hexdigest()[:32]
+
+
+def load_manifest() -> dict | None:
+    """
+    Returns the manifest of indexed sources, or None if nothing was indexed with it yet.
+    """
+    if not os.path.exists(MANIFEST_PATH):
+        return None
+    with open(MANIFEST_PATH, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def save_manifest(manifest: dict):
+    tmp_path = MANIFEST_PATH + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump(manifest, file)
+    os.replace(tmp_path, MANIFEST_PATH)
+
+
+def delete_chunks(ids: list[str]):
+    """
+    Deletes chunks by id (e.g. paragraphs removed from their source file).
+    """
+    ids = list(ids)
+    for start in range(0, len(ids), DELETE_BATCH_SIZE):
+        get_collection().delete(ids=ids[start:start + DELETE_BATCH_SIZE])
+    if ids:
+        logger.info(f"Deleted {len(ids)} stale chunks from ChromaDB.")
+        refresh_stats()
+
+def store_chunks(chunks: list[dict], embeddings=None, verify: bool = True):
+    """
+    Stores (upserts) chunks in ChromaDB for later retrieval.
+
+    Chunk ids are content-addressed (see chunk_id), so storing the same
+    text again updates it in place instead of adding a duplicate.
 
     Args:
         chunks (list[dict]): List of chunk dictionaries to store.
+        embeddings (np.ndarray | None): Precomputed vectors, one row per chunk.
+            If None, Chroma embeds the documents with its default embedding function.
+        verify (bool): Log count and sample-query checks after insertion.
     """
-    print(f"Number of documents in collection: {collection.count()}")
+    if verify:
+        print(f"Number of documents in collection: {get_collection().count()}")
 
     logger.info(f"Storing {len(chunks)} chunks in Chroma...")
 
@@ -47,9 +159,15 @@ def store_chunks(chunks: list[dict]):
     documents = []
     metadatas = []
     ids = []
+    vectors = []
+    seen_ids = set()
 
     for i, chunk in enumerate(chunks):
+        doc_id = chunk.get("id") or chunk_id(chunk["source"], chunk["text"])
+        if doc_id in seen_ids:
+            continue  # Identical text repeated in the same file
         if "pro-analytics-01" in chunk["source"].lower():
+            seen_ids.add(doc_id)
             documents.append(chunk["text"])
             tags = ["pro-analytics-01"]  # Base tag
 
@@ -91,30 +209,30 @@ def store_chunks(chunks: list[dict]):
 
             metadatas.append({
                 "source": chunk["source"],
-                 "tags": ", ".join(tags)
+                 "tags": ", ".join(tags),
+                "heading_path": chunk.get("heading_path", "")
             })
-            ids.append(f"{i}-{chunk['source']}")
-
-    # Add to ChromaDB
-    logger.info(f"Adding {len(documents)} documents to ChromaDB.")
-    existing_ids = set(collection.get()['ids'])
-    new_documents, new_metadatas, new_ids = [], [], []
-
-    for doc, meta, doc_id in zip(documents, metadatas, ids):
-        if doc_id not in existing_ids:
-            new_documents.append(doc)
-            new_metadatas.append(meta)
-            new_ids.append(doc_id)
-
-    if new_documents:
-        collection.add(
-            documents=new_documents,
-            metadatas=new_metadatas,
-            ids=new_ids
-        )
-        
+            ids.append(doc_id)
+            if embeddings is not None:
+                vectors.append(embeddings[i].tolist())
+
+    # Upsert into ChromaDB (no need to fetch existing ids first)
+    logger.info(f"Upserting {len(documents)} documents to ChromaDB.")
+    if documents:
+        with span("chroma_upsert", documents=len(documents)):
+            get_collection().upsert(
+                documents=documents,
+                metadatas=metadatas,
+                ids=ids,
+                embeddings=vectors or None
+            )
+        refresh_stats()
+
+    if not verify:
+        return
+
     # Verification Check
-    current_count = collection.count()
+    current_count = get_collection().count()
     logger.info(f"Number of documents in collection after insertion: {current_count}")
 
     if current_count != len(ids):
@@ -124,33 +242,76 @@ def store_chunks(chunks: list[dict]):
         logger.info(f"{ids[:5]}")
 
     # Additional Verification - Fetch back a sample
-    sample_docs = collection.query(query_texts=["setup"], n_results=2)
-    logger.info(f"Sample query results: {sample_docs}")
+    sample_docs = get_collection().query(query_texts=["setup"], n_results=2)
+    # Log ids and distances only; full documents would flood the log
+    logger.info(f"Sample query results: ids={sample_docs['ids']}, distances={sample_docs['distances']}")
 
 
-def query_chunks(user_input: str, top_k: int = 3) -> list[str]:
+def fuse_lexical(user_input: str, chunks: list[str], top_k: int) -> list[str]:
+    """
+    Merges confident Chroma results with BM25 results over the same documents.
+
+    Results are ordered by reciprocal rank fusion. BM25 hits only count as
+    confident on their own when a command-like query appears in them verbatim.
+    """
+    from backend.D_storage_layer.corpus_index import load_snapshot
+
+    # One snapshot, so BM25 rows index the chunks of the same version
+    snapshot = load_snapshot()
+    indexed_chunks = snapshot.chunks
+    rows, _ = snapshot.lexical_index.search(user_input, top_k)
+    # Same documents as stored in Chroma (see store_chunks)
+    lexical = [
+        indexed_chunks[row]["text"] for row in rows
+        if "pro-analytics-01" in indexed_chunks[row]["source"].lower()
+    ]
+    confident = set(chunks)
+    if looks_like_command(user_input):
+        confident.update(text for text in lexical if contains_phrase(text, user_input))
+
+    fused = [text for text, _ in reciprocal_rank_fusion([chunks, lexical]) if text in confident]
+    return fused[:max(top_k, len(chunks))]
+
+
+def query_chunks(
+    user_input: str,
+    top_k: int = 3,
+    hybrid: bool = RETRIEVAL_MODE == "hybrid",
+    context=None,
+) -> list[str]:
     """
     Queries ChromaDB for relevant chunks based on user input.
 
     Args:
         user_input (str): The user's question or query.
         top_k (int): Number of top results to retrieve.
+        hybrid (bool): Also rank with the BM25 keyword index (reciprocal rank fusion).
+        context (RetrievalContext | None): Per-request retrieval state. When given,
+            its candidates are used instead of a separate Chroma query, so the
+            question is embedded and probed only once per request.
 
     Returns:
         list[str]: High-confidence results if found, empty list otherwise.
     """
-    logger.info(f"Attempting local retrieval for: {user_input}")
+    logger.info(f"Attempting local retrieval for: {user_input[:80]!r}")
 
-    logger.info("Collection Stats:")
-    logger.info(f"Total documents: {collection.count()}")
-    results = collection.get()
-    for idx, doc in enumerate(results['documents'][:5]):
-        logger.info(f"{idx+1}. {doc}")
+    if context is not None:
+        high_confidence_chunks = context.local_matches(top_k, CONFIDENCE_THRESHOLD)
+        if high_confidence_chunks:
+            logger.info(f"Local retrieval successful: Found {len(high_confidence_chunks)} chunks.")
+        else:
+            logger.warning("Local retrieval not sufficient. Proceeding with RAG.")
+        return high_confidence_chunks
 
-    results = collection.query(
-        query_texts=[user_input],
-        n_results=top_k
-    )
+    logger.info(f"Total documents: {get_collection_stats()['count']}")
+    if CHROMA_DEBUG_DUMP:
+        debug_dump_collection()
+
+    with span("chroma_query", queries=1):
+        results = get_collection().query(
+            query_texts=[user_input],
+            n_results=top_k
+        )
     
     # Loop through flattened lists
     high_confidence_chunks = []
@@ -169,6 +330,9 @@ def query_chunks(user_input: str, top_k: int = 3) -> list[str]:
              # Extract string from list
             high_confidence_chunks.append(doc[0]) 
 
+    if hybrid:
+        high_confidence_chunks = fuse_lexical(user_input, high_confidence_chunks, top_k)
+
     if high_confidence_chunks:
         logger.info(f"Local retrieval successful: Found {len(high_confidence_chunks)} chunks.")
         return high_confidence_chunks
@@ -0,0 +1,369 @@
+# File: backend/D_storage_layer/corpus_index.py
+# ==========================================================
+# Persistent Corpus Index (chunks + embeddings)
+# - Built once at startup or by refresh_chroma.py
+# - Stores a content hash per source file and only re-embeds changed files
+# - Serves precomputed vectors to the query path (no corpus encoding per request)
+# - Keeps the ANN index (VECTOR_DB = ivf / hnsw) in sync with the embeddings
+# - Or searches compressed vectors (VECTOR_QUANTIZATION), rescoring from the
+#   memory-mapped float32 matrix
+# - Keeps a BM25 keyword index over the same chunks (hybrid retrieval)
+# - Serves one immutable CorpusSnapshot (chunks, embeddings, search indexes)
+#   per version, swapped in whole, so concurrent requests never mix versions
+# ==========================================================
+
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+
+from backend.C_retrieval_logic.c01_load_files import load_markdown_files
+from backend.C_retrieval_logic.c02_chunk_text import chunk_text, chunker_signature
+from backend.C_retrieval_logic.c03_embed_chunks import embed_texts
+from backend.C_retrieval_logic.c04_search_lexical import BM25Index
+from backend.C_retrieval_logic.c04_search_vectors import VectorIndex
+from backend.C_retrieval_logic.c04_search_vectors_ann import (
+    ANN_BACKENDS,
+    build_ann_index,
+    has_ann_index,
+    load_ann_index,
+)
+from backend.C_retrieval_logic.c04_search_vectors_quantized import QUANTIZATIONS, QuantizedIndex
+from backend.utils.config import (
+    BM25_B,
+    BM25_K1,
+    EMBEDDING_MODEL,
+    VECTOR_DB,
+    VECTOR_METRIC,
+    VECTOR_QUANTIZATION,
+    VECTOR_RECALL_SAMPLES,
+    VECTOR_RESCORE_FACTOR,
+)
+from backend.utils.lazy import lazy_component
+from backend.utils.logger import logger
+
+# Folder holding the manifest and the embedding matrix
+CORPUS_INDEX_DIRECTORY = os.path.abspath("backend/D_storage_layer/corpus_index")
+MANIFEST_PATH = os.path.join(CORPUS_INDEX_DIRECTORY, "manifest.json")
+
+# Raw docs folder indexed by default
+RAW_DOCS_PATH = "backend/D_storage_layer/raw_docs"
+
+# Serializes builds within one process
+_build_lock = threading.Lock()
+
+
+class CorpusSnapshot:
+    """
+    One loaded version of the corpus index: its chunks, their embeddings and
+    the search indexes built over them. Published whole and never changed,
+    so every row id from its indexes points into its own chunks.
+    """
+
+    __slots__ = ("mtime", "version", "chunks", "embeddings", "search_index", "lexical_index")
+
+    def __init__(self, mtime, version, chunks, embeddings, search_index, lexical_index):
+        self.mtime = mtime
+        self.version = version
+        self.chunks = chunks
+        self.embeddings = embeddings
+        self.search_index = search_index
+        self.lexical_index = lexical_index
+
+
+# The published snapshot, replaced (under the lock) when the manifest changes on disk
+_current = {"snapshot": None}
+_snapshot_lock = threading.Lock()
+
+
+def _file_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _read_manifest() -> dict | None:
+    if not os.path.exists(MANIFEST_PATH):
+        return None
+    with open(MANIFEST_PATH, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def _read_embeddings(manifest: dict) -> np.ndarray:
+    path = os.path.join(CORPUS_INDEX_DIRECTORY, manifest["embeddings_file"])
+    return np.load(path, mmap_mode="r")
+
+
+def _lexical_path(version: str) -> str:
+    return os.path.join(CORPUS_INDEX_DIRECTORY, f"bm25-{version}.npz")
+
+
+def _build_lexical_index(chunks: list[dict], version: str) -> BM25Index:
+    index = BM25Index.build([chunk["text"] for chunk in chunks])
+    # Swapped in whole, so a worker loading it never reads a half-written file
+    path = _lexical_path(version)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    index.save(tmp_path)
+    os.replace(tmp_path, path)
+    return index
+
+
+def _load_lexical_file(version: str) -> BM25Index | None:
+    # The saved BM25 index for this version, if it matches the current parameters
+    path = _lexical_path(version)
+    if not os.path.exists(path):
+        return None
+    index = BM25Index.load(path)
+    return index if np.allclose(index.params, [BM25_K1, BM25_B]) else None
+
+
+def _ensure_derived_indexes(manifest: dict, embeddings: np.ndarray):
+    # Builds the persisted indexes this version is missing (e.g. after a settings change)
+    version = manifest["version"]
+    if _load_lexical_file(version) is None:
+        chunks = [chunk for entry in manifest["files"].values() for chunk in entry["chunks"]]
+        _build_lexical_index(chunks, version)
+    if VECTOR_DB in ANN_BACKENDS and embeddings is not None and len(embeddings) and not has_ann_index(version):
+        build_ann_index(np.asarray(embeddings, dtype=np.float32), version)
+
+
+def build_corpus_index(folder: str = RAW_DOCS_PATH) -> int:
+    """
+    Builds or incrementally updates the persistent corpus index.
+
+    Files whose content hash is unchanged keep their stored chunks and vectors;
+    only new or edited files are chunked and embedded again.
+
+    Args:
+        folder (str): Folder of raw markdown documents to index.
+
+    Returns:
+        int: Number of chunks in the index after the update.
+    """
+    with _build_lock:
+        os.makedirs(CORPUS_INDEX_DIRECTORY, exist_ok=True)
+
+        old_manifest = _read_manifest()
+        old_files, old_embeddings = {}, None
+        if (
+            old_manifest
+            and old_manifest.get("embedding_model") == EMBEDDING_MODEL
+            and old_manifest.get("chunker") == chunker_signature()
+        ):
+            old_files = old_manifest["files"]
+            old_embeddings = _read_embeddings(old_manifest)
+
+        new_files = {}
+        blocks = []
+        row = 0
+        changed = 0
+        for path, text in load_markdown_files(folder):
+            digest = _file_hash(text)
+            entry = old_files.get(path)
+            if entry and entry["sha256"] == digest:
+                start, end = entry["rows"]
+                chunks = entry["chunks"]
+                vectors = np.asarray(old_embeddings[start:end], dtype=np.float32)
+            else:
+                chunks = chunk_text(path, text)
+                vectors = embed_texts([chunk["text"] for chunk in chunks])
+                changed += 1
+
+            new_files[path] = {
+                "sha256": digest,
+                "rows": [row, row + len(chunks)],
+                "chunks": chunks,
+            }
+            if chunks:
+                blocks.append(vectors)
+            row += len(chunks)
+
+        removed = len(set(old_files) - set(new_files))
+        if old_manifest and not changed and not removed:
+            _ensure_derived_indexes(old_manifest, old_embeddings)
+            logger.info(f"Corpus index is up to date ({row} chunks).")
+            return row
+
+        # Version changes whenever any file, the embedding model or the chunker changes
+        version = hashlib.sha256(
+            json.dumps(
+                [EMBEDDING_MODEL, chunker_signature()] + [[p, e["sha256"]] for p, e in new_files.items()]
+            ).encode("utf-8")
+        ).hexdigest()[:16]
+
+        embeddings_file = f"embeddings-{version}.npy"
+        embeddings = np.vstack(blocks) if blocks else np.zeros((0, 0), dtype=np.float32)
+        np.save(os.path.join(CORPUS_INDEX_DIRECTORY, embeddings_file), embeddings)
+        # Tokenizing is cheap next to embedding, so BM25 is rebuilt per version
+        _build_lexical_index([c for entry in new_files.values() for c in entry["chunks"]], version)
+        # Before the manifest, so workers that reload it find the ANN index ready
+        if VECTOR_DB in ANN_BACKENDS and len(embeddings):
+            build_ann_index(embeddings, version)
+
+        # Write the manifest last so readers never see a half-built index
+        manifest = {
+            "version": version,
+            "embedding_model": EMBEDDING_MODEL,
+            "chunker": chunker_signature(),
+            "embeddings_file": embeddings_file,
+            "files": new_files,
+        }
+        tmp_path = MANIFEST_PATH + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(manifest, file)
+        os.replace(tmp_path, MANIFEST_PATH)
+
+        # Remove embedding and BM25 files from older versions
+        current = {embeddings_file, os.path.basename(_lexical_path(version))}
+        for name in os.listdir(CORPUS_INDEX_DIRECTORY):
+            if name.startswith(("embeddings-", "bm25-")) and name not in current:
+                os.remove(os.path.join(CORPUS_INDEX_DIRECTORY, name))
+
+        logger.info(
+            f"Corpus index updated: {changed} files re-embedded, {removed} removed, "
+            f"{row} chunks total."
+        )
+        return row
+
+
+def _manifest_mtime() -> float | None:
+    try:
+        return os.path.getmtime(MANIFEST_PATH)
+    except FileNotFoundError:
+        return None
+
+
+def _load_search_index(embeddings: np.ndarray, version: str):
+    if not len(embeddings):
+        return VectorIndex(embeddings, VECTOR_METRIC)
+    if VECTOR_DB in ANN_BACKENDS:
+        index = load_ann_index(embeddings, version, build_missing=False)
+        if index is not None:
+            return index
+        logger.warning(f"No {VECTOR_DB} index for corpus {version}; using exact search until the next warm-up.")
+    if VECTOR_QUANTIZATION in QUANTIZATIONS:
+        index = QuantizedIndex(embeddings, VECTOR_METRIC, VECTOR_QUANTIZATION, VECTOR_RESCORE_FACTOR)
+        if VECTOR_RECALL_SAMPLES > 0:
+            # Off the load path: queries are served while recall is measured
+            threading.Thread(
+                target=index.measure_recall,
+                kwargs={"samples": VECTOR_RECALL_SAMPLES},
+                name="recall-check",
+                daemon=True,
+            ).start()
+        return index
+    return VectorIndex(embeddings, VECTOR_METRIC)
+
+
+def _load_lexical_index(chunks: list[dict], version: str) -> BM25Index:
+    index = _load_lexical_file(version)
+    if index is None:
+        # Only if the saved file was removed or built with other parameters: build
+        # it in memory (tokenizing only) and leave the file to the next warm-up
+        logger.warning(f"No matching BM25 index for corpus {version}; building it in memory.")
+        index = BM25Index.build([chunk["text"] for chunk in chunks])
+    return index
+
+
+def _publish_snapshot() -> CorpusSnapshot:
+    # Loads the version on disk with every search index, once per version
+    with _snapshot_lock:
+        mtime = _manifest_mtime()
+        current = _current["snapshot"]
+        if current is not None and (current.mtime == mtime or mtime is None):
+            return current  # Another thread just loaded it (or the manifest is gone: keep serving)
+        if mtime is None:
+            raise RuntimeError("Corpus index not found. It is built at warm-up or by refresh_chroma.py.")
+
+        manifest = _read_manifest()
+        chunks = [chunk for entry in manifest["files"].values() for chunk in entry["chunks"]]
+        embeddings = _read_embeddings(manifest)
+        snapshot = CorpusSnapshot(
+            mtime,
+            manifest["version"],
+            chunks,
+            embeddings,
+            _load_search_index(embeddings, manifest["version"]),
+            _load_lexical_index(chunks, manifest["version"]),
+        )
+        _current["snapshot"] = snapshot
+        logger.info(f"Loaded corpus index {snapshot.version} with {len(chunks)} chunks.")
+        return snapshot
+
+
+def load_snapshot() -> CorpusSnapshot:
+    """
+    Returns the current corpus snapshot. Take one per request and read
+    everything from it, so all rows come from the same version.
+
+    The first call waits for the warm-up (which builds any missing index);
+    later calls only reload, without building, when the manifest on disk
+    changes (e.g. after refresh_chroma.py).
+    """
+    snapshot = _current["snapshot"]
+    if snapshot is None:
+        corpus_index.get()
+        snapshot = _current["snapshot"]
+    if _manifest_mtime() != snapshot.mtime:
+        snapshot = _publish_snapshot()
+    return snapshot
+
+
+def load_corpus_index() -> tuple[list[dict], np.ndarray]:
+    """
+    Returns the indexed chunks and their embedding matrix (memory-mapped), from one snapshot.
+
+    Returns:
+        tuple[list[dict], np.ndarray]: Chunk dicts and a float32 matrix with one row per chunk.
+    """
+    snapshot = load_snapshot()
+    return snapshot.chunks, snapshot.embeddings
+
+
+def get_corpus_version() -> str:
+    """
+    Returns the version of the current corpus index; it changes whenever
+    any indexed file (or the embedding model) changes.
+    """
+    return load_snapshot().version
+
+
+def load_search_index():
+    """
+    Returns the search index of the current snapshot, selected by VECTOR_DB:
+    an ANN index (ivf / hnsw) loaded from disk, or exact search otherwise
+    (over compressed vectors if VECTOR_QUANTIZATION is set).
+
+    Returns:
+        VectorIndex | IVFIndex | HNSWIndex | QuantizedIndex: Object with a `search(query_vector, top_k)` method.
+    """
+    return load_snapshot().search_index
+
+
+def search_index_stats() -> dict:
+    """
+    Size and measured recall of the loaded search index ({} if none or not reported).
+    """
+    snapshot = _current["snapshot"]
+    # A copy: the background recall check may still be adding to it
+    return dict(getattr(snapshot and snapshot.search_index, "stats", {}))
+
+
+def load_lexical_index() -> BM25Index:
+    """
+    Returns the BM25 index of the current snapshot (rows match load_corpus_index).
+    """
+    return load_snapshot().lexical_index
+
+
+def warm_corpus_index() -> CorpusSnapshot:
+    """
+    Builds (or updates) the corpus index and any missing search index, then
+    publishes the snapshot that requests read from.
+    """
+    build_corpus_index()
+    return _publish_snapshot()
+
+
+# Reported by the API readiness check and loaded by its background warm-up
+corpus_index = lazy_component("corpus_index", warm_corpus_index)
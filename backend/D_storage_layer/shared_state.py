@@ -0,0 +1,285 @@
+# File: backend/D_storage_layer/shared_state.py
+# ==========================================================
+# Shared State Store (rate-limit counters + cached answers)
+# - Lets several uvicorn workers (or EC2 instances) share one view of
+#   rate limits and cached answers, instead of one copy per process
+# - STATE_BACKEND = memory  → per-process (default, no shared state)
+# - STATE_BACKEND = sqlite  → one SQLite file (WAL + mmap) for a single host
+# - STATE_BACKEND = redis   → any Redis-protocol server (e.g. a local redis-server)
+# - Also registers a "sqlite://" storage for slowapi / limits
+# ==========================================================
+
+import os
+import sqlite3
+import threading
+import time
+
+from backend.utils.config import STATE_BACKEND, STATE_REDIS_URL, STATE_SQLITE_PATH
+from backend.utils.logger import logger
+
+# Namespace for every key written by this app
+KEY_PREFIX = "pro-analytics-ai:"
+
+# Expired SQLite rows are purged after roughly this many writes
+PURGE_EVERY_WRITES = 1000
+
+
+class StateStore:
+    """
+    Key-value store with expiring values and fixed-window counters.
+    """
+
+    def get(self, key: str) -> bytes | None:
+        raise NotImplementedError
+
+    def set(self, key: str, value: bytes, ttl: float | None = None):
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+    def incr(self, key: str, amount: int, expiry: float) -> int:
+        """
+        Adds `amount` to a counter, starting a new window of `expiry` seconds
+        when the counter is missing or expired. Returns the new count.
+        """
+        raise NotImplementedError
+
+    def counter(self, key: str) -> int:
+        raise NotImplementedError
+
+    def expires_at(self, key: str) -> float | None:
+        """
+        Epoch seconds when the key expires (None if missing or never).
+        """
+        raise NotImplementedError
+
+    def clear(self, prefix: str = ""):
+        """
+        Deletes every key starting with `prefix`.
+        """
+        raise NotImplementedError
+
+
+class SQLiteStore(StateStore):
+    """
+    StateStore in one SQLite file, safe across threads and processes on one host.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        self._writes = 0
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS state ("
+                "key TEXT PRIMARY KEY, value BLOB, counter INTEGER NOT NULL DEFAULT 0, expires REAL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per thread; WAL lets readers run while another process writes
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA mmap_size=67108864")
+            self._local.conn = conn
+        return conn
+
+    def _row(self, key: str, column: str):
+        row = self._connect().execute(
+            f"SELECT {column}, expires FROM state WHERE key = ?", (KEY_PREFIX + key,)
+        ).fetchone()
+        if row is None or (row[1] is not None and row[1] <= time.time()):
+            return None
+        return row
+
+    def get(self, key: str) -> bytes | None:
+        row = self._row(key, "value")
+        return None if row is None else row[0]
+
+    def set(self, key: str, value: bytes, ttl: float | None = None):
+        expires = time.time() + ttl if ttl else None
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO state (key, value, expires) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires = excluded.expires",
+                (KEY_PREFIX + key, value, expires),
+            )
+        self._after_write()
+
+    def delete(self, key: str):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM state WHERE key = ?", (KEY_PREFIX + key,))
+
+    def incr(self, key: str, amount: int, expiry: float) -> int:
+        now = time.time()
+        with self._connect() as conn:
+            # The upsert and the read share one write transaction, so concurrent
+            # processes never see or lose each other's increments
+            conn.execute(
+                "INSERT INTO state (key, counter, expires) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET "
+                "counter = CASE WHEN state.expires <= ? THEN excluded.counter ELSE state.counter + excluded.counter END, "
+                "expires = CASE WHEN state.expires <= ? THEN excluded.expires ELSE state.expires END",
+                (KEY_PREFIX + key, amount, now + expiry, now, now),
+            )
+            count = conn.execute("SELECT counter FROM state WHERE key = ?", (KEY_PREFIX + key,)).fetchone()[0]
+        self._after_write()
+        return count
+
+    def counter(self, key: str) -> int:
+        row = self._row(key, "counter")
+        return 0 if row is None else row[0]
+
+    def expires_at(self, key: str) -> float | None:
+        row = self._row(key, "expires")
+        return None if row is None else row[1]
+
+    def clear(self, prefix: str = ""):
+        pattern = (KEY_PREFIX + prefix).replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        with self._connect() as conn:
+            conn.execute("DELETE FROM state WHERE key LIKE ? ESCAPE '\\'", (pattern,))
+
+    def _after_write(self):
+        self._writes += 1
+        if self._writes % PURGE_EVERY_WRITES == 0:
+            with self._connect() as conn:
+                conn.execute("DELETE FROM state WHERE expires IS NOT NULL AND expires <= ?", (time.time(),))
+
+
+class RedisStore(StateStore):
+    """
+    StateStore on a Redis-protocol server (Redis, Valkey, or a local stand-in).
+    """
+
+    def __init__(self, url: str):
+        import redis
+
+        self.url = url
+        self._redis = redis.Redis.from_url(url)
+
+    def get(self, key: str) -> bytes | None:
+        return self._redis.get(KEY_PREFIX + key)
+
+    def set(self, key: str, value: bytes, ttl: float | None = None):
+        self._redis.set(KEY_PREFIX + key, value, px=int(ttl * 1000) if ttl else None)
+
+    def delete(self, key: str):
+        self._redis.delete(KEY_PREFIX + key)
+
+    def incr(self, key: str, amount: int, expiry: float) -> int:
+        # One MULTI/EXEC: open the window (with its expiry) if none is open, then
+        # count, so no other client can see or create a counter without an expiry
+        pipe = self._redis.pipeline(transaction=True)
+        pipe.set(KEY_PREFIX + key, 0, nx=True, px=int(expiry * 1000))
+        pipe.incrby(KEY_PREFIX + key, amount)
+        _, count = pipe.execute()
+        return count
+
+    def counter(self, key: str) -> int:
+        value = self._redis.get(KEY_PREFIX + key)
+        return int(value) if value is not None else 0
+
+    def expires_at(self, key: str) -> float | None:
+        ttl_ms = self._redis.pttl(KEY_PREFIX + key)
+        return time.time() + ttl_ms / 1000 if ttl_ms and ttl_ms > 0 else None
+
+    def clear(self, prefix: str = ""):
+        keys = list(self._redis.scan_iter(match=KEY_PREFIX + prefix + "*", count=500))
+        for start in range(0, len(keys), 500):
+            self._redis.delete(*keys[start:start + 500])
+
+
+_store = {"value": None}
+_store_lock = threading.Lock()
+
+
+def get_state_store() -> StateStore | None:
+    """
+    Returns the shared store selected by STATE_BACKEND (None for "memory").
+    """
+    if STATE_BACKEND == "memory":
+        return None
+    if _store["value"] is None:
+        with _store_lock:
+            if _store["value"] is None:
+                if STATE_BACKEND == "sqlite":
+                    _store["value"] = SQLiteStore(STATE_SQLITE_PATH)
+                elif STATE_BACKEND == "redis":
+                    _store["value"] = RedisStore(STATE_REDIS_URL)
+                else:
+                    raise ValueError(f"Unsupported STATE_BACKEND: {STATE_BACKEND}")
+                logger.info(f"Using {STATE_BACKEND} shared state store.")
+    return _store["value"]
+
+
+def rate_limit_storage_uri() -> str:
+    """
+    Returns the slowapi `storage_uri` for STATE_BACKEND.
+
+    The sqlite storage (SQLiteLimitsStorage) only supports the fixed-window
+    strategy, slowapi's default; the moving-window strategies raise
+    NotImplementedError with it (use redis for those).
+    """
+    if STATE_BACKEND == "sqlite":
+        # Fixed-window rate limits only (see above)
+        return f"sqlite:///{STATE_SQLITE_PATH}"
+    if STATE_BACKEND == "redis":
+        return STATE_REDIS_URL  # Served by the limits package's own Redis storage
+    return "memory://"
+
+
+# ==========================================================
+# "sqlite://" storage for the limits package (used by slowapi)
+# ==========================================================
+
+try:
+    from limits.storage import Storage as _LimitsStorage
+except ImportError:  # slowapi not installed (e.g. offline indexing scripts)
+    _LimitsStorage = None
+
+if _LimitsStorage is not None:
+
+    class SQLiteLimitsStorage(_LimitsStorage):
+        """
+        Rate-limit counters in a SQLiteStore: "sqlite:///relative/path.sqlite3"
+        or "sqlite:////absolute/path.sqlite3". Registered with limits on import.
+        Fixed-window counters only: it does not implement the moving-window API.
+        """
+
+        STORAGE_SCHEME = ["sqlite"]
+
+        def __init__(self, uri: str, wrap_exceptions: bool = False, **options):
+            super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+            self.store = SQLiteStore(uri.split("://", 1)[1][1:])
+
+        @property
+        def base_exceptions(self):
+            return sqlite3.Error
+
+        def incr(self, key: str, expiry: int, elastic_expiry: bool = False, amount: int = 1) -> int:
+            return self.store.incr(f"limit:{key}", amount, expiry)
+
+        def get(self, key: str) -> int:
+            return self.store.counter(f"limit:{key}")
+
+        def get_expiry(self, key: str) -> float:
+            return self.store.expires_at(f"limit:{key}") or time.time()
+
+        def check(self) -> bool:
+            try:
+                self.store.counter("limit:check")
+                return True
+            except sqlite3.Error:
+                return False
+
+        def reset(self) -> int | None:
+            self.store.clear("limit:")
+            return None
+
+        def clear(self, key: str) -> None:
+            self.store.delete(f"limit:{key}")
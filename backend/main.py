@@ -10,12 +10,13 @@ sys.path.append(str(Path(__file__).resolve().parent.parent))
 from utils.logger import logger
 
 from backend.B_prompt_model.b0_pipeline import query
-from C_retrieval_logic.c01_load_files import load_markdown_files
-from C_retrieval_logic.c02_chunk_text import chunk_text
-from C_retrieval_logic.c03_embed_chunks import embed_chunks
-from C_retrieval_logic.c04_search_vectors import search_vectors
-from C_retrieval_logic.c05_rank_chunks import rank_chunks
-from D_storage_layer.chroma_store import collection, store_chunks
+from backend.C_retrieval_logic.c01_load_files import load_markdown_files
+from backend.C_retrieval_logic.c02_chunk_text import chunk_text
+from backend.C_retrieval_logic.c03_embed_chunks import embed_chunks
+from backend.C_retrieval_logic.c04_search_vectors import search_vectors
+from backend.C_retrieval_logic.c05_rank_chunks import rank_chunks
+from backend.D_storage_layer.corpus_index import load_corpus_index
+from backend.D_storage_layer.chroma_store import get_collection, store_chunks
 
 
 def main():
@@ -33,19 +34,21 @@ def main():
     logger.info(f"Total chunks created: {len(all_chunks)}")
 
     # Step 3: Check if already stored in Chroma
-    if collection.count() == 0:
+    if get_collection().count() == 0:
         logger.info("No existing Chroma data. Embedding and storing new chunks...")
         embedded_chunks = embed_chunks(all_chunks)
         store_chunks(embedded_chunks)
     else:
         logger.info("Chroma already contains data. Skipping embedding/storage.")
 
-    # Step 4: Get user query and search
+    # Step 4: Get user query and search the precomputed corpus index
     user_question = "How do I start my Python project?"
-    top_chunks = search_vectors(user_question, all_chunks)
+    indexed_chunks, embeddings = load_corpus_index()
+    top_chunks = search_vectors(user_question, indexed_chunks, embeddings=embeddings)
 
-    # Step 5: Rank results
-    ranked_chunks = rank_chunks(top_chunks)
+    # Step 5: Rank results against the question (as the query pipeline does)
+    ranked_chunks = rank_chunks(top_chunks, user_question)
+    logger.info(f"Top ranked sources: {[chunk['source'] for chunk in ranked_chunks]}")
 
     # Step 6: Call query pipeline (builds prompt + calls LLM)
     response = query(user_question)
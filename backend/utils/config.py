@@ -33,12 +33,159 @@ LLM_PROVIDER = os.getenv("LLM_PROVIDER", "openrouter").lower()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY", "")
 
+# Backends the LLM router may use, in preference order: openrouter, openai, 8bit, 4bit
+# (default: the single backend chosen by QUANT_MODE and LLM_PROVIDER)
+LLM_BACKENDS = [
+    name.strip().lower() for name in os.getenv("LLM_BACKENDS", "").split(",") if name.strip()
+] or [LLM_PROVIDER if QUANT_MODE == "none" else QUANT_MODE]
+
+# The local model mode among LLM_BACKENDS ("none" if no local model is configured)
+LOCAL_QUANT_MODE = next((name for name in LLM_BACKENDS if name in ("8bit", "4bit")), "none")
+
+# Router: per-attempt timeout before failing over, and the error rate (over the
+# last LLM_ROUTER_WINDOW calls) that takes a backend out for a cooldown
+LLM_ROUTER_TIMEOUT_SECONDS = float(os.getenv("LLM_ROUTER_TIMEOUT_SECONDS", "30"))
+LLM_ROUTER_ERROR_THRESHOLD = float(os.getenv("LLM_ROUTER_ERROR_THRESHOLD", "0.5"))
+LLM_ROUTER_COOLDOWN_SECONDS = float(os.getenv("LLM_ROUTER_COOLDOWN_SECONDS", "30"))
+LLM_ROUTER_WINDOW = int(os.getenv("LLM_ROUTER_WINDOW", "50"))
+
 # Local HuggingFace Model Name (only if QUANT_MODE is "8bit" or "4bit")
 MODEL_NAME = os.getenv("MODEL_NAME", "TheBloke/TinyLlama-1.1B-Chat-v1.0-GPTQ")
 
 # Model settings
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
 
+# Hosted provider HTTP client: endpoint override (e.g. a local mock server),
+# timeouts, retries with exponential backoff, and pooled keep-alive connections
+LLM_BASE_URL = os.getenv("LLM_BASE_URL", "")
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "60"))
+LLM_CONNECT_TIMEOUT_SECONDS = float(os.getenv("LLM_CONNECT_TIMEOUT_SECONDS", "5"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_BACKOFF_SECONDS = float(os.getenv("LLM_BACKOFF_SECONDS", "0.5"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+LLM_KEEPALIVE_SECONDS = float(os.getenv("LLM_KEEPALIVE_SECONDS", "30"))
+
+# Hedging: resend requests slower than the recent p95 latency (after this many samples)
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "false").lower() == "true"
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+
+# Batch queries (/query/batch): max questions per request, concurrent API calls,
+# and prompts per batched `generate` call for local models
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "500"))
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "4"))
+LOCAL_BATCH_SIZE = int(os.getenv("LOCAL_BATCH_SIZE", "8"))
+
+# API admission control: concurrent model calls, max queued requests, and the
+# deadline after which queued requests are shed with 503 + Retry-After
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", "8"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "64"))
+ADMISSION_DEADLINE_SECONDS = float(os.getenv("ADMISSION_DEADLINE_SECONDS", "60"))
+
+# Local models: batch concurrent requests in a background worker, waiting at most
+# this many milliseconds for more prompts (batch size is LOCAL_BATCH_SIZE)
+GENERATION_BATCHING = os.getenv("GENERATION_BATCHING", "true").lower() == "true"
+GENERATION_MAX_WAIT_MS = float(os.getenv("GENERATION_MAX_WAIT_MS", "20"))
+
+# Local models: cache the key/values of the GUIDELINES.md prompt prefix once per model
+PREFIX_CACHE_ENABLED = os.getenv("PREFIX_CACHE_ENABLED", "true").lower() == "true"
+
+# Maximum tokens of retrieved context per prompt (also capped by the model's context window)
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "800"))
+
+# Context window (tokens) of the hosted model; 0 looks it up from OPENAI_MODEL
+LLM_CONTEXT_WINDOW = int(os.getenv("LLM_CONTEXT_WINDOW", "0"))
+
 # Embedding settings
 EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
-VECTOR_DB = os.getenv("VECTOR_DB", "chroma")
+
+# Embedding pipeline: chunks per batch, and worker processes (0 or 1 = in-process)
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", "1"))
+
+# Embedding cache: vectors keyed by (model, text hash) in an append-only,
+# memory-mapped file shared by all processes (used for both corpus and queries)
+EMBED_CACHE_ENABLED = os.getenv("EMBED_CACHE_ENABLED", "true").lower() == "true"
+EMBED_CACHE_DIR = os.getenv("EMBED_CACHE_DIR", "backend/D_storage_layer/embedding_cache")
+EMBED_CACHE_MAX_MB = float(os.getenv("EMBED_CACHE_MAX_MB", "512"))
+
+# Vector search backend for the corpus index:
+# - chroma → exact (brute-force) search; Chroma keeps serving local retrieval
+# - ivf    → approximate inverted-file index (numpy, memory-mapped)
+# - hnsw   → approximate graph index (requires hnswlib)
+VECTOR_DB = os.getenv("VECTOR_DB", "chroma").lower()
+
+# Similarity metric for vector search: cosine, dot, or l2
+VECTOR_METRIC = os.getenv("VECTOR_METRIC", "cosine").lower()
+
+# Exact search over compressed vectors (only if VECTOR_DB is "chroma"):
+# none, float16, int8 or binary; candidates per result rescored at full precision
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "none").lower()
+VECTOR_RESCORE_FACTOR = int(os.getenv("VECTOR_RESCORE_FACTOR", "10"))
+# Pseudo-queries for the recall check run in the background after the index loads (0 = off)
+VECTOR_RECALL_SAMPLES = int(os.getenv("VECTOR_RECALL_SAMPLES", "100"))
+
+# Log every Chroma document on each query (debugging only; O(corpus) per request)
+CHROMA_DEBUG_DUMP = os.getenv("CHROMA_DEBUG_DUMP", "false").lower() == "true"
+
+# Retrieval: "hybrid" fuses vector search with a BM25 keyword index, "vector" uses embeddings only
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid").lower()
+# Candidates taken from each ranking per requested chunk before fusion
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "4"))
+# Reciprocal rank fusion constant (higher = flatter fusion)
+RRF_K = int(os.getenv("RRF_K", "60"))
+# BM25 term-frequency saturation and length normalization
+BM25_K1 = float(os.getenv("BM25_K1", "1.5"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+
+# Second-stage re-ranking of retrieved candidates with a small CPU cross-encoder
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "true").lower() == "true"
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+# Candidates passed to the re-ranker, and chunks kept for the prompt
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "10"))
+RERANK_TOP_K = int(os.getenv("RERANK_TOP_K", "3"))
+# Keep first-stage order if scoring would take longer than this
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "200"))
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "10000"))
+
+# Markdown chunking: token budget per chunk (0 = embedding model limit) and overlap
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "0"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "32"))
+
+# Approximate nearest neighbour (ANN) knobs (only if VECTOR_DB is "ivf" or "hnsw")
+# IVF: number of lists (0 = auto, ~4*sqrt(chunks)) and lists probed per query
+ANN_NLIST = int(os.getenv("ANN_NLIST", "0"))
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", "8"))
+# HNSW: graph degree, build-time breadth, and query-time breadth
+HNSW_M = int(os.getenv("HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "200"))
+HNSW_EF = int(os.getenv("HNSW_EF", "64"))
+
+# Answer cache in front of the pipeline (exact + semantic tiers)
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "86400"))
+# Minimum cosine similarity between questions to reuse a cached answer
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95"))
+# Optional file to persist cached answers across restarts (empty = memory only)
+ANSWER_CACHE_PATH = os.getenv("ANSWER_CACHE_PATH", "")
+
+# Coalesce identical in-flight questions into one retrieval + LLM call
+SINGLEFLIGHT_ENABLED = os.getenv("SINGLEFLIGHT_ENABLED", "true").lower() == "true"
+# "question" = same normalized question; "context" = same question and retrieved chunks
+SINGLEFLIGHT_KEY = os.getenv("SINGLEFLIGHT_KEY", "question").lower()
+SINGLEFLIGHT_MAX_WAITERS = int(os.getenv("SINGLEFLIGHT_MAX_WAITERS", "100"))
+SINGLEFLIGHT_TIMEOUT_SECONDS = float(os.getenv("SINGLEFLIGHT_TIMEOUT_SECONDS", "90"))
+
+# Load models and indexes in a background thread when the API starts
+# (false = load each one lazily on its first request)
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "true").lower() == "true"
+
+# Response header carrying each request's trace id (empty = don't return one)
+TRACE_HEADER = os.getenv("TRACE_HEADER", "X-Trace-Id")
+
+# Shared state for multi-worker deployments (rate-limit counters + cached answers)
+# memory = per process, sqlite = one file per host, redis = Redis-protocol server
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory").lower()
+STATE_SQLITE_PATH = os.getenv("STATE_SQLITE_PATH", "backend/D_storage_layer/shared_state.sqlite3")
+STATE_REDIS_URL = os.getenv("STATE_REDIS_URL", "redis://localhost:6379/0")
\ No newline at end of file
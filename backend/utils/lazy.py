@@ -0,0 +1,114 @@
+"""
+Lazy Component Loading
+File: backend/utils/lazy.py
+
+Heavy resources (the LLM, the embedding model, the Chroma client, the corpus
+index) are loaded on first use instead of at import time, so scripts and
+health checks start fast and a broken optional dependency (e.g. AutoGPTQ)
+does not stop the whole app from starting.
+
+Features:
+- Thread-safe singletons: concurrent first calls load the resource only once.
+- A registry of components, so the API can report which ones are loaded.
+- A warm-up helper that loads every component in a background thread.
+"""
+
+# Imports from Python Standard Library
+import threading
+import time
+from typing import Any, Callable
+
+# Imports from local modules
+from backend.utils.logger import logger
+
+
+class LazyComponent:
+    """
+    A resource created by `loader()` on the first call to `get()`.
+    Failed loads are not cached: the error is recorded and the next call retries.
+    """
+
+    def __init__(self, name: str, loader: Callable[[], Any]):
+        self.name = name
+        self._loader = loader
+        self._value = None
+        self._lock = threading.Lock()
+        self.error = None
+        self.load_seconds = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._value is not None
+
+    def get(self) -> Any:
+        if self._value is None:
+            with self._lock:
+                if self._value is None:
+                    started = time.perf_counter()
+                    try:
+                        value = self._loader()
+                    except Exception as e:
+                        self.error = f"{type(e).__name__}: {e}"
+                        logger.error(f"Failed to load {self.name}: {self.error}")
+                        raise
+                    self.load_seconds = time.perf_counter() - started
+                    self.error = None
+                    self._value = value
+                    logger.info(f"Loaded {self.name} in {self.load_seconds:.1f}s")
+        return self._value
+
+
+# All registered components, in registration order
+_components: dict[str, LazyComponent] = {}
+
+
+def lazy_component(name: str, loader: Callable[[], Any]) -> LazyComponent:
+    """
+    Creates and registers a lazily loaded component.
+
+    Args:
+        name (str): Name reported by `component_status()`.
+        loader (Callable): Zero-argument function returning the resource.
+
+    Returns:
+        LazyComponent: Call `.get()` wherever the resource is needed.
+    """
+    component = LazyComponent(name, loader)
+    _components[name] = component
+    return component
+
+
+def component_status() -> dict:
+    """
+    Returns {name: {"loaded", "error", "load_seconds"}} for every component.
+    """
+    return {
+        name: {
+            "loaded": component.loaded,
+            "error": component.error,
+            "load_seconds": None if component.load_seconds is None else round(component.load_seconds, 2),
+        }
+        for name, component in _components.items()
+    }
+
+
+def warm_up(names: list[str] | None = None):
+    """
+    Loads the given components (all by default), logging failures instead of raising.
+    """
+    for name, component in list(_components.items()):
+        if names is not None and name not in names:
+            continue
+        try:
+            component.get()
+        except Exception:
+            pass  # Already logged and reported by component_status()
+
+
+def start_warm_up(names: list[str] | None = None) -> threading.Thread:
+    """
+    Runs `warm_up` in a daemon thread so the caller (e.g. the API server) is not blocked.
+    """
+    thread = threading.Thread(target=warm_up, args=(names,), name="warm-up", daemon=True)
+    thread.start()
+    return thread
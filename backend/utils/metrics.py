@@ -0,0 +1,209 @@
+"""
+Latency Metrics and Request Traces
+File: backend/utils/metrics.py
+
+Every pipeline stage (load, chunk, embed, search, rank, build_prompt,
+call_model, Chroma calls, cache lookups) runs inside a timing span, so a slow
+request can be attributed to retrieval, Chroma, or the LLM.
+
+Features:
+- `span(stage, **counts)`: times a block and records counts such as chunks,
+  prompt tokens or cache hits.
+- Prometheus-style histograms and counters, rendered as text by
+  `render_metrics()` for the API's GET /metrics route.
+- Per-request traces: spans run under `start_trace()` are also collected for
+  that request, so the API can log one line per request with its stage timings.
+"""
+
+# Imports from Python Standard Library
+import contextvars
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Iterator
+
+# Histogram bucket upper bounds, in seconds (from a cache hit to a slow LLM call)
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _label_text(labels: tuple) -> str:
+    return ",".join(f'{name}="{value}"' for name, value in labels)
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram with labels, in the Prometheus text format.
+    """
+
+    def __init__(self, name: str, help_text: str, buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._series = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                labels = _label_text(key)
+                prefix = f"{labels}," if labels else ""
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {count}')
+                lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {series[-1]}')
+                lines.append(f"{self.name}_sum{{{labels}}} {series[-2]:.6f}")
+                lines.append(f"{self.name}_count{{{labels}}} {series[-1]}")
+        return lines
+
+
+class Counter:
+    """
+    Monotonic counter with labels.
+    """
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{{{_label_text(key)}}} {value:g}")
+        return lines
+
+
+STAGE_SECONDS = Histogram("rag_stage_duration_seconds", "Time spent in each pipeline stage.")
+STAGE_ITEMS = Counter("rag_stage_items_total", "Items processed per pipeline stage (chunks, tokens, cache hits, ...).")
+STAGE_ERRORS = Counter("rag_stage_errors_total", "Pipeline stage calls that raised an error.")
+REQUEST_SECONDS = Histogram("rag_request_duration_seconds", "Time until the API response starts, per route.")
+
+_registry = [STAGE_SECONDS, STAGE_ITEMS, STAGE_ERRORS, REQUEST_SECONDS]
+
+# Spans of the current request: (stage, seconds, counts); None outside a trace
+_trace: contextvars.ContextVar = contextvars.ContextVar("trace", default=None)
+_trace_id: contextvars.ContextVar = contextvars.ContextVar("trace_id", default=None)
+
+
+@contextmanager
+def span(stage: str, **counts) -> Iterator[dict]:
+    """
+    Times the enclosed block as one pipeline stage.
+
+    Args:
+        stage (str): Stage name, e.g. "embed" or "call_model".
+        **counts: Initial counts; the yielded dict can be updated inside the block.
+
+    Yields:
+        dict: Counts recorded when the block ends (e.g. counts["chunks"] = 5).
+    """
+    started = time.perf_counter()
+    try:
+        yield counts
+    except BaseException:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        for item, value in counts.items():
+            if value:
+                STAGE_ITEMS.inc(value, stage=stage, item=item)
+        trace = _trace.get()
+        if trace is not None:
+            trace.append((stage, elapsed, dict(counts)))
+
+
+def timed(stage: str) -> Callable:
+    """
+    Decorator running a function (sync or async) inside `span(stage)`.
+    """
+
+    def decorate(fn):
+        import asyncio
+
+        if asyncio.iscoroutinefunction(fn):
+            @wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(stage):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+
+    return decorate
+
+
+def start_trace(trace_id: str | None = None) -> str:
+    """
+    Starts collecting spans for the current request (and threads it starts
+    with asyncio.to_thread). Returns the trace id, generating one if needed.
+    """
+    trace_id = trace_id or uuid.uuid4().hex
+    _trace_id.set(trace_id)
+    _trace.set([])
+    return trace_id
+
+
+def current_trace_id() -> str | None:
+    return _trace_id.get()
+
+
+def trace_summary() -> str:
+    """
+    Formats the current request's spans, e.g. "embed=12ms search=3ms call_model=850ms".
+    """
+    totals = {}
+    for stage, seconds, _ in _trace.get() or []:
+        totals[stage] = totals.get(stage, 0.0) + seconds
+    return " ".join(f"{stage}={seconds * 1000:.0f}ms" for stage, seconds in totals.items())
+
+
+def render_metrics(extra_lines: list[str] | None = None) -> str:
+    """
+    Returns all metrics in the Prometheus text exposition format.
+    """
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    lines.extend(extra_lines or [])
+    return "\n".join(lines) + "\n"
+
+
+def gauge_lines(name: str, help_text: str, samples: list[tuple[dict, float]]) -> list[str]:
+    """
+    Formats point-in-time values (queue depth, health, ...) as one Prometheus gauge.
+
+    Args:
+        samples (list[tuple[dict, float]]): (labels, value) pairs; non-numeric values are skipped.
+    """
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+    for labels, value in samples:
+        if isinstance(value, bool):
+            value = int(value)
+        if isinstance(value, (int, float)):
+            lines.append(f"{name}{{{_label_text(tuple(sorted(labels.items())))}}} {value:g}")
+    return lines
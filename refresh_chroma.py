@@ -1,7 +1,14 @@
 # File: refresh_chroma.py (in root directory)
 import os
-from backend.D_storage_layer.chroma_loader import get_markdown_files, chunk_markdown
-from backend.D_storage_layer.chroma_store import store_chunks
+import sys
+from pathlib import Path
+
+# Ensure backend folder is in sys.path for layer-local imports (utils, C_retrieval_logic)
+sys.path.append(str(Path(__file__).resolve().parent / "backend"))
+
+from backend.B_prompt_model.b0_pipeline_cache import clear_answer_cache
+from backend.D_storage_layer.chroma_loader import load_and_store
+from backend.D_storage_layer.corpus_index import build_corpus_index
 from backend.utils.logger import logger
 
 # Define the path to the raw docs
@@ -10,7 +17,11 @@ PRO_ANALYTICS_PATH = "backend/D_storage_layer/raw_docs/pro-analytics-01"
 
 def refresh_chroma():
     """
-    Rebuilds the ChromaDB index by reloading markdown files and storing fresh chunks.
+    Rebuilds the ChromaDB index by reloading markdown files and storing fresh chunks,
+    then updates the persistent corpus index used by the RAG query path.
+
+    Chunks are embedded and added to Chroma batch by batch
+    (see EMBED_BATCH_SIZE and EMBED_WORKERS in .env).
     """
     if not os.path.exists(PRO_ANALYTICS_PATH):
         logger.error(f"ERROR: Path not found: {PRO_ANALYTICS_PATH}")
@@ -18,18 +29,15 @@ def refresh_chroma():
     
     logger.info("Refreshing ChromaDB with new content...")
     
-    all_chunks = []
-    markdown_files = get_markdown_files()
-    
-    for md_file in markdown_files:
-        chunks = chunk_markdown(md_file)
-        all_chunks.extend(chunks)
-    
-    if all_chunks:
-        store_chunks(all_chunks)
-        logger.info(f"Successfully reinitialized ChromaDB with {len(all_chunks)} chunks.")
-    else:
-        logger.warning("No chunks found to store.")
+    # Only new or edited content is embedded; vanished chunks are deleted
+    load_and_store()
+
+    # Only files whose content hash changed are re-embedded; any missing
+    # ANN / BM25 index is built here, so running servers only load them
+    build_corpus_index()
+
+    # Cached answers may cite the old content
+    clear_answer_cache()
 
 if __name__ == "__main__":
     refresh_chroma()
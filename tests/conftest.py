@@ -0,0 +1,7 @@
+# File: tests/conftest.py
+# Makes the project root and backend/ importable, as the app and scripts do.
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(ROOT), str(ROOT / "backend")]
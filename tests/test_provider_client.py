@@ -0,0 +1,154 @@
+# File: tests/test_provider_client.py
+# ProviderClient (b2_provider_client.py) against httpx.MockTransport and a local server.
+import asyncio
+import http.server
+import json
+import threading
+import time
+
+import httpx
+import pytest
+
+import backend.B_prompt_model.b2_provider_client as provider
+from backend.B_prompt_model.b2_provider_client import ProviderClient, ProviderError
+
+
+def _ok(text: str = "hi") -> httpx.Response:
+    return httpx.Response(200, json={"choices": [{"message": {"content": text}}]})
+
+
+def _client(handler, **kwargs) -> ProviderClient:
+    kwargs.setdefault("backoff_seconds", 0.0)
+    return ProviderClient("http://llm.test/v1", "key", "model", transport=httpx.MockTransport(handler), **kwargs)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    # Records retry sleeps instead of waiting
+    waits = []
+    monkeypatch.setattr(provider.time, "sleep", waits.append)
+    return waits
+
+
+def test_pooled_connection_is_reused():
+    ports = []
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive
+
+        def do_POST(self):
+            ports.append(self.client_address[1])
+            self.rfile.read(int(self.headers["Content-Length"]))
+            body = json.dumps({"choices": [{"message": {"content": "ok"}}]}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = ProviderClient(f"http://127.0.0.1:{server.server_port}/v1", "key", "model")
+    try:
+        assert [client.complete("q") for _ in range(3)] == ["ok"] * 3
+    finally:
+        client.close()
+        server.shutdown()
+    assert len(ports) == 3 and len(set(ports)) == 1
+
+
+def test_retries_server_errors(sleeps):
+    statuses = iter([503, 500, 200])
+
+    def handler(request):
+        status = next(statuses)
+        return _ok("done") if status == 200 else httpx.Response(status)
+
+    client = _client(handler, max_retries=3)
+    assert client.complete("q") == "done"
+    assert client.metrics()["retries"] == 2 and len(sleeps) == 2
+
+
+def test_429_honors_retry_after(sleeps):
+    responses = iter([httpx.Response(429, headers={"Retry-After": "2"}), _ok()])
+    client = _client(lambda request: next(responses), max_retries=1)
+    assert client.complete("q") == "hi"
+    assert sleeps == [2.0]
+
+
+def test_gives_up_after_max_retries(sleeps):
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(502, text="bad gateway")
+
+    client = _client(handler, max_retries=2)
+    with pytest.raises(ProviderError) as error:
+        client.complete("q")
+    assert error.value.status == 502
+    assert len(calls) == 3
+    assert client.metrics()["failures"] == 1
+
+
+def test_hedge_delay_waits_for_enough_samples():
+    client = _client(lambda request: _ok(), hedge=True, hedge_min_samples=3)
+    for _ in range(2):
+        client.complete("q")
+    assert client.hedge_delay() is None
+    client.complete("q")
+    assert client.hedge_delay() is not None
+    assert _client(lambda request: _ok(), hedge=False, hedge_min_samples=0).hedge_delay() is None
+    client.close()
+
+
+def test_hedged_backup_win_is_counted():
+    calls = []
+    lock = threading.Lock()
+
+    def handler(request):
+        with lock:
+            calls.append(request)
+            number = len(calls)
+        if number == 4:
+            time.sleep(0.5)  # The primary of the hedged call stalls
+            return _ok("slow")
+        return _ok("fast")
+
+    client = _client(handler, hedge=True, hedge_min_samples=3)
+    for _ in range(3):
+        client.complete("q")
+    assert client.complete("q") == "fast"
+    stats = client.metrics()
+    assert stats["hedged"] == 1 and stats["hedge_wins"] == 1
+    client.close()
+
+
+def test_acomplete_cancels_losing_request():
+    calls = []
+    cancelled = asyncio.Event()
+
+    async def handler(request):
+        calls.append(request)
+        if len(calls) == 4:
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+        return _ok("fast")
+
+    async def run():
+        client = _client(handler, hedge=True, hedge_min_samples=3)
+        for _ in range(3):
+            await client.acomplete("q")
+        answer = await client.acomplete("q")
+        await asyncio.wait_for(cancelled.wait(), timeout=1)
+        return answer, client.metrics()
+
+    answer, stats = asyncio.run(run())
+    assert answer == "fast"
+    assert stats["hedged"] == 1 and stats["hedge_wins"] == 1
@@ -0,0 +1,81 @@
+# File: tests/test_router.py
+# LLMRouter (b2_router.py) with fake backends.
+import asyncio
+import time
+
+from backend.B_prompt_model.b2_router import MIN_CALLS_FOR_HEALTH, Backend, LLMRouter
+
+
+class FakeBackend(Backend):
+    """
+    Answers with its name after `delay` seconds, or raises while `failing`.
+    """
+
+    def __init__(self, name: str, delay: float = 0.0):
+        self.name = name
+        self.delay = delay
+        self.failing = False
+        self.calls = 0
+
+    def complete(self, prompt: str) -> str:
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.failing:
+            raise RuntimeError(f"{self.name} is down")
+        return self.name
+
+    async def acomplete(self, prompt: str) -> str:
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.failing:
+            raise RuntimeError(f"{self.name} is down")
+        return self.name
+
+
+def test_fastest_healthy_backend_is_chosen():
+    slow, fast = FakeBackend("slow", delay=0.05), FakeBackend("fast")
+    router = LLMRouter([slow, fast])
+    # Untried backends rank first, so each is measured once
+    assert {router.complete("q") for _ in range(2)} == {"slow", "fast"}
+    assert [router.complete("q") for _ in range(5)] == ["fast"] * 5
+    assert [backend.name for backend in router.ranked()] == ["fast", "slow"]
+
+
+def test_timeout_fails_over_mid_request():
+    stuck, healthy = FakeBackend("stuck", delay=1.0), FakeBackend("healthy")
+    router = LLMRouter([stuck, healthy], attempt_timeout=0.1)
+
+    started = time.perf_counter()
+    assert router.complete("q") == "healthy"
+    assert time.perf_counter() - started < 0.5
+    assert asyncio.run(router.acomplete("q")) == "healthy"
+
+    stats = router.metrics()
+    assert stats["stuck"]["failures"] == 1  # Then ranked behind the healthy backend
+    assert stats["healthy"]["failures"] == 0
+
+
+def test_failing_backend_is_marked_unhealthy_then_recovers():
+    flaky, steady = FakeBackend("flaky"), FakeBackend("steady", delay=0.02)
+    router = LLMRouter([flaky, steady], error_threshold=0.5, cooldown_seconds=0.2, window=10)
+    for _ in range(3):
+        router.complete("q")
+    assert router.ranked()[0] is flaky
+
+    # Still the fastest on record, so it is tried (and fails over) until the window trips
+    flaky.failing = True
+    for _ in range(MIN_CALLS_FOR_HEALTH):
+        assert router.complete("q") == "steady"
+    assert router.metrics()["flaky"]["healthy"] is False
+
+    # Skipped while cooling down
+    calls = flaky.calls
+    assert router.complete("q") == "steady"
+    assert flaky.calls == calls
+    assert router.ranked()[-1] is flaky
+
+    # Tried again with a clean window once the cooldown ends
+    flaky.failing = False
+    time.sleep(0.25)
+    assert router.metrics()["flaky"]["healthy"] is True
+    assert router.complete("q") == "flaky"